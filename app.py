@@ -1,12 +1,21 @@
 import streamlit as st
-import pandas as pd
 import tempfile
 import os
+from io import BytesIO
+from pathlib import Path
+
+# pandas, openpyxl, xlrd и скрипты обработки импортируются внутри функций:
+# страница отрисовывается, не дожидаясь их загрузки
 
 # ====== НАСТРОЙКИ ЛОГИНА ======
 USERNAME = "misha"
 PASSWORD = "130206"
 
+# ====== НАСТРОЙКИ ОБРАБОТКИ ======
+WORKERS = 2  # процессов в тёплом пуле (общий для всех сессий)
+SAVE_TO_DB = False  # загружать результаты обработки в базу запросов (история маршрутов); заменяются только загруженные даты
+PREVIEW = True  # сначала показать предпросмотр по первому дню, затем заменить его полным результатом
+
 # ====== ФУНКЦИЯ ПРОВЕРКИ АВТОРИЗАЦИИ ======
 def check_login():
     if "logged_in" not in st.session_state:
@@ -37,7 +46,7 @@ def main():
 
     # Загрузка файлов
     uploaded_files = st.file_uploader(
-        "Загрузите файлы (Выпуск, КСУПТ, ЭП июль и т.д.)",
+        "Загрузите файлы (Выпуск DD.MM.YYYY, Отметки выхода, ЭП июль)",
         type=["xlsx", "xls"],
         accept_multiple_files=True
     )
@@ -49,29 +58,202 @@ def main():
             with st.spinner("Обработка данных..."):
                 # ВРЕМЕННАЯ ПАПКА
                 with tempfile.TemporaryDirectory() as tmpdir:
-                    file_paths = []
                     for file in uploaded_files:
                         file_path = os.path.join(tmpdir, file.name)
                         with open(file_path, "wb") as f:
                             f.write(file.getbuffer())
-                        file_paths.append(file_path)
-
-                    # === ТУТ НАДО ВСТАВИТЬ ВЫЗОВ SCRIPT1, SCRIPT2, SCRIPT3 ===
-                    # Сейчас заглушка: просто сохраняем один пустой Excel
-                    output_path = os.path.join(tmpdir, "ЭП_итог.xlsx")
-                    df = pd.DataFrame({"Сообщение": ["Тут будет результат SCRIPT3"]})
-                    df.to_excel(output_path, index=False)
-
-                    with open(output_path, "rb") as f:
-                        st.success("✅ Обработка завершена!")
-                        st.download_button(
-                            label="📥 Скачать ЭП_итог.xlsx",
-                            data=f,
-                            file_name="ЭП_итог.xlsx",
-                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                        )
+
+                    preview_box = st.empty()
+                    import batch
+                    try:
+                        result = run_pipeline(Path(tmpdir), on_preview=preview_box.container if PREVIEW else None)
+                    except Exception as e:
+                        st.error(f"Ошибка обработки: {e}")
+                        return
+                    preview_box.empty()
+                    # книга и куб забираются в сессию до удаления временной папки:
+                    # скачивание и срезы переживают перезапуск страницы
+                    output_path = result["output"]
+                    st.session_state.result = {
+                        "xlsx": output_path.read_bytes(),
+                        "cube": output_path.with_name(batch.CUBE_NAME).read_bytes(),
+                        "rows": result["rows"],
+                        "preflight_text": result["preflight_text"] if not result["preflight"].empty else "",
+                    }
+
+    if "result" in st.session_state:
+        show_result(st.session_state.result)
+
+def show_result(result: dict):
+    if result["preflight_text"]:
+        st.warning(result["preflight_text"])
+    rows = ", ".join(f"{t}={n}" for t, n in result["rows"].items())
+    st.success("✅ Обработка завершена!")
+    st.caption(f"Строк: {rows}")
+    col_xlsx, col_cube = st.columns(2)
+    col_xlsx.download_button(
+        label="📥 Скачать ЭП_итог.xlsx",
+        data=result["xlsx"],
+        file_name="ЭП_итог.xlsx",
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    )
+    col_cube.download_button(
+        label="📥 Скачать ЭП_куб.parquet",
+        data=result["cube"],
+        file_name="ЭП_куб.parquet",
+        mime="application/octet-stream"
+    )
+
+# ====== ТЁПЛЫЙ ПУЛ ПРОЦЕССОВ ======
+@st.cache_resource(show_spinner=False)
+def get_worker_pool():
+    """
+    Пул поднимается один раз на процесс Streamlit: модули обработки уже импортированы.
+    Справочник ЭП из загруженной папки разбирается при первой обработке и дальше
+    берётся из кеша процесса (batch.load_reference), пока файл не изменится.
+    """
+    import batch
+    return batch.make_worker_pool(WORKERS)
+
+def show_preview(preview: dict):
+    st.info(f"👀 Предпросмотр по файлу {preview['release']} ({', '.join(preview['dates'])}) — "
+            "полная обработка продолжается, результат заменит предпросмотр")
+    rows = preview["rows"]
+    st.caption(f"Строк: выпуск={rows['releases']}, отметки за день={rows['marks']}, "
+               f"КСУПТ за день={rows['kcsupt']}, ЭкспПоказ={rows['exp_pokaz']}")
+    for warning in preview["warnings"]:
+        st.warning(f"Предпросмотр: {warning}")
+    cols = st.columns(len(preview["rates"]))
+    for col, (name, rate) in zip(cols, preview["rates"].items()):
+        col.metric(f"Сопоставлено: {name}", f"{rate:.0%}")
+    st.dataframe(preview["exp_pokaz"], use_container_width=True, hide_index=True)
+
+def run_pipeline(folder: Path, on_preview=None) -> dict:
+    """
+    Предпроверка и полная обработка в тёплом пуле. on_preview — контейнер Streamlit
+    (фабрика), в который, пока идёт полная обработка, выводится быстрый предпросмотр.
+    """
+    from concurrent.futures.process import BrokenProcessPool
+    import batch
+    import preflight
+    db = batch.DB_FILE if SAVE_TO_DB else None
+    # предпроверка в том же тёплом пуле: плохие файлы отсекаются за секунды, до полной обработки
+    report = preflight.run_preflight(preflight.month_tasks(batch.resolve_month_inputs(folder)), pool=get_worker_pool())
+    if preflight.has_errors(report):
+        raise RuntimeError("входные файлы не прошли проверку:\n" + preflight.format_report(report))
+    try:
+        pool = get_worker_pool()
+        # предпросмотр ставится в очередь первым: при одном процессе он не ждёт полной обработки
+        preview = pool.submit(batch.preview_month, folder) if on_preview is not None else None
+        full = pool.submit(batch.process_month, folder, None, db)
+        if preview is not None:
+            try:
+                data = preview.result()
+            except BrokenProcessPool:
+                raise
+            except Exception as e:
+                print(f"[WARN] Предпросмотр не построен: {e}")
+            else:
+                with on_preview():
+                    show_preview(data)
+        result = full.result()
+    except BrokenProcessPool:
+        # процесс пула упал — закрываем старый пул (оставшиеся процессы и задачи), пересоздаём и пробуем ещё раз
+        get_worker_pool().shutdown(wait=False, cancel_futures=True)
+        get_worker_pool.clear()
+        result = get_worker_pool().submit(batch.process_month, folder, None, db).result()
+    return {**result, "preflight": report, "preflight_text": preflight.format_report(report)}
+
+# ====== СРЕЗЫ ПЛАН/ФАКТ ПО КУБУ ======
+@st.cache_data(show_spinner=False)
+def load_cube(data: bytes, name: str):
+    import pandas as pd
+    import cube
+    if name.lower().endswith(".parquet"):
+        return cube.read_cube(BytesIO(data))
+    df = pd.read_excel(BytesIO(data), sheet_name=cube.SOURCE_SHEET)
+    return cube.build_cube(df)
+
+def show_cube_slices():
+    st.header("📈 План / факт: срезы")
+
+    cube_file = st.file_uploader(
+        "Загрузите куб (ЭП_куб.parquet) или ЭП_итог.xlsx с листом ЭкспПоказ — "
+        "без файла показывается куб последней обработки",
+        type=["parquet", "xlsx"],
+        key="cube_file"
+    )
+    if cube_file:
+        data, name = cube_file.getvalue(), cube_file.name
+    elif "result" in st.session_state:
+        data, name = st.session_state.result["cube"], "ЭП_куб.parquet"
+    else:
+        return
+
+    import cube
+    try:
+        df_cube = load_cube(data, name)
+    except Exception as e:
+        st.error(f"Не удалось прочитать куб: {e}")
+        return
+
+    cols = st.columns(len(cube.DIMENSIONS))
+    filters = {}
+    for col, dim in zip(cols, cube.DIMENSIONS):
+        filters[dim] = col.selectbox(dim, [cube.ALL] + cube.dimension_values(df_cube, dim), key=f"cube_{dim}")
+
+    by = st.multiselect(
+        "Разбить по",
+        [d for d in cube.DIMENSIONS if filters[d] == cube.ALL],
+        default=[],
+        key="cube_by"
+    )
+    measures = st.multiselect("Показатели", cube.MEASURES, default=cube.MEASURES[:6], key="cube_measures")
+
+    result = cube.slice_cube(df_cube, filters, by)
+    st.dataframe(result[by + measures + [cube.COUNT_COL]], use_container_width=True, hide_index=True)
+    if by and measures and not result.empty:
+        st.bar_chart(result.set_index(by)[measures])
+
+# ====== ИСТОРИЯ МАРШРУТА ======
+@st.cache_data(ttl=60, show_spinner=False)
+def load_route_history(route: str, date_from, date_to):
+    import query
+    return query.route_history(route, date_from, date_to, db_file=query.DB_FILE)
+
+def show_route_history():
+    st.header("🕒 История маршрута")
+
+    col_route, col_from, col_to = st.columns(3)
+    route = col_route.text_input("Маршрут", key="hist_route")
+    date_from = col_from.date_input("С", value=None, format="DD.MM.YYYY", key="hist_from")
+    date_to = col_to.date_input("По", value=None, format="DD.MM.YYYY", key="hist_to")
+    if not route.strip():
+        return
+
+    import query
+    if not query.DB_FILE.exists():
+        st.info("База результатов ещё не создана — сначала обработайте хотя бы один месяц")
+        return
+    try:
+        df = load_route_history(route.strip(), date_from, date_to)
+    except Exception as e:
+        st.error(f"Не удалось прочитать историю: {e}")
+        return
+    if df.empty:
+        st.warning(f"Нет данных по маршруту '{route.strip()}'")
+        return
+
+    st.dataframe(df, use_container_width=True, hide_index=True)
+    measures = [c for c in ["Корр. Выпуск План", "Корр. Выпуск Факт", "Выпуск факт КСУПТ"] if c in df.columns]
+    if measures:
+        st.line_chart(df.groupby(query.DATE_ISO_COL)[measures].sum())
 
 # ====== ЗАПУСК ======
 if __name__ == "__main__":
     if check_login():
         main()
+        show_cube_slices()
+        show_route_history()
+        # страница уже отрисована — поднимаем пул, чтобы первая обработка не ждала импортов
+        get_worker_pool()
@@ -0,0 +1,459 @@
+import os
+import sys
+import hashlib
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+
+import script1
+import script2
+import script3
+import cube
+import export
+import query
+import routes
+import checkpoint
+import preflight
+import prefetch
+
+# =====================
+# НАСТРОЙКИ / ПУТИ
+# =====================
+BASE_FOLDER = Path("/Users/mikhailsokolov/Desktop/МГТ/Рейсы")
+STORE_FOLDER = BASE_FOLDER / "ЭП" / "store"
+DB_FILE = query.DB_FILE
+
+RELEASE_GLOB = script1.RELEASE_GLOB
+MARKS_GLOB = "Отметки выхода*.xls*"
+REFERENCE_GLOB = "ЭП *.xls*"
+RESULT_SUBFOLDER = "ЭП"
+RESULT_NAME = "ЭП_итог.xlsx"
+CUBE_NAME = "ЭП_куб.parquet"
+
+REFERENCE_CACHE_SIZE = 4  # сколько разобранных справочников ЭП держать в каждом процессе
+PREVIEW_MARKS_ROWS = 5000  # не больше стольких строк отметок за день в предпросмотре
+PREVIEW_ROWS = 50  # строк ЭкспПоказ в предпросмотре
+
+# =====================
+
+
+def resolve_month_inputs(folder: Path) -> dict:
+    """Находит в папке месяца файлы выпусков, отметок и справочник ЭП по шаблонам."""
+    releases = sorted(folder.glob(RELEASE_GLOB))
+    marks = sorted(folder.glob(MARKS_GLOB))
+    reference = sorted(folder.glob(REFERENCE_GLOB))
+
+    missing = []
+    if not releases:
+        missing.append(RELEASE_GLOB)
+    if not marks:
+        missing.append(MARKS_GLOB)
+    if not reference:
+        missing.append(REFERENCE_GLOB)
+    if missing:
+        raise FileNotFoundError(f"В папке {folder} не найдены файлы: {', '.join(missing)}")
+
+    for kind, files in [("отметок", marks), ("справочников ЭП", reference)]:
+        if len(files) > 1:
+            print(f"[WARN] {folder.name}: найдено несколько {kind}, беру {files[0].name}")
+
+    return {
+        "releases": releases,
+        "marks": marks[0],
+        "reference": reference[0],
+        "output": folder / RESULT_SUBFOLDER / RESULT_NAME,
+    }
+
+
+def write_month_partitions(store: Path, table: str, df: pd.DataFrame, part_name: str) -> list:
+    """
+    Раскладывает таблицу по папкам store/<table>/month=YYYY-MM/<part_name>.parquet.
+    Повторная обработка той же папки месяца перезаписывает только свои файлы.
+    """
+    if df.empty or "Дата" not in df.columns:
+        return []
+    months = query.month_of(df["Дата"])
+    written = []
+    for month, part in df.groupby(months, sort=True):
+        part_dir = store / table / f"month={month}"
+        part_dir.mkdir(parents=True, exist_ok=True)
+        path = part_dir / f"{part_name}.parquet"
+        export.to_columnar(part).to_parquet(path, index=False)
+        written.append(month)
+    return written
+
+
+def read_store(store: Path, table: str, months: list | None = None, columns: list | None = None) -> pd.DataFrame:
+    """Читает только нужные месяцы (партиции) и колонки таблицы хранилища."""
+    table_dir = store / table
+    if not table_dir.exists():
+        return pd.DataFrame(columns=columns)
+    frames = []
+    for part_dir in sorted(table_dir.glob("month=*")):
+        month = part_dir.name.split("=", 1)[1]
+        if months is not None and month not in months:
+            continue
+        for path in sorted(part_dir.glob("*.parquet")):
+            df = pd.read_parquet(path, columns=columns)
+            df["Месяц"] = month
+            frames.append(df)
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
+
+
+# =====================
+# ТЁПЛЫЕ ПРОЦЕССЫ
+# =====================
+# Справочник ЭП разбирается дольше всего остального в script3, а между запусками
+# он обычно тот же. Каждый процесс держит разобранные справочники по хешу содержимого.
+
+_REFERENCE_CACHE = {}
+
+
+def reference_cached(path: Path) -> bool:
+    return hashlib.sha1(Path(path).read_bytes()).hexdigest() in _REFERENCE_CACHE
+
+
+def load_reference(path: Path, loaded=None):
+    """loaded — future справочника, уже разбираемого в prefetch (если его нет в кеше процесса)."""
+    digest = hashlib.sha1(Path(path).read_bytes()).hexdigest()
+    july_ref = _REFERENCE_CACHE.get(digest)
+    if july_ref is None:
+        july_ref = loaded.result() if loaded is not None else script3.load_july_reference(path)
+        if len(_REFERENCE_CACHE) >= REFERENCE_CACHE_SIZE:
+            _REFERENCE_CACHE.pop(next(iter(_REFERENCE_CACHE)))
+        _REFERENCE_CACHE[digest] = july_ref
+    return july_ref
+
+
+def _ready() -> bool:
+    return True
+
+
+def make_worker_pool(workers: int | None = None) -> ProcessPoolExecutor:
+    """
+    Пул процессов, поднятых заранее: по одной пустой задаче на процесс заставляет
+    пул создать все процессы сразу, а не при первой настоящей обработке.
+    Справочники ЭП разбираются при первом использовании (load_reference) и остаются в кеше процесса.
+    Процессы запускаются через spawn: fork из многопоточного сервера (Streamlit) может зависнуть.
+    """
+    workers = workers or os.cpu_count() or 1
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    for _ in range(workers):
+        pool.submit(_ready)
+    return pool
+
+
+def process_month(folder: Path, store: Path | None, db: Path | None = None, resume: bool = False) -> dict:
+    """
+    Полная цепочка script1 -> script2 -> script3 для одной папки месяца.
+    store=None — только ЭП_итог.xlsx и куб, без записи в хранилище.
+    db — сразу загрузить результат месяца в базу запросов (query.py).
+    После каждого этапа (каждый файл выпуска, лист КСУПТ, ЭкспПоказ) пишется
+    контрольная точка с отпечатком входов; resume=True — продолжить с последней
+    действительной точки. Листы ЭП_итог.xlsx, куб и хранилище пишутся всегда заново.
+    """
+    inputs, points, fps = open_month(folder, resume)
+    # отметки и справочник ЭП разбираются, пока идёт разбор файлов выпуска
+    with prefetch.prefetch(month_reads(inputs, points, fps)) as pending:
+        df_releases, df_kcsupt = build_month_sources(folder, inputs, points, fps, pending)
+
+        def compute_exp_pokaz():
+            # листы уже в памяти — ЭП_итог.xlsx заново не читается
+            df_src = sheet_frame(df_kcsupt)
+            refs = script3.build_refs(df_src, sheet_frame(df_releases),
+                                      lambda: load_reference(inputs["reference"], pending.get("reference")))
+            return script3.build_exp_pokaz(df_src, refs)
+
+        df_unique, stats = points.run("exp_pokaz", fps["exp_pokaz"], compute_exp_pokaz, folder.name)
+    return finish_month(folder, inputs, df_releases, df_kcsupt, df_unique, store, db)
+
+
+def open_month(folder: Path, resume: bool = False) -> tuple:
+    """Входы папки месяца, её контрольные точки и отпечатки этапов: (inputs, точки, отпечатки)."""
+    inputs = resolve_month_inputs(folder)
+    output_file = inputs["output"]
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    points = checkpoint.Checkpoints(output_file.parent / checkpoint.CHECKPOINT_SUBFOLDER, resume=resume)
+    return inputs, points, month_fingerprints(inputs)
+
+
+def month_fingerprints(inputs: dict) -> dict:
+    """Отпечатки этапов считаются по входным файлам заранее, до разбора."""
+    code1 = checkpoint.code_fingerprint(script1, routes)
+    releases = [checkpoint.fingerprint(code1, path) for path in inputs["releases"]]
+    kcsupt = checkpoint.fingerprint(checkpoint.code_fingerprint(script2, routes), *releases, inputs["marks"])
+    exp_pokaz = checkpoint.fingerprint(checkpoint.code_fingerprint(script3, routes), kcsupt, inputs["reference"])
+    return {"releases": releases, "kcsupt": kcsupt, "exp_pokaz": exp_pokaz}
+
+
+def month_reads(inputs: dict, points: checkpoint.Checkpoints, fps: dict) -> dict:
+    """Чтения для prefetch: только входы этапов, которые придётся считать (нет действительной точки)."""
+    reads = {}
+    if not points.valid("kcsupt", fps["kcsupt"]):
+        reads["marks"] = (pd.read_excel, inputs["marks"])
+    if not points.valid("exp_pokaz", fps["exp_pokaz"]) and not reference_cached(inputs["reference"]):
+        reads["reference"] = (script3.load_july_reference, inputs["reference"])
+    return reads
+
+
+def parse_releases(points: checkpoint.Checkpoints, paths: list, label: str = "", fps: list | None = None) -> tuple:
+    """
+    Разбор файлов выпуска, по контрольной точке на файл. Точка называется по имени
+    файла, а не по номеру: добавленный или удалённый файл не сдвигает точки остальных.
+    Возвращает (кадры, отпечатки файлов).
+    """
+    if fps is None:
+        code1 = checkpoint.code_fingerprint(script1, routes)
+        fps = [checkpoint.fingerprint(code1, path) for path in paths]
+    frames = [points.run(f"release_{path.name}", fp, lambda path=path: script1.process_release_file(path), label)
+              for path, fp in zip(paths, fps)]
+    return frames, fps
+
+
+def build_month_sources(folder: Path, inputs: dict, points: checkpoint.Checkpoints, fps: dict,
+                        pending: dict | None = None) -> tuple:
+    """
+    script1 и script2 для папки месяца (с контрольными точками): листы Sheet1 и КСУПТ
+    записаны в ЭП_итог.xlsx. pending — future из prefetch (month_reads). Возвращает (df_releases, df_kcsupt).
+    """
+    pending = pending or {}
+    output_file = inputs["output"]
+    label = folder.name
+
+    frames, _ = parse_releases(points, inputs["releases"], label, fps["releases"])
+    df_releases = script1.finalize_releases(frames)
+    if df_releases.empty:
+        raise RuntimeError(f"{folder.name}: из файлов выпусков не извлечено ни одной строки")
+    df_releases.to_excel(output_file, index=False)
+
+    def compute_kcsupt():
+        df_marks = pending["marks"].result() if "marks" in pending else pd.read_excel(inputs["marks"])
+        return script2.build_kcsupt_sheet(df_marks, sheet_frame(df_releases))
+
+    df_kcsupt = points.run("kcsupt", fps["kcsupt"], compute_kcsupt, label)
+    script2.write_kcsupt_sheet(df_kcsupt, output_file)
+    return df_releases, df_kcsupt
+
+
+def _sheet_value(v):
+    if v is None or (isinstance(v, str) and v == ""):
+        return np.nan
+    if isinstance(v, float) and v.is_integer() and abs(v) < 2 ** 53:
+        return int(v)
+    return v
+
+
+def sheet_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Кадр таким, каким его вернёт чтение только что записанного листа (read_excel, dtype=object):
+    индекс 0..n-1, пустые строки -> NaN, целые float -> int. Следующий этап получает те же значения, что и при
+    чтении ЭП_итог.xlsx, но без повторного разбора книги.
+    """
+    df = df.reset_index(drop=True)
+    out = df.astype(object)
+    for col in out.columns:
+        s = df[col]
+        if pd.api.types.is_float_dtype(s):
+            whole = s.notna() & (s % 1 == 0) & (s.abs() < 2 ** 53)
+            out.loc[whole, col] = s[whole].astype("int64").astype(object)
+        elif s.dtype == object:
+            out[col] = s.map(_sheet_value)
+    return out
+
+
+def finish_month(folder: Path, inputs: dict, df_releases: pd.DataFrame, df_kcsupt: pd.DataFrame,
+                 df_unique: pd.DataFrame, store: Path | None, db: Path | None) -> dict:
+    """Лист ЭкспПоказ, куб, партиции хранилища и база для посчитанного месяца."""
+    output_file = inputs["output"]
+    script3.write_target_sheet(df_unique, output_file)
+
+    tables = {
+        "releases": df_releases,
+        "kcsupt": df_kcsupt,
+        "exp_pokaz": script3.to_target_frame(df_unique),
+    }
+    cube.write_cube(cube.build_cube(tables["exp_pokaz"]), output_file.with_name(CUBE_NAME))
+    months = set()
+    if store is not None:
+        for table, df in tables.items():
+            months.update(write_month_partitions(store, table, df, folder.name))
+    if db is not None:
+        try:
+            query.register_tables(db, tables)
+        except Exception as e:
+            print(f"[WARN] {folder.name}: не удалось обновить базу '{db}': {e}")
+
+    return {
+        "folder": folder.name,
+        "output": output_file,
+        "months": sorted(months),
+        "rows": {table: len(df) for table, df in tables.items()},
+    }
+
+
+def _first_release(releases: list) -> Path:
+    """Файл выпуска за самый ранний день (по дате в имени файла)."""
+    dates = [pd.to_datetime(script1.extract_date_from_filename(p.name) or None, dayfirst=True) for p in releases]
+    known = [(d, p) for d, p in zip(dates, releases) if pd.notna(d)]
+    return min(known, key=lambda x: x[0])[1] if known else releases[0]
+
+
+def read_marks_for_dates(path: Path, dates: set, limit: int | None = None) -> tuple:
+    """
+    Строки отметок за даты dates (ДД.ММ.ГГГГ; дата приводится так же, как в script2) по всему листу.
+    xlsx читается потоково (openpyxl read_only), в память попадают только нужные строки;
+    limit — остановиться на стольких строках. Возвращает (кадр, упёрлись ли в limit).
+    """
+    days = {}
+
+    def day(value):
+        if value not in days:
+            ts = pd.to_datetime(value, errors="coerce", dayfirst=True)
+            days[value] = None if pd.isna(ts) else ts.strftime("%d.%m.%Y")
+        return days[value]
+
+    if path.suffix.lower() not in (".xlsx", ".xlsm"):
+        df = pd.read_excel(path)
+        if "Дата" not in df.columns:
+            return df.iloc[0:0], False
+        df = df[df["Дата"].map(day).isin(dates)].reset_index(drop=True)
+        if limit is not None and len(df) > limit:
+            return df.head(limit), True
+        return df, False
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = [f"Unnamed: {i}" if v is None else v for i, v in enumerate(next(rows, ()))]
+        if "Дата" not in header:
+            return pd.DataFrame(columns=header), False
+        pos, found, capped = header.index("Дата"), [], False
+        for row in rows:
+            if row[pos] is not None and day(row[pos]) in dates:
+                if limit is not None and len(found) >= limit:
+                    capped = True
+                    break
+                found.append(row)
+    finally:
+        wb.close()
+    return pd.DataFrame(found, columns=header), capped
+
+
+def preview_month(folder: Path, marks_rows: int = PREVIEW_MARKS_ROWS) -> dict:
+    """
+    Быстрый предпросмотр папки месяца: цепочка в памяти на одном файле выпуска
+    (самый ранний день) и первых marks_rows строках отметок за этот день.
+    Ничего не пишет на диск. Возвращает число строк, доли сопоставленных
+    строк ЭкспПоказ по справочникам, первые строки ЭкспПоказ и предупреждения.
+    """
+    inputs = resolve_month_inputs(folder)
+    release = _first_release(inputs["releases"])
+    df_releases = script1.finalize_releases([script1.process_release_file(release)])
+    if df_releases.empty:
+        raise RuntimeError(f"{release.name}: не извлечено ни одной строки выпуска")
+
+    dates = set(df_releases["Дата"].dropna())
+    df_marks, capped = read_marks_for_dates(inputs["marks"], dates, marks_rows)
+    warnings = []
+    if df_marks.empty:
+        warnings.append(f"в отметках нет строк за {', '.join(sorted(dates))} — факт КСУПТ в предпросмотре пустой")
+    elif capped:
+        warnings.append(f"взяты первые {marks_rows} строк отметок за день — доли в предпросмотре приблизительные")
+    for w in warnings:
+        print(f"[WARN] {folder.name}: предпросмотр: {w}")
+
+    if df_marks.empty:
+        df_src = pd.DataFrame(columns=script3.SUBSET_KEY_COLS)
+    else:
+        df_kcsupt = script2.build_kcsupt_sheet(df_marks.copy(), df_releases)
+        df_src = df_kcsupt[df_kcsupt["Дата"].isin(dates)].reset_index(drop=True)
+
+    refs = script3.build_refs(df_src, df_releases, load_reference(inputs["reference"]))
+    df_unique, _ = script3.compute_exp_pokaz(df_src, refs)
+    df_target = script3.to_target_frame(df_unique)
+
+    def share(mask) -> float:
+        return float(mask.mean()) if len(mask) else 0.0
+
+    return {
+        "release": release.name,
+        "dates": sorted(df_releases["Дата"].dropna().unique().tolist()),
+        "rows": {"releases": len(df_releases), "marks": len(df_marks), "kcsupt": len(df_src), "exp_pokaz": len(df_target)},
+        "rates": {
+            "КТР": share(df_target["КТР"].notna() & (df_target["КТР"] != "")),
+            "ПКД": share(df_target["Выпус План ПКД"].notna()),
+            "ЭП июль": share(df_target["Длина маршр., км"].notna()),
+            "Факт КСУПТ": share(pd.to_numeric(df_target["Рейсы факт КСУПТ"], errors="coerce").fillna(0) > 0),
+        },
+        "exp_pokaz": df_target.head(PREVIEW_ROWS),
+        "warnings": warnings,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетная обработка нескольких месяцев (script1 -> script2 -> script3)")
+    parser.add_argument("folders", nargs="+", type=Path, help="папки месяцев с выпусками, отметками и справочником ЭП")
+    parser.add_argument("--store", type=Path, default=STORE_FOLDER, help="папка хранилища, разбитого по месяцам")
+    parser.add_argument("--db", type=Path, default=DB_FILE, help="база SQLite для запросов (query.py); '-' — не обновлять")
+    parser.add_argument("--workers", type=int, default=None, help="число процессов (по умолчанию — число ядер)")
+    parser.add_argument("--no-preflight", action="store_true",
+                        help="не проверять входные файлы перед обработкой")
+    parser.add_argument("--resume", action="store_true",
+                        help="продолжить с последней действительной контрольной точки каждой папки")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    print(f"[INFO] Пакетная обработка: папок={len(args.folders)}, хранилище={args.store}")
+
+    if not args.no_preflight:
+        # все входы всех папок проверяются разом, до первой полной обработки
+        tasks = []
+        for folder in args.folders:
+            try:
+                tasks += preflight.month_tasks(resolve_month_inputs(folder))
+            except FileNotFoundError as e:
+                print(f"[ERROR] {e}")
+                sys.exit(1)
+        report = preflight.run_preflight(tasks, workers=args.workers)
+        preflight.print_report(report, len(tasks))
+        if preflight.has_errors(report):
+            print("[ERROR] Входные файлы не прошли предпроверку — обработка не запускалась")
+            sys.exit(1)
+
+    failed, months = [], set()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(process_month, folder, args.store, None, args.resume): folder for folder in args.folders}
+        for fut in as_completed(futures):
+            folder = futures[fut]
+            try:
+                res = fut.result()
+            except Exception as e:
+                print(f"[ERROR] {folder.name}: {e}")
+                failed.append(folder)
+                continue
+            months.update(res["months"])
+            rows = ", ".join(f"{t}={n}" for t, n in res["rows"].items())
+            print(f"[OK] {res['folder']}: месяцы {', '.join(res['months'])}; строк: {rows}")
+
+    if str(args.db) != "-" and months:
+        # в базу перезаливаются только месяцы этого запуска, остальные уже там
+        tables = {table: read_store(args.store, table, months=months) for table in query.SHEET_TABLES}
+        query.register_tables(args.db, tables, whole_months=True)
+        print(f"[OK] В базу запросов {args.db} загружены месяцы: {', '.join(sorted(months))}")
+
+    if failed:
+        print(f"[ERROR] Не обработано папок: {len(failed)} из {len(args.folders)}")
+        sys.exit(1)
+    print("[DONE] Пакетная обработка завершена ✅")
+
+
+if __name__ == "__main__":
+    main()
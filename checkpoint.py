@@ -0,0 +1,102 @@
+import json
+import hashlib
+import pickle
+from datetime import datetime
+from pathlib import Path
+
+# =====================
+# НАСТРОЙКИ
+# =====================
+CHECKPOINT_SUBFOLDER = ".checkpoints"
+MANIFEST_NAME = "manifest.json"
+# =====================
+
+
+def fingerprint(*parts) -> str:
+    """
+    Отпечаток входов этапа: содержимое файлов (Path), отпечатки предыдущих этапов
+    и любые другие значения (str/числа). Любое изменение входа даёт новый отпечаток.
+    """
+    h = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, Path):
+            h.update(part.name.encode("utf-8"))
+            h.update(part.read_bytes())
+        else:
+            h.update(str(part).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def code_fingerprint(*modules) -> str:
+    """Отпечаток исходников модулей: после правки скрипта старые контрольные точки не подходят."""
+    return fingerprint(*[Path(m.__file__) for m in modules])
+
+
+class Checkpoints:
+    """
+    Контрольные точки цепочки в папке folder: <этап>.pkl и manifest.json
+    {этап: {fingerprint, file, created}}. Кадры хранятся через pickle — без потерь
+    типов object-колонок, чтобы продолжение давало тот же результат, что и полный прогон.
+    resume=False — точки только записываются; resume=True — этап с тем же отпечатком
+    входов читается из точки, а не считается заново.
+    """
+
+    def __init__(self, folder: Path, resume: bool = False):
+        self.folder = folder
+        self.resume = resume
+        self.manifest_file = folder / MANIFEST_NAME
+        self.manifest = self._load_manifest() if resume else {}
+
+    def _load_manifest(self) -> dict:
+        if not self.manifest_file.exists():
+            return {}
+        try:
+            return json.loads(self.manifest_file.read_text(encoding="utf-8"))
+        except Exception as e:
+            print(f"[WARN] Не удалось прочитать {self.manifest_file}: {e}. Начинаю без контрольных точек.")
+            return {}
+
+    def _save_manifest(self):
+        tmp = self.manifest_file.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.manifest, ensure_ascii=False, indent=1), encoding="utf-8")
+        tmp.replace(self.manifest_file)
+
+    def valid(self, stage: str, fp: str) -> bool:
+        """Есть ли для этапа точка с тем же отпечатком входов (без чтения самой точки)."""
+        entry = self.manifest.get(stage)
+        return (self.resume and entry is not None and entry.get("fingerprint") == fp
+                and (self.folder / entry["file"]).exists())
+
+    def load(self, stage: str, fp: str):
+        """Значение этапа из контрольной точки или None, если точки нет или входы изменились."""
+        entry = self.manifest.get(stage)
+        if not self.resume or entry is None or entry.get("fingerprint") != fp:
+            return None
+        path = self.folder / entry["file"]
+        try:
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        except Exception as e:
+            print(f"[WARN] Контрольная точка '{stage}' повреждена ({e}) — считаю этап заново")
+            return None
+
+    def save(self, stage: str, fp: str, value):
+        self.folder.mkdir(parents=True, exist_ok=True)
+        file_name = f"{stage}.pkl"
+        tmp = self.folder / f"{file_name}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp.replace(self.folder / file_name)
+        self.manifest[stage] = {"fingerprint": fp, "file": file_name, "created": datetime.now().isoformat(timespec="seconds")}
+        self._save_manifest()
+
+    def run(self, stage: str, fp: str, compute, label: str = ""):
+        """Значение этапа: из контрольной точки, если она действительна, иначе compute() с записью точки."""
+        value = self.load(stage, fp)
+        if value is not None:
+            print(f"[INFO] {label or stage}: продолжаю с контрольной точки '{stage}'")
+            return value
+        value = compute()
+        self.save(stage, fp, value)
+        return value
@@ -0,0 +1,118 @@
+import sys
+import argparse
+from itertools import combinations
+from pathlib import Path
+import pandas as pd
+
+# =====================
+# НАСТРОЙКИ
+# =====================
+SOURCE_SHEET = "ЭкспПоказ"
+
+DIMENSIONS = ["Дата", "Филиал", "Авт/Эл", "КТР"]
+MEASURES = [
+    "Корр. Выпуск План", "Корр. Выпуск Факт", "Корр. Рейсы План", "Корр. Рейсы Факт",
+    "Выпуск факт КСУПТ", "Рейсы факт КСУПТ",
+    "Совпадение исх плана выпуска", "Совпадение исх плана рейсов",
+    "Совпадение плана выпуска", "Совпадение факта выпуска",
+    "Совпадение плана рейсов", "Совпадение факта рейсов",
+]
+
+ALL = "Все"
+EMPTY = "(пусто)"
+LEVEL_COL = "Уровень"
+COUNT_COL = "Строк"
+# =====================
+
+
+def level_name(dims) -> str:
+    return "|".join(dims) if dims else ALL
+
+
+def build_cube(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Предагрегированный куб по ЭкспПоказ: суммы MEASURES для каждого набора
+    измерений из DIMENSIONS (2^4 уровней). Измерения, по которым уровень
+    не группирует, заполнены значением ALL, так что любой срез — это выборка строк.
+    """
+    base = pd.DataFrame(index=df.index)
+    for dim in DIMENSIONS:
+        if dim in df.columns:
+            base[dim] = df[dim].where(df[dim].notna(), EMPTY).astype(str).str.strip().replace("", EMPTY)
+        else:
+            base[dim] = EMPTY
+    for m in MEASURES:
+        base[m] = pd.to_numeric(df[m], errors="coerce").fillna(0) if m in df.columns else 0.0
+    base[COUNT_COL] = 1
+
+    levels = []
+    for k in range(len(DIMENSIONS) + 1):
+        for dims in combinations(DIMENSIONS, k):
+            dims = list(dims)
+            if dims:
+                agg = base.groupby(dims, sort=True)[MEASURES + [COUNT_COL]].sum().reset_index()
+            else:
+                agg = base[MEASURES + [COUNT_COL]].sum().to_frame().T
+            for dim in DIMENSIONS:
+                if dim not in dims:
+                    agg[dim] = ALL
+            agg[LEVEL_COL] = level_name(dims)
+            levels.append(agg)
+
+    cube = pd.concat(levels, ignore_index=True)
+    return cube[[LEVEL_COL] + DIMENSIONS + MEASURES + [COUNT_COL]]
+
+
+def slice_cube(cube: pd.DataFrame, filters: dict | None = None, by: list | None = None) -> pd.DataFrame:
+    """
+    Срез без пересчёта: filters — {измерение: значение}, by — измерения разбивки.
+    Берётся уровень, группирующий ровно по filters ∪ by.
+    """
+    filters = {d: v for d, v in (filters or {}).items() if v not in (None, ALL)}
+    by = [d for d in (by or []) if d not in filters]
+    dims = [d for d in DIMENSIONS if d in filters or d in by]
+
+    out = cube[cube[LEVEL_COL] == level_name(dims)]
+    for dim, value in filters.items():
+        out = out[out[dim] == value]
+    return out[by + MEASURES + [COUNT_COL]].reset_index(drop=True)
+
+
+def dimension_values(cube: pd.DataFrame, dim: str) -> list:
+    values = cube.loc[cube[LEVEL_COL] == dim, dim].unique().tolist()
+    if dim == "Дата":
+        return sorted(values, key=lambda v: pd.to_datetime(v, format="%d.%m.%Y", errors="coerce"))
+    return sorted(values)
+
+
+def write_cube(cube: pd.DataFrame, path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    cube.to_parquet(path, index=False)
+
+
+def read_cube(path) -> pd.DataFrame:
+    return pd.read_parquet(path)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Построение куба план/факт из листа ЭкспПоказ")
+    parser.add_argument("workbook", type=Path, help="ЭП_итог.xlsx с листом ЭкспПоказ")
+    parser.add_argument("-o", "--output", type=Path, default=None, help="куда сохранить куб (.parquet)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.workbook.exists():
+        print(f"[ERROR] Не найден файл: {args.workbook}")
+        sys.exit(1)
+    output = args.output or args.workbook.with_name("ЭП_куб.parquet")
+
+    df = pd.read_excel(args.workbook, sheet_name=SOURCE_SHEET)
+    cube = build_cube(df)
+    write_cube(cube, output)
+    print(f"[OK] Куб сохранён: {output} (строк={len(cube)}, из {len(df)} строк '{SOURCE_SHEET}')")
+
+
+if __name__ == "__main__":
+    main()
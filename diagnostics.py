@@ -0,0 +1,206 @@
+import sys
+import argparse
+from pathlib import Path
+import pandas as pd
+
+import routes
+
+# =====================
+# НАСТРОЙКИ
+# =====================
+REPORT_SHEET = "Диагностика"
+REPORT_COLUMNS = ["Проверка", "Ключ", "Строк", "Маршрут", "Кандидаты"]
+NEAREST_N = 3
+
+CHECK_KTR = "Ключ 2 нет в Sheet1 (КТР)"
+CHECK_KTR_AMBIG = "Ключ 2 -> КТР неоднозначен"
+CHECK_TYPE_AMBIG = "Ключ 2 -> ТипТС неоднозначен"
+CHECK_PKD = "Ключ 4 нет в Sheet1 (ПКД)"
+CHECK_JULY = "Маршрута нет в ЭП июль"
+CHECK_JULY_ROUTE_ONLY = "ЭП июль: нет даты, взято по маршруту"
+# =====================
+
+
+def split_key(keys: pd.Series) -> pd.DataFrame:
+    """Ключ 2/4 = 'дата маршрут ...' -> колонки date и route (канонический маршрут)."""
+    parts = keys.str.split(" ", n=2, expand=True).reindex(columns=[0, 1])
+    return pd.DataFrame({
+        "date": parts[0],
+        "route": parts[1].fillna("").map(routes.canonical_token),
+    }, index=keys.index)
+
+
+def key_index(keys) -> tuple:
+    """
+    Индекс ключей справочника: RouteIndex по маршрутам (для nearest) и
+    {(дата, маршрут): [ключи]} — подсказки похожих ключей для несопоставленных.
+    """
+    keys = pd.Series(sorted(set(keys)), dtype=object)
+    index, by_date_route = routes.RouteIndex(), {}
+    if keys.empty:
+        return index, by_date_route
+    parsed = split_key(keys)
+    for key, date, route in zip(keys, parsed["date"], parsed["route"]):
+        if route:
+            index.add(None, None, [route], None)
+            by_date_route.setdefault((date, route), []).append(key)
+    return index, by_date_route
+
+
+def nearest_keys(lookup: tuple, key: str, date, route) -> str:
+    """Ключи с той же датой и похожим маршрутом; совпадающие по остатку ключа (филиал, тип) — первыми."""
+    index, by_date_route = lookup
+    rest = key.split(" ", 2)[2:]
+    found = []
+    for r in index.nearest(route, n=NEAREST_N):
+        same_day = by_date_route.get((date, r), [])
+        found += [k for k in same_day if k.split(" ", 2)[2:] == rest]
+        found += [k for k in same_day if k.split(" ", 2)[2:] != rest]
+    found = list(dict.fromkeys(k for k in found if k != key))
+    return "; ".join(found[:NEAREST_N])
+
+
+def _stripped_keys(df: pd.DataFrame, col: str) -> pd.Series:
+    """Ключ 2 так, как его ищет script3 в ktr_map: str(...).strip()."""
+    if col not in df.columns:
+        return pd.Series("<__NA__>", index=df.index)
+    return df[col].astype(str).str.strip().where(df[col].notna(), "<__NA__>")
+
+
+def _key_rows(keys: pd.Series, mask=None) -> pd.DataFrame:
+    """Уникальные ключи с числом строк, в которых они встречаются."""
+    if mask is not None:
+        keys = keys[mask]
+    keys = keys[keys != "<__NA__>"]
+    counts = keys.value_counts(sort=False)
+    return pd.DataFrame({"Ключ": counts.index.astype(str), "Строк": counts.to_numpy()})
+
+
+def _anti_join(key_rows: pd.DataFrame, known, check: str, lookup: tuple) -> pd.DataFrame:
+    missing = key_rows[~key_rows["Ключ"].isin(known)].copy()
+    if missing.empty:
+        return missing.reindex(columns=REPORT_COLUMNS)
+    parsed = split_key(missing["Ключ"])
+    missing["Проверка"] = check
+    missing["Маршрут"] = parsed["route"]
+    missing["Кандидаты"] = [nearest_keys(lookup, k, d, r) for k, d, r in zip(missing["Ключ"], parsed["date"], parsed["route"])]
+    return missing[REPORT_COLUMNS]
+
+
+def _ambiguous(df_sheet1: pd.DataFrame, value_col: str, check: str, key2_rows: pd.DataFrame) -> pd.DataFrame:
+    if df_sheet1 is None or not {"Ключ 2", value_col}.issubset(df_sheet1.columns):
+        return pd.DataFrame(columns=REPORT_COLUMNS)
+    pairs = df_sheet1[["Ключ 2", value_col]].dropna()
+    pairs = pairs.assign(**{"Ключ 2": pairs["Ключ 2"].astype(str).str.strip(), value_col: pairs[value_col].astype(str)})
+    variants = pairs.drop_duplicates().groupby("Ключ 2", sort=True)[value_col].agg(list)
+    variants = variants[variants.map(len) > 1]
+    if variants.empty:
+        return pd.DataFrame(columns=REPORT_COLUMNS)
+    out = pd.DataFrame({"Ключ": variants.index, "Кандидаты": variants.map("; ".join).to_numpy()})
+    out = out.merge(key2_rows, on="Ключ", how="left").fillna({"Строк": 0})
+    out["Проверка"] = check
+    out["Маршрут"] = split_key(out["Ключ"])["route"]
+    return out[REPORT_COLUMNS]
+
+
+def _july_check(key4_rows: pd.DataFrame, july_ref: routes.RouteIndex, parse_key4) -> pd.DataFrame:
+    """
+    Повторяет три уровня поиска RouteIndex.lookup, но как anti-join по уникальным Ключ 4:
+    точный ключ -> (дата, маршрут) -> маршрут.
+    """
+    if key4_rows.empty:
+        return pd.DataFrame(columns=REPORT_COLUMNS)
+    parsed = [parse_key4(k) for k in key4_rows["Ключ"]]
+    keys = key4_rows.assign(
+        key_norm=[p.get("key_norm") for p in parsed],
+        date=[p.get("date") for p in parsed],
+        routes=[p.get("routes") or [] for p in parsed],
+    )
+    exploded = keys.explode("routes")
+    date_route_known = {f"{d}|{r}" for d, r in july_ref.date_route}
+    by_date = (exploded["date"].astype(str) + "|" + exploded["routes"].astype(str)).isin(date_route_known)
+    by_route = exploded["routes"].isin(july_ref.route.keys())
+
+    exact = keys["key_norm"].isin(july_ref.exact.keys())
+    dated = by_date.groupby(level=0).any().reindex(keys.index, fill_value=False) & keys["date"].notna()
+    routed = by_route.groupby(level=0).any().reindex(keys.index, fill_value=False)
+
+    keys["Маршрут"] = split_key(keys["Ключ"])["route"]
+    missing = keys[~(exact | dated | routed)].assign(Проверка=CHECK_JULY)
+    missing["Кандидаты"] = [", ".join(july_ref.nearest(r, n=NEAREST_N)) for r in missing["Маршрут"]]
+    route_only = keys[~exact & ~dated & routed].assign(Проверка=CHECK_JULY_ROUTE_ONLY, Кандидаты="")
+    return pd.concat([missing, route_only], ignore_index=True)[REPORT_COLUMNS]
+
+
+def build_report(df_src: pd.DataFrame, df_sheet1: pd.DataFrame | None, refs: dict, parse_key4) -> pd.DataFrame:
+    """
+    Несопоставленные и неоднозначные ключи по всем справочникам script3 за один проход
+    по уникальным ключам листа КСУПТ. refs — как в script3: july, ktr_map, pkd_map.
+    parse_key4(ключ) -> {"key_norm", "date", "routes"} — тот же разбор, что при расчёте.
+    """
+    key2 = _stripped_keys(df_src, "Ключ 2")
+    key4 = routes.normalize_key_series(df_src["Ключ 4"]) if "Ключ 4" in df_src.columns \
+        else pd.Series("<__NA__>", index=df_src.index)
+    ktr_empty = df_src["КТР"].isna() if "КТР" in df_src.columns else pd.Series(True, index=df_src.index)
+
+    key2_rows = _key_rows(key2)
+    key4_rows = _key_rows(key4)
+
+    parts = [
+        _anti_join(_key_rows(key2, ktr_empty), refs["ktr_map"].keys(), CHECK_KTR, key_index(refs["ktr_map"])),
+        _ambiguous(df_sheet1, "КТР", CHECK_KTR_AMBIG, key2_rows),
+        _ambiguous(df_sheet1, "ТипТС", CHECK_TYPE_AMBIG, key2_rows),
+        _anti_join(key4_rows, refs["pkd_map"].keys(), CHECK_PKD, key_index(refs["pkd_map"])),
+        _july_check(key4_rows, refs["july"], parse_key4),
+    ]
+    parts = [p for p in parts if not p.empty]
+    if not parts:
+        return pd.DataFrame(columns=REPORT_COLUMNS)
+    report = pd.concat(parts, ignore_index=True)
+    report["Строк"] = report["Строк"].astype(int)
+    return report.sort_values(["Проверка", "Строк", "Ключ"], ascending=[True, False, True], kind="stable").reset_index(drop=True)
+
+
+def print_report(report: pd.DataFrame):
+    if report.empty:
+        print("[OK] Диагностика: все ключи сопоставлены")
+        return
+    for check, part in report.groupby("Проверка", sort=False):
+        print(f"[DIAG] {check}: ключей={len(part)}, строк={int(part['Строк'].sum())}")
+
+
+def write_report(report: pd.DataFrame, path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    report.to_excel(path, sheet_name=REPORT_SHEET, index=False)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Несопоставленные и неоднозначные ключи по справочникам script3")
+    parser.add_argument("workbook", type=Path, help="ЭП_итог.xlsx (листы Sheet1 и 'Выпуск и рейсы КСУПТ')")
+    parser.add_argument("reference", type=Path, help="справочник 'ЭП июль.xlsx'")
+    parser.add_argument("-o", "--output", type=Path, default=None, help="куда сохранить отчёт (.xlsx)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    import script3
+
+    args = parse_args(argv)
+    for path in (args.workbook, args.reference):
+        if not path.exists():
+            print(f"[ERROR] Не найден файл: {path}")
+            sys.exit(1)
+
+    df_src = script3.read_source_sheet(args.workbook)
+    df_sheet1 = script3.read_sheet1(args.workbook)
+    refs = script3.build_refs(df_src, df_sheet1, script3.load_july_reference(args.reference))
+    report = build_report(df_src, df_sheet1, refs, script3.parse_key4)
+    print_report(report)
+
+    output = args.output or args.workbook.with_name("ЭП_диагностика.xlsx")
+    write_report(report, output)
+    print(f"[OK] Отчёт сохранён: {output}")
+
+
+if __name__ == "__main__":
+    main()
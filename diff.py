@@ -0,0 +1,195 @@
+import sys
+import argparse
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+import routes
+
+# =====================
+# НАСТРОЙКИ
+# =====================
+DEFAULT_SHEET = "ЭкспПоказ"
+KEY_CANDIDATES = ["Ключ 5", "Ключ 4"]
+OCC_COL = "_n"          # номер повтора ключа: дубли сопоставляются по порядку
+ATOL = 1e-9
+RTOL = 0.0
+CSV_SEP = ";"
+# =====================
+
+
+def read_result(path: Path, sheet: str = DEFAULT_SHEET) -> pd.DataFrame:
+    suffix = path.suffix.lower()
+    if suffix == ".parquet":
+        return pd.read_parquet(path)
+    if suffix == ".csv":
+        return pd.read_csv(path, sep=CSV_SEP, encoding="utf-8-sig")
+    return pd.read_excel(path, sheet_name=sheet)
+
+
+def pick_key(old: pd.DataFrame, new: pd.DataFrame, key: str | None = None) -> str:
+    candidates = [key] if key else KEY_CANDIDATES
+    for k in candidates:
+        if k in old.columns and k in new.columns:
+            return k
+    raise ValueError(f"Нет общей ключевой колонки среди {candidates}")
+
+
+def _keyed(df: pd.DataFrame, key: str) -> pd.DataFrame:
+    out = df.copy()
+    out[key] = routes.normalize_key_series(out[key])
+    out[OCC_COL] = out.groupby(key, sort=False).cumcount()
+    return out
+
+
+def _as_numeric(a: pd.Series, b: pd.Series):
+    """Числовые представления, если обе колонки числовые (пустые значения не мешают), иначе None."""
+    na, nb = pd.to_numeric(a, errors="coerce"), pd.to_numeric(b, errors="coerce")
+    if na.notna().sum() == a.notna().sum() and nb.notna().sum() == b.notna().sum():
+        return na.astype(float), nb.astype(float)
+    return None
+
+
+def _as_text(s: pd.Series) -> pd.Series:
+    return s.where(s.isna(), s.astype(str).str.strip())
+
+
+def diff_frames(old: pd.DataFrame, new: pd.DataFrame, key: str | None = None,
+                columns: list | None = None, atol: float = ATOL, rtol: float = RTOL) -> dict:
+    """
+    Сопоставляет два результата по ключу одним outer join.
+    Возвращает словарь:
+      key, added / removed — строки только в new / только в old,
+      summary — по колонке: сколько строк отличается, макс./сумма дельты,
+      changes — длинная таблица отличий (ключ, колонка, было, стало, дельта).
+    Числа считаются равными, если |стало - было| <= atol + rtol * |было|.
+    """
+    key = pick_key(old, new, key)
+    common = [c for c in old.columns if c in new.columns and c != key]
+    if columns:
+        common = [c for c in common if c in columns]
+
+    a, b = _keyed(old, key), _keyed(new, key)
+    merged = a[[key, OCC_COL] + common].merge(
+        b[[key, OCC_COL] + common], on=[key, OCC_COL], how="outer",
+        suffixes=("_old", "_new"), indicator=True, sort=False,
+    )
+    both = merged["_merge"] == "both"
+    added = b.merge(merged.loc[merged["_merge"] == "right_only", [key, OCC_COL]], on=[key, OCC_COL]).drop(columns=OCC_COL)
+    removed = a.merge(merged.loc[merged["_merge"] == "left_only", [key, OCC_COL]], on=[key, OCC_COL]).drop(columns=OCC_COL)
+
+    matched = merged[both]
+    summary, changes = [], []
+    for col in common:
+        va, vb = matched[f"{col}_old"], matched[f"{col}_new"]
+        null_mismatch = va.isna() != vb.isna()
+        nums = _as_numeric(va, vb)
+        if nums is not None:
+            fa, fb = nums
+            delta = fb - fa
+            differs = null_mismatch | ((delta.abs() > atol + rtol * fa.abs()) & delta.notna())
+            max_abs = float(delta[differs].abs().max()) if differs.any() else 0.0
+            total = float(delta[differs].sum()) if differs.any() else 0.0
+            kind = "число"
+        else:
+            ta, tb = _as_text(va), _as_text(vb)
+            differs = null_mismatch | ((ta != tb) & ta.notna() & tb.notna())
+            delta = pd.Series(np.nan, index=matched.index)
+            max_abs = total = np.nan
+            kind = "текст"
+
+        n = int(differs.sum())
+        summary.append({"Колонка": col, "Тип": kind, "Отличий": n, "Макс |Δ|": max_abs, "Сумма Δ": total})
+        if n:
+            changes.append(pd.DataFrame({
+                key: matched.loc[differs, key].to_numpy(),
+                "Колонка": col,
+                "Было": va[differs].to_numpy(),
+                "Стало": vb[differs].to_numpy(),
+                "Δ": delta[differs].to_numpy(),
+            }))
+
+    return {
+        "key": key,
+        "matched": int(both.sum()),
+        "added": added,
+        "removed": removed,
+        "summary": pd.DataFrame(summary, columns=["Колонка", "Тип", "Отличий", "Макс |Δ|", "Сумма Δ"]),
+        "changes": pd.concat(changes, ignore_index=True) if changes else
+                   pd.DataFrame(columns=[key, "Колонка", "Было", "Стало", "Δ"]),
+        "only_old_cols": [c for c in old.columns if c not in new.columns],
+        "only_new_cols": [c for c in new.columns if c not in old.columns],
+    }
+
+
+def is_equal(result: dict) -> bool:
+    return (result["added"].empty and result["removed"].empty and result["changes"].empty
+            and not result["only_old_cols"] and not result["only_new_cols"])
+
+
+def write_report(result: dict, path: Path):
+    with pd.ExcelWriter(path, engine="openpyxl") as writer:
+        result["summary"].to_excel(writer, sheet_name="Сводка", index=False)
+        result["changes"].to_excel(writer, sheet_name="Изменения", index=False)
+        result["added"].to_excel(writer, sheet_name="Добавлены", index=False)
+        result["removed"].to_excel(writer, sheet_name="Удалены", index=False)
+
+
+def print_summary(result: dict, show_all: bool = False):
+    print(f"[INFO] Ключ: {result['key']}; сопоставлено строк: {result['matched']}, "
+          f"добавлено: {len(result['added'])}, удалено: {len(result['removed'])}")
+    if result["only_old_cols"]:
+        print(f"[INFO] Колонки только в старом: {result['only_old_cols']}")
+    if result["only_new_cols"]:
+        print(f"[INFO] Колонки только в новом: {result['only_new_cols']}")
+    summary = result["summary"]
+    if not show_all:
+        summary = summary[summary["Отличий"] > 0]
+    if not summary.empty:
+        with pd.option_context("display.max_rows", 500, "display.width", 200):
+            print(summary.to_string(index=False))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Сравнение двух результатов (ЭкспПоказ и др.) по Ключ 5 / Ключ 4")
+    parser.add_argument("old", type=Path, help="прошлый результат (.xlsx/.parquet/.csv)")
+    parser.add_argument("new", type=Path, help="новый результат")
+    parser.add_argument("--sheet", default=DEFAULT_SHEET, help="лист для .xlsx")
+    parser.add_argument("--key", default=None, help="ключевая колонка (по умолчанию Ключ 5, затем Ключ 4)")
+    parser.add_argument("--columns", nargs="+", default=None, help="сравнивать только эти колонки")
+    parser.add_argument("--atol", type=float, default=ATOL, help="абсолютный допуск для чисел")
+    parser.add_argument("--rtol", type=float, default=RTOL, help="относительный допуск для чисел")
+    parser.add_argument("--all", action="store_true", help="показать в сводке и колонки без отличий")
+    parser.add_argument("-o", "--output", type=Path, default=None, help="сохранить подробный отчёт в .xlsx")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    for path in (args.old, args.new):
+        if not path.exists():
+            print(f"[ERROR] Не найден файл: {path}")
+            sys.exit(2)
+
+    old, new = read_result(args.old, args.sheet), read_result(args.new, args.sheet)
+    try:
+        result = diff_frames(old, new, key=args.key, columns=args.columns, atol=args.atol, rtol=args.rtol)
+    except ValueError as e:
+        print(f"[ERROR] {e}")
+        sys.exit(2)
+
+    print_summary(result, show_all=args.all)
+    if args.output:
+        write_report(result, args.output)
+        print(f"[OK] Отчёт сохранён: {args.output}")
+
+    if is_equal(result):
+        print("[OK] Результаты совпадают ✅")
+        return
+    print(f"[DIFF] Добавлено: {len(result['added'])}, удалено: {len(result['removed'])}, "
+          f"отличий в значениях: {len(result['changes'])}")
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
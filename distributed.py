@@ -0,0 +1,405 @@
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import sqlite3
+import argparse
+import threading
+import multiprocessing
+from datetime import datetime
+from pathlib import Path
+import pandas as pd
+
+import batch
+import script3
+import query
+import prefetch
+
+# =====================
+# НАСТРОЙКИ / ПУТИ
+# =====================
+QUEUE_FOLDER = batch.BASE_FOLDER / "ЭП" / "очередь"  # папка на общем диске, одинаковый путь на всех машинах
+QUEUE_DB_NAME = "queue.sqlite"
+WORK_SUBFOLDER = "work"  # партиции листа КСУПТ и результаты задач partition
+
+LEASE_SECONDS = 120     # задача без пульса дольше этого считается брошенной и отдаётся другому
+HEARTBEAT_SECONDS = 15  # как часто обработчик продлевает аренду
+POLL_SECONDS = 2.0      # пауза, когда свободных задач нет
+MAX_ATTEMPTS = 3        # после стольких неудач (ошибка или потерянная аренда) задача — failed
+
+PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+# =====================
+
+
+class JobQueue:
+    """
+    Очередь задач в файле SQLite на общем диске — брокер не нужен.
+    Захват — одна транзакция BEGIN IMMEDIATE, поэтому задачу получает ровно один
+    обработчик; захваченная задача арендуется на LEASE_SECONDS и продлевается пульсом.
+    Если обработчик пропал, аренда истекает и задачу забирает другой.
+    Журнал DELETE, а не WAL: WAL держит индекс в общей памяти и между машинами не работает.
+    """
+
+    def __init__(self, folder: Path):
+        folder.mkdir(parents=True, exist_ok=True)
+        self.folder = folder
+        self.con = sqlite3.connect(folder / QUEUE_DB_NAME, timeout=60, isolation_level=None)
+        self.con.execute("PRAGMA journal_mode=DELETE")
+        self.con.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, kind TEXT, payload TEXT, state TEXT,"
+            " owner TEXT, lease_until REAL, attempts INTEGER DEFAULT 0, result TEXT, error TEXT, updated REAL)"
+        )
+
+    def close(self):
+        self.con.close()
+
+    def put(self, job_id: str, kind: str, payload: dict):
+        self.con.execute(
+            "INSERT OR REPLACE INTO jobs (id, kind, payload, state, attempts, updated) VALUES (?, ?, ?, ?, 0, ?)",
+            (job_id, kind, json.dumps(payload, ensure_ascii=False), PENDING, time.time()),
+        )
+
+    def claim(self, worker: str) -> dict | None:
+        """Свободная задача (новая или с истёкшей арендой) или None."""
+        now = time.time()
+        self.con.execute("BEGIN IMMEDIATE")
+        try:
+            self.con.execute(
+                "UPDATE jobs SET state = ?, error = 'аренда истекла', owner = NULL"
+                " WHERE state = ? AND lease_until < ? AND attempts >= ?",
+                (FAILED, RUNNING, now, MAX_ATTEMPTS),
+            )
+            row = self.con.execute(
+                "SELECT id, kind, payload, attempts FROM jobs"
+                " WHERE state = ? OR (state = ? AND lease_until < ?) ORDER BY rowid LIMIT 1",
+                (PENDING, RUNNING, now),
+            ).fetchone()
+            if row is not None:
+                self.con.execute(
+                    "UPDATE jobs SET state = ?, owner = ?, lease_until = ?, attempts = ?, updated = ? WHERE id = ?",
+                    (RUNNING, worker, now + LEASE_SECONDS, row[3] + 1, now, row[0]),
+                )
+            self.con.execute("COMMIT")
+        except Exception:
+            self.con.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        return {"id": row[0], "kind": row[1], "payload": json.loads(row[2]), "attempt": row[3] + 1}
+
+    def _update_owned(self, sql: str, params: tuple) -> bool:
+        """Изменение задачи, которую всё ещё арендует этот обработчик."""
+        cur = self.con.execute(sql + " AND state = ?", params + (RUNNING,))
+        return cur.rowcount == 1
+
+    def heartbeat(self, job_id: str, worker: str) -> bool:
+        now = time.time()
+        return self._update_owned("UPDATE jobs SET lease_until = ?, updated = ? WHERE id = ? AND owner = ?",
+                                  (now + LEASE_SECONDS, now, job_id, worker))
+
+    def complete(self, job_id: str, worker: str, result: dict) -> bool:
+        return self._update_owned("UPDATE jobs SET state = ?, result = ?, updated = ? WHERE id = ? AND owner = ?",
+                                  (DONE, json.dumps(result, ensure_ascii=False), time.time(), job_id, worker))
+
+    def fail(self, job_id: str, worker: str, error: str) -> bool:
+        """Ошибка задачи: вернуть в очередь, пока не исчерпаны попытки."""
+        return self._update_owned(
+            "UPDATE jobs SET state = CASE WHEN attempts < ? THEN ? ELSE ? END, owner = NULL, error = ?, updated = ?"
+            " WHERE id = ? AND owner = ?",
+            (MAX_ATTEMPTS, PENDING, FAILED, error, time.time(), job_id, worker),
+        )
+
+    def counts(self) -> dict:
+        return dict(self.con.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+
+    def status(self, prefix: str = "") -> pd.DataFrame:
+        return pd.read_sql_query(
+            "SELECT id, kind, state, owner, attempts, result, error FROM jobs WHERE id LIKE ? ORDER BY rowid",
+            self.con, params=(prefix + "%",),
+        )
+
+
+# =====================
+# ОБРАБОТЧИК
+# =====================
+
+_REFS_CACHE = {}
+
+
+def _load_refs(path: Path) -> dict:
+    """Справочники партиционной задачи: читаются один раз на процесс."""
+    if path not in _REFS_CACHE:
+        _REFS_CACHE.clear()
+        _REFS_CACHE[path] = pd.read_pickle(path)
+    return _REFS_CACHE[path]
+
+
+def run_job(job: dict) -> dict:
+    payload = job["payload"]
+    if job["kind"] == "month":
+        store = Path(payload["store"]) if payload.get("store") else None
+        # resume: контрольные точки упавшего обработчика подхватываются следующим
+        res = batch.process_month(Path(payload["folder"]), store, None, resume=True)
+        return {"months": res["months"], "rows": res["rows"]}
+    if job["kind"] == "partition":
+        result = script3.compute_exp_pokaz(pd.read_pickle(payload["source"]), _load_refs(Path(payload["refs"])))
+        out = Path(payload["output"])
+        tmp = out.with_suffix(".tmp")
+        pd.to_pickle(result, tmp)
+        tmp.replace(out)
+        return {"rows": len(result[0])}
+    raise ValueError(f"Неизвестный вид задачи: {job['kind']}")
+
+
+class _Heartbeat(threading.Thread):
+    """Продлевает аренду задачи, пока она выполняется (своё соединение — соединения SQLite не делятся между потоками)."""
+
+    def __init__(self, folder: Path, job_id: str, worker: str):
+        super().__init__(daemon=True)
+        self.folder, self.job_id, self.worker = folder, job_id, worker
+        self.stopped = threading.Event()
+        self.lost = False
+
+    def run(self):
+        q = JobQueue(self.folder)
+        try:
+            while not self.stopped.wait(HEARTBEAT_SECONDS):
+                if not q.heartbeat(self.job_id, self.worker):
+                    self.lost = True
+                    return
+        finally:
+            q.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def run_worker(folder: Path, worker: str | None = None, wait: bool = False) -> int:
+    """
+    Берёт задачи из очереди, пока они есть. Пока другие обработчики держат задачи,
+    ждёт: если кто-то из них пропадёт, его задачу можно будет забрать.
+    wait=True — не завершаться и после того, как очередь опустела.
+    """
+    worker = worker or worker_name()
+    q = JobQueue(folder)
+    done = 0
+    print(f"[INFO] Обработчик {worker}: очередь {folder}")
+    try:
+        while True:
+            job = q.claim(worker)
+            if job is None:
+                counts = q.counts()
+                if not wait and not counts.get(PENDING) and not counts.get(RUNNING):
+                    break
+                time.sleep(POLL_SECONDS)
+                continue
+
+            print(f"[INFO] {worker}: {job['id']} (попытка {job['attempt']})")
+            beat = _Heartbeat(folder, job["id"], worker)
+            beat.start()
+            try:
+                result = run_job(job)
+            except Exception as e:
+                beat.stop()
+                print(f"[ERROR] {worker}: {job['id']}: {e}")
+                q.fail(job["id"], worker, str(e))
+                continue
+            beat.stop()
+            if q.complete(job["id"], worker, result):
+                done += 1
+            else:
+                print(f"[WARN] {worker}: аренда {job['id']} потеряна — задачу выполнит другой обработчик")
+    finally:
+        q.close()
+    print(f"[DONE] {worker}: выполнено задач {done}")
+    return done
+
+
+# =====================
+# КООРДИНАТОР
+# =====================
+
+def start_local_workers(folder: Path, count: int) -> list:
+    """Обработчики-процессы на этой машине (для локального прогона и проверки)."""
+    procs = [multiprocessing.Process(target=run_worker, args=(folder, f"{socket.gethostname()}:local{i}"))
+             for i in range(count)]
+    for p in procs:
+        p.start()
+    return procs
+
+
+def wait_for_jobs(q: JobQueue, prefix: str) -> pd.DataFrame:
+    """Ждёт, пока все задачи запуска завершатся (done или failed); печатает ход работы."""
+    last = None
+    while True:
+        jobs = q.status(prefix)
+        counts = jobs["state"].value_counts().to_dict()
+        if counts != last:
+            print("[INFO] Задачи: " + ", ".join(f"{s}={n}" for s, n in sorted(counts.items())))
+            last = counts
+        if not counts.get(PENDING) and not counts.get(RUNNING):
+            return jobs
+        time.sleep(POLL_SECONDS)
+
+
+def _run_id() -> str:
+    return datetime.now().strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}"
+
+
+def _join(procs: list):
+    for p in procs:
+        p.join()
+
+
+def distribute_months(folders: list, queue_folder: Path, store: Path | None, db: Path | None,
+                      local_workers: int = 0) -> pd.DataFrame:
+    """Одна задача на папку месяца; по готовности хранилище загружается в базу, как в batch.py."""
+    q = JobQueue(queue_folder)
+    prefix = f"{_run_id()}/month/"
+    for folder in folders:
+        q.put(prefix + folder.name, "month", {
+            "folder": str(folder.resolve()),
+            "store": str(store.resolve()) if store is not None else None,
+        })
+    print(f"[INFO] В очередь {queue_folder} поставлено месяцев: {len(folders)}")
+    procs = start_local_workers(queue_folder, local_workers)
+    try:
+        jobs = wait_for_jobs(q, prefix)
+    finally:
+        _join(procs)
+        q.close()
+
+    months = set()
+    for result in jobs.loc[jobs["state"] == DONE, "result"]:
+        months.update(json.loads(result).get("months", []))
+    if db is not None and store is not None and months:
+        # в базу перезаливаются только месяцы этого запуска
+        tables = {table: batch.read_store(store, table, months=months) for table in query.SHEET_TABLES}
+        query.register_tables(db, tables, whole_months=True)
+        print(f"[OK] В базу запросов {db} загружены месяцы: {', '.join(sorted(months))}")
+    return jobs
+
+
+def distribute_partitions(folder: Path, queue_folder: Path, store: Path | None, db: Path | None,
+                          local_workers: int = 0, resume: bool = False) -> dict:
+    """
+    Один большой месяц: script1 и script2 считает координатор, лист КСУПТ режется
+    на партиции (Дата, Филиал) — по задаче на партицию; из результатов координатор
+    собирает ЭкспПоказ и итоговую книгу так же, как process_month.
+    """
+    inputs, points, fps = batch.open_month(folder, resume)
+    with prefetch.prefetch(batch.month_reads(inputs, points, fps)) as pending:
+        df_releases, df_kcsupt = batch.build_month_sources(folder, inputs, points, fps, pending)
+        df_src = batch.sheet_frame(df_kcsupt)
+        refs = script3.build_refs(df_src, batch.sheet_frame(df_releases),
+                                  lambda: batch.load_reference(inputs["reference"], pending.get("reference")))
+    parts = script3.split_partitions(df_src) or [df_src]
+
+    run_id = _run_id()
+    work = queue_folder / WORK_SUBFOLDER / run_id
+    work.mkdir(parents=True, exist_ok=True)
+    refs_file = work / "refs.pkl"
+    pd.to_pickle(refs, refs_file)
+
+    q = JobQueue(queue_folder)
+    prefix = f"{run_id}/partition/"
+    outputs = []
+    for i, part in enumerate(parts):
+        source, output = work / f"part_{i:04d}.pkl", work / f"result_{i:04d}.pkl"
+        pd.to_pickle(part, source)
+        q.put(f"{prefix}{i:04d}", "partition", {"source": str(source.resolve()), "refs": str(refs_file.resolve()),
+                                                "output": str(output.resolve())})
+        outputs.append(output)
+    print(f"[INFO] {folder.name}: в очередь {queue_folder} поставлено партиций (Дата, Филиал): {len(parts)}")
+    procs = start_local_workers(queue_folder, local_workers)
+    try:
+        jobs = wait_for_jobs(q, prefix)
+    finally:
+        _join(procs)
+        q.close()
+
+    failed = jobs[jobs["state"] == FAILED]
+    if not failed.empty:
+        errors = "; ".join(f"{r.id}: {r.error}" for r in failed.itertuples())
+        raise RuntimeError(f"{folder.name}: не посчитано партиций {len(failed)} из {len(jobs)} ({errors})")
+
+    df_unique, _ = script3.merge_partitions([pd.read_pickle(p) for p in outputs], df_src, refs)
+    res = batch.finish_month(folder, inputs, df_releases, df_kcsupt, df_unique, store, db)
+    shutil.rmtree(work, ignore_errors=True)
+    return res
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Распределённая обработка через очередь задач на общем диске")
+    parser.add_argument("--queue", type=Path, default=QUEUE_FOLDER, help="папка очереди на общем диске")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    for name, help_text in [("months", "по задаче на папку месяца"),
+                            ("partitions", "один месяц, по задаче на партицию (Дата, Филиал)")]:
+        p = sub.add_parser(name, help=help_text)
+        if name == "months":
+            p.add_argument("folders", nargs="+", type=Path, help="папки месяцев")
+        else:
+            p.add_argument("folder", type=Path, help="папка месяца")
+            p.add_argument("--resume", action="store_true", help="script1/script2 — с контрольных точек")
+        p.add_argument("--store", type=Path, default=batch.STORE_FOLDER, help="папка хранилища; '-' — не писать")
+        p.add_argument("--db", type=Path, default=batch.DB_FILE, help="база SQLite для запросов; '-' — не обновлять")
+        p.add_argument("--local-workers", type=int, default=0,
+                       help="сколько обработчиков запустить на этой машине (0 — только ждать внешних)")
+
+    p_worker = sub.add_parser("worker", help="обработчик: брать задачи из очереди")
+    p_worker.add_argument("--id", default=None, help="имя обработчика (по умолчанию хост:pid)")
+    p_worker.add_argument("--wait", action="store_true", help="не завершаться, когда очередь пуста")
+
+    sub.add_parser("status", help="состояние задач в очереди")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.command == "worker":
+        run_worker(args.queue, args.id, wait=args.wait)
+        return
+    if args.command == "status":
+        q = JobQueue(args.queue)
+        with pd.option_context("display.max_rows", 500, "display.width", 200, "display.max_colwidth", 60):
+            print(q.status().to_string(index=False))
+        q.close()
+        return
+
+    store = None if str(args.store) == "-" else args.store
+    db = None if str(args.db) == "-" else args.db
+    if args.local_workers == 0:
+        print(f"[INFO] Жду обработчики: python distributed.py --queue {args.queue} worker")
+
+    if args.command == "months":
+        jobs = distribute_months(args.folders, args.queue, store, db, args.local_workers)
+        for r in jobs.itertuples():
+            print(f"[{'OK' if r.state == DONE else 'ERROR'}] {r.id}: {r.result if r.state == DONE else r.error}")
+        failed = int((jobs["state"] != DONE).sum())
+        if failed:
+            print(f"[ERROR] Не обработано папок: {failed} из {len(jobs)}")
+            sys.exit(1)
+        print("[DONE] Распределённая обработка завершена ✅")
+        return
+
+    try:
+        res = distribute_partitions(args.folder, args.queue, store, db, args.local_workers, resume=args.resume)
+    except Exception as e:
+        print(f"[ERROR] {e}")
+        sys.exit(1)
+    rows = ", ".join(f"{t}={n}" for t, n in res["rows"].items())
+    print(f"[OK] {res['folder']}: {res['output']}; строк: {rows}")
+    print("[DONE] Распределённая обработка завершена ✅")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import os
+import sys
+import zipfile
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import pandas as pd
+
+# =====================
+# НАСТРОЙКИ
+# =====================
+FORMATS = ["xlsx", "csv", "parquet"]
+EXPORT_SHEETS = ["ЭкспПоказ", "Выпуск и рейсы КСУПТ"]
+SPLIT_COL = "Филиал"
+NO_FILIAL = "без филиала"
+CSV_SEP = ";"
+CSV_ENCODING = "utf-8-sig"  # с BOM — Excel открывает кириллицу без перекодировки
+# =====================
+
+
+def to_columnar(df: pd.DataFrame) -> pd.DataFrame:
+    """Приводит object-колонки к однородным типам, чтобы их можно было записать в Parquet."""
+    out = df.copy()
+    for col in out.columns:
+        if out[col].dtype != object:
+            continue
+        values = out[col]
+        numeric = pd.to_numeric(values, errors="coerce")
+        if numeric.notna().sum() == values.notna().sum() and values.notna().any():
+            out[col] = numeric
+        else:
+            out[col] = values.where(values.isna(), values.astype(str))
+    return out
+
+
+def split_by_filial(df: pd.DataFrame) -> dict:
+    """{филиал: строки филиала}; строки без филиала попадают в NO_FILIAL."""
+    if SPLIT_COL not in df.columns:
+        return {None: df}
+    keys = df[SPLIT_COL].where(df[SPLIT_COL].notna(), NO_FILIAL).astype(str).str.strip().replace("", NO_FILIAL)
+    return {filial: part for filial, part in df.groupby(keys, sort=True)}
+
+
+def export_path(out_dir: Path, sheet: str, filial, fmt: str) -> Path:
+    name = sheet if filial is None else f"{sheet}_{filial}"
+    return out_dir / f"{name.replace('/', '_')}.{fmt}"
+
+
+def write_frame(df: pd.DataFrame, path: Path, fmt: str, sheet: str) -> Path:
+    if fmt == "xlsx":
+        df.to_excel(path, sheet_name=sheet[:31], index=False)
+    elif fmt == "csv":
+        df.to_csv(path, sep=CSV_SEP, index=False, encoding=CSV_ENCODING)
+    elif fmt == "parquet":
+        to_columnar(df).to_parquet(path, index=False)
+    else:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+    return path
+
+
+def _write_task(task) -> tuple:
+    df, path, fmt, sheet = task
+    write_frame(df, path, fmt, sheet)
+    return path, path.stat().st_size
+
+
+def export_tables(tables: dict, out_dir: Path, formats=("xlsx",), split: bool = False,
+                  workers: int | None = None, zip_path: Path | None = None) -> list:
+    """
+    Выгружает {лист: DataFrame} в каждом из formats, по желанию — отдельным файлом
+    на каждый филиал. Файлы пишутся параллельно (по процессу на файл, крупные первыми),
+    zip_path — дополнительно собрать всё в один архив.
+    Возвращает [(путь, размер в байтах)].
+    """
+    for fmt in formats:
+        if fmt not in FORMATS:
+            raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    tasks = []
+    for sheet, df in tables.items():
+        parts = split_by_filial(df) if split else {None: df}
+        for filial, part in parts.items():
+            for fmt in formats:
+                tasks.append((part, export_path(out_dir, sheet, filial, fmt), fmt, sheet))
+    tasks.sort(key=lambda t: len(t[0]), reverse=True)
+
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    if workers <= 1:
+        written = [_write_task(t) for t in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            written = list(pool.map(_write_task, tasks))
+
+    if zip_path is not None:
+        with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            for path, _ in sorted(written):
+                zf.write(path, arcname=path.name)
+        written.append((zip_path, zip_path.stat().st_size))
+    return written
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Выгрузка ЭкспПоказ и листа КСУПТ в XLSX/CSV/Parquet")
+    parser.add_argument("workbook", type=Path, help="ЭП_итог.xlsx")
+    parser.add_argument("-o", "--output", type=Path, default=None, help="папка выгрузки (по умолчанию — рядом с книгой)")
+    parser.add_argument("-f", "--formats", nargs="+", choices=FORMATS, default=["xlsx"], help="форматы файлов")
+    parser.add_argument("--split", action="store_true", help="отдельный файл на каждый филиал")
+    parser.add_argument("--zip", action="store_true", help="собрать файлы в один zip")
+    parser.add_argument("--workers", type=int, default=None, help="число процессов (по умолчанию — число ядер)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.workbook.exists():
+        print(f"[ERROR] Не найден файл: {args.workbook}")
+        sys.exit(1)
+    out_dir = args.output or args.workbook.with_name("выгрузка")
+
+    tables = pd.read_excel(args.workbook, sheet_name=EXPORT_SHEETS)
+    zip_path = out_dir / f"{args.workbook.stem}.zip" if args.zip else None
+    written = export_tables(tables, out_dir, args.formats, split=args.split, workers=args.workers, zip_path=zip_path)
+    for path, size in written:
+        print(f"[OK] {path.name}: {size / 1024:.1f} КБ")
+    print(f"[DONE] Выгружено файлов: {len(written)} в {out_dir}")
+
+
+if __name__ == "__main__":
+    main()
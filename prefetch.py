@@ -0,0 +1,39 @@
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
+
+# =====================
+# НАСТРОЙКИ
+# =====================
+# Чтение xlsx (openpyxl) — это работа интерпретатора, потоки упираются в GIL,
+# поэтому независимые чтения идут в отдельных процессах.
+MAX_WORKERS = 4
+# =====================
+
+
+def _done(fn, args) -> Future:
+    fut = Future()
+    try:
+        fut.set_result(fn(*args))
+    except Exception as e:
+        fut.set_exception(e)
+    return fut
+
+
+@contextmanager
+def prefetch(reads: dict, workers: int | None = None):
+    """
+    Запускает все независимые чтения сразу и отдаёт {имя: Future}.
+    reads — {имя: (функция, аргументы...)}; функции и аргументы должны передаваться
+    в процесс (функции модуля, пути). Этап, которому нужен один вход, ждёт только его
+    future, пока остальные файлы ещё разбираются. workers=1 — читать по очереди в этом процессе.
+    """
+    workers = min(workers or MAX_WORKERS, len(reads), os.cpu_count() or 1)
+    if workers <= 1:
+        yield {name: _done(fn, args) for name, (fn, *args) in reads.items()}
+        return
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        yield {name: pool.submit(fn, *args) for name, (fn, *args) in reads.items()}
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,220 @@
+import os
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import pandas as pd
+
+import script1
+import script2
+import script3
+
+# =====================
+# НАСТРОЙКИ
+# =====================
+PROBE_ROWS = 5  # строк, которые читаются из отметок и справочника ЭП (шапка + несколько строк)
+JULY_MIN_COLS = 23  # script3 берёт из справочника колонки A..W
+
+# лист ЭП_итог.xlsx -> колонки, без которых script3 не посчитает ЭкспПоказ
+RESULT_SHEETS = {
+    "Sheet1": ["Ключ 2", "Ключ 4", "КТР", "ПланВыпуск", "ФактВыпуск", "ПланРейсы", "ФактРейсы"],
+    script3.SOURCE_SHEET: ["Ключ 2", "Ключ 4", "Ключ 5", "Не ноль рейсов", "Факт рейсов"],
+}
+MARKS_OPTIONAL = ["Выход"]  # без неё не считается 'Выпуск факт КСУПТ'
+RESULT_OPTIONAL = {script3.SOURCE_SHEET: MARKS_OPTIONAL}  # лист КСУПТ наследует колонку из отметок
+# файлы-блокировки рядом с открытой книгой: Excel (Windows и macOS) и LibreOffice
+LOCK_FILES = ["~${}", ".~lock.{}#"]
+
+ERROR = "ERROR"
+WARN = "WARN"
+REPORT_COLUMNS = ["Уровень", "Файл", "Проверка"]
+# =====================
+
+
+def _problem(level: str, path: Path, message: str) -> dict:
+    return {"Уровень": level, "Файл": f"{path.parent.name}/{path.name}", "Проверка": message}
+
+
+def check_release(path: Path) -> list:
+    """Файл выпуска: дата в имени, шапка с маршрутом и маркер типа ТС в первых строках."""
+    problems = []
+    if not script1.extract_date_from_filename(path.name):
+        problems.append(_problem(ERROR, path, "в имени файла нет даты ДД.ММ.ГГГГ — ключи будут без даты"))
+    head = script1.read_excel_auto(path, nrows=script1.LAYOUT_HEAD_ROWS)
+    header_rows = script1.find_header_rows(head)
+    markers = script1.find_transport_headers(head)
+    if not header_rows and not markers:
+        problems.append(_problem(ERROR, path, f"в первых {script1.LAYOUT_HEAD_ROWS} строках нет ни шапки "
+                                              "'№ м-та', ни типа ТС — не похоже на выгрузку выпуска"))
+    elif not markers:
+        problems.append(_problem(WARN, path, f"в первых {script1.LAYOUT_HEAD_ROWS} строках нет маркера типа ТС"))
+    elif not {t for t, _ in markers} & script1.ALLOWED_TTYPES:
+        problems.append(_problem(WARN, path, f"в первых строках только {sorted({t for t, _ in markers})} — "
+                                             f"нужные типы {sorted(script1.ALLOWED_TTYPES)} могут быть ниже"))
+    elif not header_rows:
+        problems.append(_problem(WARN, path, "шапка '№ м-та' не найдена — будут взяты стандартные позиции колонок"))
+    return problems
+
+
+def check_marks(path: Path) -> list:
+    """Отметки выхода: колонки, которые требует script2."""
+    columns = set(pd.read_excel(path, nrows=PROBE_ROWS).columns)
+    problems = []
+    missing = script2.REQUIRED_COLS - columns
+    if missing:
+        problems.append(_problem(ERROR, path, f"нет колонок {sorted(missing)}"))
+    for col in MARKS_OPTIONAL:
+        if col not in columns:
+            problems.append(_problem(WARN, path, f"нет колонки '{col}' — 'Выпуск факт КСУПТ' будет нулевым"))
+    return problems
+
+
+def check_reference(path: Path) -> list:
+    """Справочник ЭП июль: колонки A..W и хотя бы одна строка данных."""
+    head = pd.read_excel(path, nrows=PROBE_ROWS, dtype=object)
+    problems = []
+    if head.shape[1] < JULY_MIN_COLS:
+        problems.append(_problem(ERROR, path, f"колонок {head.shape[1]}, нужно не меньше {JULY_MIN_COLS} (A..W)"))
+    if head.empty:
+        problems.append(_problem(WARN, path, "справочник пуст"))
+    return problems
+
+
+def check_result(path: Path, sheets: bool = True) -> list:
+    """
+    Итоговая книга: её можно перезаписать (не открыта и не заблокирована);
+    sheets=True — в ней есть листы и колонки, которые читает script3.
+    Открытую книгу Windows не даёт открыть на запись; на macOS и Linux запись не блокируется,
+    поэтому открытая книга видна только по файлу-блокировке рядом с ней (LOCK_FILES).
+    Если Excel упал и оставил такой файл, проверка сработает ложно — его нужно удалить.
+    """
+    problems = []
+    if not path.exists():
+        if sheets:
+            problems.append(_problem(ERROR, path, "итоговая книга не найдена"))
+        return problems
+    locks = [lock for lock in (path.with_name(p.format(path.name)) for p in LOCK_FILES) if lock.exists()]
+    if locks:
+        problems.append(_problem(ERROR, path, f"книга открыта (есть файл-блокировка {locks[0].name}) — закройте её"))
+    elif not os.access(path, os.W_OK):
+        problems.append(_problem(ERROR, path, "нет прав на запись в книгу"))
+    else:
+        try:
+            with open(path, "r+b"):
+                pass
+        except OSError as e:
+            problems.append(_problem(ERROR, path, f"книгу нельзя перезаписать (открыта в Excel?): {e}"))
+    if not sheets:
+        return problems
+
+    names = pd.ExcelFile(path).sheet_names
+    missing = [s for s in RESULT_SHEETS if s not in names]
+    if missing:
+        problems.append(_problem(ERROR, path, f"нет листов {missing}"))
+    present = [s for s in RESULT_SHEETS if s in names]
+    for sheet, df in pd.read_excel(path, sheet_name=present, nrows=0).items():
+        lost = [c for c in RESULT_SHEETS[sheet] if c not in df.columns]
+        if lost:
+            problems.append(_problem(ERROR, path, f"лист '{sheet}': нет колонок {lost}"))
+        for col in RESULT_OPTIONAL.get(sheet, []):
+            if col not in df.columns:
+                problems.append(_problem(WARN, path, f"лист '{sheet}': нет колонки '{col}' — "
+                                                     "'Выпуск факт КСУПТ' будет нулевым"))
+    return problems
+
+
+CHECKS = {
+    "release": check_release,
+    "marks": check_marks,
+    "reference": check_reference,
+    "result": lambda path: check_result(path, sheets=False),
+    "result_sheets": check_result,
+}
+
+
+def _probe(task) -> list:
+    kind, path = task
+    if not path.exists() and kind != "result":
+        return [_problem(ERROR, path, "файл не найден")]
+    try:
+        return CHECKS[kind](path)
+    except Exception as e:
+        return [_problem(ERROR, path, f"не удалось прочитать: {e}")]
+
+
+def month_tasks(inputs: dict) -> list:
+    """Задачи проверки для папки месяца (словарь batch.resolve_month_inputs)."""
+    tasks = [("release", p) for p in inputs["releases"]]
+    tasks += [("marks", inputs["marks"]), ("reference", inputs["reference"]), ("result", inputs["output"])]
+    return tasks
+
+
+def run_preflight(tasks: list, workers: int | None = None, pool=None) -> pd.DataFrame:
+    """
+    Проверяет все входы параллельно (по процессу на файл), читая только имена листов
+    и первые строки. tasks — [(вид, путь)], вид из CHECKS. pool — уже поднятый пул процессов.
+    Возвращает сводный отчёт: одна строка на найденную проблему.
+    """
+    if pool is not None:
+        results = list(pool.map(_probe, tasks))
+    else:
+        workers = min(workers or os.cpu_count() or 1, len(tasks) or 1)
+        if workers <= 1:
+            results = [_probe(t) for t in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_probe, tasks))
+    return pd.DataFrame([p for problems in results for p in problems], columns=REPORT_COLUMNS)
+
+
+def has_errors(report: pd.DataFrame) -> bool:
+    return bool((report["Уровень"] == ERROR).any())
+
+
+def format_report(report: pd.DataFrame) -> str:
+    return "\n".join(f"[{r['Уровень']}] {r['Файл']}: {r['Проверка']}" for _, r in report.iterrows())
+
+
+def print_report(report: pd.DataFrame, checked: int):
+    if report.empty:
+        print(f"[OK] Предпроверка: файлов={checked}, проблем нет")
+        return
+    print(format_report(report))
+    errors = int((report["Уровень"] == ERROR).sum())
+    print(f"[INFO] Предпроверка: файлов={checked}, ошибок={errors}, предупреждений={len(report) - errors}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Быстрая проверка входных файлов до полной обработки")
+    parser.add_argument("folders", nargs="*", type=Path, help="папки месяцев (как для batch.py)")
+    parser.add_argument("--result", type=Path, default=None,
+                        help="проверить готовую ЭП_итог.xlsx перед script3 (листы Sheet1 и КСУПТ)")
+    parser.add_argument("--workers", type=int, default=None, help="число процессов (по умолчанию — число ядер)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    import batch
+
+    args = parse_args(argv)
+    tasks = []
+    for folder in args.folders:
+        try:
+            tasks += month_tasks(batch.resolve_month_inputs(folder))
+        except FileNotFoundError as e:
+            print(f"[ERROR] {e}")
+            sys.exit(1)
+    if args.result is not None:
+        tasks.append(("result_sheets", args.result))
+    if not tasks:
+        print("[ERROR] Нечего проверять: укажите папки месяцев или --result")
+        sys.exit(1)
+
+    report = run_preflight(tasks, workers=args.workers)
+    print_report(report, len(tasks))
+    if has_errors(report):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+import sys
+import sqlite3
+import argparse
+from pathlib import Path
+import pandas as pd
+
+import routes
+
+# =====================
+# НАСТРОЙКИ / ПУТИ
+# =====================
+BASE_FOLDER = Path("/Users/mikhailsokolov/Desktop/МГТ/Рейсы")
+DB_FILE = BASE_FOLDER / "ЭП" / "ЭП.sqlite"
+
+# таблица базы -> лист ЭП_итог.xlsx
+SHEET_TABLES = {
+    "releases": "Sheet1",
+    "kcsupt": "Выпуск и рейсы КСУПТ",
+    "exp_pokaz": "ЭкспПоказ",
+}
+
+# история маршрута: отдельная таблица, отсортированная по (маршрут, дата) составным индексом
+ROUTE_TABLE = "route_history"
+ROUTE_COL = "Маршрут_норм"
+HISTORY_COLUMNS = [
+    "Дата", "Маршрут", "Филиал", "Авт/Эл", "Площадка", "КТР",
+    "Выпус План ПКД", "Выпуск Факт ПКД", "Рейсы План ПКД", "Рейсы Факт ПКД",
+    "Корр. Выпуск План", "Корр. Выпуск Факт", "Корр. Рейсы План", "Корр. Рейсы Факт",
+    "Выпуск факт КСУПТ", "Рейсы факт КСУПТ",
+]
+
+MONTH_COL = "Месяц"
+DATE_ISO_COL = "Дата_iso"
+INDEX_COLUMNS = [MONTH_COL, DATE_ISO_COL, "Ключ 2", "Ключ 4", "Ключ 5", "Филиал", "Маршрут", "№\nм-та", "Площадка"]
+COMPOSITE_INDEXES = {ROUTE_TABLE: [ROUTE_COL, DATE_ISO_COL]}
+# =====================
+
+
+def month_of(dates: pd.Series) -> pd.Series:
+    return pd.to_datetime(dates, format="%d.%m.%Y", errors="coerce").dt.strftime("%Y-%m").fillna("unknown")
+
+
+def _quote(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def connect(db_file: Path) -> sqlite3.Connection:
+    db_file.parent.mkdir(parents=True, exist_ok=True)
+    con = sqlite3.connect(db_file, timeout=30)
+    con.execute("PRAGMA journal_mode=WAL")
+    return con
+
+
+def _table_columns(con: sqlite3.Connection, table: str) -> list:
+    return [row[1] for row in con.execute(f"PRAGMA table_info({_quote(table)})")]
+
+
+def _prepare(df: pd.DataFrame) -> pd.DataFrame:
+    out = df.copy()
+    if "Дата" in out.columns:
+        dates = pd.to_datetime(out["Дата"], format="%d.%m.%Y", errors="coerce")
+        out[DATE_ISO_COL] = dates.dt.strftime("%Y-%m-%d")
+        if MONTH_COL not in out.columns:
+            out[MONTH_COL] = month_of(out["Дата"])
+    return out
+
+
+def register_table(con: sqlite3.Connection, table: str, df: pd.DataFrame, whole_months: bool = False):
+    """
+    Заменяет в таблице строки тех дат, что есть в df (повторный прогон не дублирует
+    данные, а загрузка части месяца не стирает остальные дни), добавляет недостающие
+    колонки и индексы. whole_months — заменить месяцы df целиком (df содержит месяц полностью).
+    """
+    df = _prepare(df)
+    existing = _table_columns(con, table)
+    if existing:
+        for col in df.columns:
+            if col not in existing:
+                con.execute(f"ALTER TABLE {_quote(table)} ADD COLUMN {_quote(col)}")
+        col = MONTH_COL if whole_months else DATE_ISO_COL
+        if col in df.columns and col in existing:
+            values = df[col].dropna().unique().tolist()
+            con.executemany(f"DELETE FROM {_quote(table)} WHERE {_quote(col)} = ?", [(v,) for v in values])
+            if df[col].isna().any():
+                con.execute(f"DELETE FROM {_quote(table)} WHERE {_quote(col)} IS NULL")
+        else:
+            con.execute(f"DELETE FROM {_quote(table)}")
+    df.to_sql(table, con, if_exists="append", index=False, chunksize=5000)
+
+    for col in INDEX_COLUMNS:
+        if col in df.columns:
+            name = f"ix_{table}_{INDEX_COLUMNS.index(col)}"
+            con.execute(f"CREATE INDEX IF NOT EXISTS {_quote(name)} ON {_quote(table)} ({_quote(col)})")
+    if table in COMPOSITE_INDEXES:
+        cols = ", ".join(_quote(c) for c in COMPOSITE_INDEXES[table])
+        con.execute(f"CREATE INDEX IF NOT EXISTS {_quote('ix_' + table + '_key')} ON {_quote(table)} ({cols})")
+
+
+def build_route_history(df_exp: pd.DataFrame) -> pd.DataFrame:
+    """Строки ЭкспПоказ, нужные для истории маршрута, с нормализованным маршрутом (как в Ключ 2)."""
+    out = df_exp[[c for c in HISTORY_COLUMNS if c in df_exp.columns]].copy()
+    out.insert(0, ROUTE_COL, routes.normalize_route_series(df_exp["Маршрут"]))
+    return out[out[ROUTE_COL] != ""]
+
+
+def register_tables(db_file: Path, tables: dict, whole_months: bool = False):
+    """
+    Загружает таблицы в базу (по датам; whole_months — месяцами целиком, см. register_table);
+    из exp_pokaz заодно обновляется индекс истории маршрутов.
+    """
+    tables = dict(tables)
+    exp_pokaz = tables.get("exp_pokaz")
+    if exp_pokaz is not None and "Маршрут" in exp_pokaz.columns:
+        tables[ROUTE_TABLE] = build_route_history(exp_pokaz)
+    con = connect(db_file)
+    try:
+        with con:
+            for table, df in tables.items():
+                if df is not None and not df.empty:
+                    register_table(con, table, df, whole_months)
+    finally:
+        con.close()
+
+
+def register_workbook(db_file: Path, workbook: Path):
+    sheets = pd.read_excel(workbook, sheet_name=None, dtype=object)
+    tables = {table: sheets.get(sheet) for table, sheet in SHEET_TABLES.items()}
+    register_tables(db_file, tables)
+    return {t: len(df) for t, df in tables.items() if df is not None}
+
+
+def run_query(sql: str, params=None, db_file: Path = DB_FILE) -> pd.DataFrame:
+    """Выполняет произвольный SQL над таблицами releases / kcsupt / exp_pokaz."""
+    con = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+    try:
+        return pd.read_sql_query(sql, con, params=params)
+    finally:
+        con.close()
+
+
+def _iso_date(value):
+    if value is None or value == "":
+        return None
+    if hasattr(value, "strftime"):
+        return value.strftime("%Y-%m-%d")
+    # ISO (ГГГГ-ММ-ДД) нельзя разбирать с dayfirst: '2025-08-02' прочиталось бы как 8 февраля
+    iso = pd.to_datetime(str(value), format="%Y-%m-%d", errors="coerce")
+    if pd.notna(iso):
+        return iso.strftime("%Y-%m-%d")
+    return pd.to_datetime(str(value), dayfirst=True).strftime("%Y-%m-%d")
+
+
+def route_history(route: str, date_from=None, date_to=None, db_file: Path = DB_FILE) -> pd.DataFrame:
+    """
+    Ряд по одному маршруту за все загруженные месяцы, по дате.
+    route — в любом написании ('Е10', 'e10', '15к/гк'); даты — 'ДД.ММ.ГГГГ', ISO или date.
+    """
+    sql = f"SELECT * FROM {ROUTE_TABLE} WHERE {_quote(ROUTE_COL)} = ?"
+    params = [routes.normalize_route(route)]
+    if date_from is not None and date_from != "":
+        sql += f" AND {_quote(DATE_ISO_COL)} >= ?"
+        params.append(_iso_date(date_from))
+    if date_to is not None and date_to != "":
+        sql += f" AND {_quote(DATE_ISO_COL)} <= ?"
+        params.append(_iso_date(date_to))
+    sql += f" ORDER BY {_quote(DATE_ISO_COL)}"
+    df = run_query(sql, params, db_file)
+    return df.drop(columns=[ROUTE_COL, MONTH_COL], errors="ignore")
+
+
+def list_tables(db_file: Path = DB_FILE) -> pd.DataFrame:
+    rows = []
+    con = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+    try:
+        for (name,) in con.execute("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name"):
+            count = con.execute(f"SELECT COUNT(*) FROM {_quote(name)}").fetchone()[0]
+            months = [m for (m,) in con.execute(f"SELECT DISTINCT {_quote(MONTH_COL)} FROM {_quote(name)} ORDER BY 1")] \
+                if MONTH_COL in _table_columns(con, name) else []
+            rows.append({"Таблица": name, "Строк": count, "Месяцы": ", ".join(map(str, months))})
+    finally:
+        con.close()
+    return pd.DataFrame(rows)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Запросы к результатам обработки (SQLite)")
+    parser.add_argument("--db", type=Path, default=DB_FILE, help="файл базы")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_reg = sub.add_parser("register", help="загрузить ЭП_итог.xlsx в базу")
+    p_reg.add_argument("workbooks", nargs="+", type=Path)
+
+    p_sql = sub.add_parser("sql", help="выполнить запрос")
+    p_sql.add_argument("query")
+    p_sql.add_argument("-o", "--output", type=Path, default=None, help="сохранить результат в .csv/.xlsx")
+
+    p_route = sub.add_parser("route", help="история маршрута по всем загруженным месяцам")
+    p_route.add_argument("route")
+    p_route.add_argument("--from", dest="date_from", default=None, help="с даты (ДД.ММ.ГГГГ)")
+    p_route.add_argument("--to", dest="date_to", default=None, help="по дату (ДД.ММ.ГГГГ)")
+    p_route.add_argument("-o", "--output", type=Path, default=None, help="сохранить результат в .csv/.xlsx")
+
+    sub.add_parser("tables", help="список таблиц")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.command == "register":
+        for wb in args.workbooks:
+            if not wb.exists():
+                print(f"[ERROR] Не найден файл: {wb}")
+                sys.exit(1)
+            counts = register_workbook(args.db, wb)
+            print(f"[OK] {wb.name} загружен в {args.db}: {counts}")
+        return
+
+    if not args.db.exists():
+        print(f"[ERROR] Не найдена база: {args.db}")
+        sys.exit(1)
+
+    if args.command == "tables":
+        print(list_tables(args.db).to_string(index=False))
+        return
+
+    try:
+        if args.command == "route":
+            df = route_history(args.route, args.date_from, args.date_to, db_file=args.db)
+        else:
+            df = run_query(args.query, db_file=args.db)
+    except Exception as e:
+        print(f"[ERROR] {e}")
+        sys.exit(1)
+    if args.output:
+        if args.output.suffix.lower() == ".xlsx":
+            df.to_excel(args.output, index=False)
+        else:
+            df.to_csv(args.output, index=False)
+        print(f"[OK] Строк: {len(df)}, сохранено в {args.output}")
+    else:
+        with pd.option_context("display.max_rows", 200, "display.width", 200):
+            print(df.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
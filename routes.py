@@ -0,0 +1,129 @@
+import re
+import difflib
+import pandas as pd
+
+# =====================
+# НОРМАЛИЗАЦИЯ И ИНДЕКС МАРШРУТОВ
+# =====================
+# Одна каноническая форма маршрута для всех скриптов: латинские буквы, которые
+# выглядят как кириллические, переводятся в кириллицу через str.translate.
+# "С3" (кир.) и "C3" (лат.) — один и тот же маршрут.
+
+LAT_TO_CYR = {"A":"А","B":"В","C":"С","E":"Е","H":"Н","K":"К","M":"М","O":"О","P":"Р","T":"Т","X":"Х","Y":"У","Z":"З","S":"С","V":"В"}
+
+_CANON_UPPER = str.maketrans(LAT_TO_CYR)
+_CANON_LOWER = str.maketrans({k.lower(): v.lower() for k, v in LAT_TO_CYR.items()})
+
+GK_SUFFIX_RE = re.compile(r'\s*/\s*гк(?:\s*-\s*[\w\-а-яё\d]+)?', re.IGNORECASE)
+# максимальные серии [0-9A-Za-zА-Яа-яЁё-], в которых есть хотя бы одна цифра
+ROUTE_TOKEN_RE = re.compile(r'[0-9A-Za-zА-Яа-яЁё\-]*\d[0-9A-Za-zА-Яа-яЁё\-]*')
+DASHES_RE = re.compile(r'-+')
+
+
+def strip_gk_suffix(value: str) -> str:
+    return GK_SUFFIX_RE.sub('', str(value)).strip()
+
+
+def normalize_route(value) -> str:
+    """Форма маршрута для ключей (Ключ 2 и т.д.): нижний регистр, без '_' и '/гк', кириллица."""
+    s = str(value).strip().replace("_", "").lower()
+    return strip_gk_suffix(s).replace("_", "").translate(_CANON_LOWER)
+
+
+def normalize_route_series(series: pd.Series) -> pd.Series:
+    return (
+        series.fillna("")
+              .astype(str)
+              .str.strip()
+              .str.replace("_", "", regex=False)
+              .str.lower()
+              .str.replace(GK_SUFFIX_RE, "", regex=True)
+              .str.strip()
+              .str.replace("_", "", regex=False)
+              .str.translate(_CANON_LOWER)
+    )
+
+
+def normalize_key_series(series: pd.Series) -> pd.Series:
+    """Ключи 2/4/5 для сравнения: NBSP -> пробел, пробелы схлопнуты, пустые -> '<__NA__>'."""
+    return (
+        series.where(series.notna(), "<__NA__>")
+              .astype(str)
+              .str.replace("\xa0", " ", regex=False)
+              .str.replace(r"\s+", " ", regex=True)
+              .str.strip()
+    )
+
+
+def canonical_token(token: str) -> str:
+    return DASHES_RE.sub('-', token.upper()).strip('-').translate(_CANON_UPPER)
+
+
+def _candidates_from_tokens(tokens) -> list:
+    out = []
+    for t in tokens:
+        c = canonical_token(t)
+        if c and c not in out:
+            out.append(c)
+    return out
+
+
+def route_candidates(cell_value) -> list:
+    """Канонические номера маршрутов из произвольной ячейки (токены с цифрами, в порядке появления)."""
+    if cell_value is None or (not isinstance(cell_value, str) and pd.isna(cell_value)):
+        return []
+    return _candidates_from_tokens(ROUTE_TOKEN_RE.findall(str(cell_value)))
+
+
+def route_candidates_series(series: pd.Series) -> pd.Series:
+    """Векторный вариант route_candidates для целой колонки."""
+    tokens = series.where(series.notna(), "").astype(str).str.findall(ROUTE_TOKEN_RE)
+    return tokens.map(_candidates_from_tokens)
+
+
+class RouteIndex:
+    """
+    Справочник по каноническим маршрутам. Три уровня поиска, как и раньше:
+    точный ключ (дата маршрут филиал тип) -> (дата, маршрут) -> маршрут.
+    Для каждого ключа хранится первая встреченная запись.
+    """
+
+    def __init__(self):
+        self.exact = {}
+        self.date_route = {}
+        self.route = {}
+        self._route_list = None
+
+    def __len__(self):
+        return len(self.route)
+
+    def add(self, key_norm, date, routes: list, entry):
+        self._route_list = None
+        if key_norm:
+            self.exact.setdefault(key_norm, entry)
+        for r in routes:
+            if date:
+                self.date_route.setdefault((date, r), entry)
+            self.route.setdefault(r, entry)
+
+    def lookup(self, key_norm, date, routes: list):
+        if key_norm and key_norm in self.exact:
+            return self.exact[key_norm]
+        if date:
+            for r in routes:
+                entry = self.date_route.get((date, r))
+                if entry is not None:
+                    return entry
+        for r in routes:
+            entry = self.route.get(r)
+            if entry is not None:
+                return entry
+        return None
+
+    def nearest(self, route: str, n: int = 3, cutoff: float = 0.6) -> list:
+        """Похожие маршруты справочника (difflib), ближайшие первыми; сам маршрут — если он есть."""
+        if not route:
+            return []
+        if self._route_list is None:
+            self._route_list = list(self.route)
+        return difflib.get_close_matches(route, self._route_list, n=n, cutoff=cutoff)
@@ -5,6 +5,8 @@ from typing import Optional, Tuple, List
 import numpy as np
 import pandas as pd
 
+from routes import GK_SUFFIX_RE, normalize_route_series
+
 
 
 # НАСТРОЙКИ / ПУТИ
@@ -12,6 +14,7 @@ import pandas as pd
 SOURCE_FOLDER = Path("/Users/mikhailsokolov/Desktop/МГТ/Рейсы")
 OUTPUT_FOLDER = SOURCE_FOLDER / "ЭП"
 OUTPUT_FILE = OUTPUT_FOLDER / "ЭП_итог.xlsx"
+RELEASE_GLOB = "Выпуск*.xls*"
 # =====================
 
 
@@ -31,20 +34,37 @@ TRANSPORT_ABBR = {
 
 ALLOWED_BRANCHES = {"ЮЗ", "СВ", "СЗ", "Ю"}
 
-GK_SUFFIX_RE = re.compile(r'\s*/\s*гк(?:\s*-\s*[\w\-а-яё\d]+)?', re.IGNORECASE)
+# Раскладка по умолчанию (номера колонок выгрузки Мосгортранс), если шапку распознать не удалось
+DEFAULT_LAYOUT = {
+    "Филиал_raw": 1,
+    "Маршрут_raw": 2,
+    "ПланВыпуск": 3,
+    "ФактВыпуск": 8,
+    "ПланРейсы": 13,
+    "ФактРейсы": 14,
+    "Потери": 15,
+}
+
+METRIC_KEYWORDS = {
+    "ПланВыпуск": ("выпуск", "план"),
+    "ФактВыпуск": ("выпуск", "факт"),
+    "ПланРейсы": ("рейс", "план"),
+    "ФактРейсы": ("рейс", "факт"),
+    "Потери": ("потер",),
+}
 
-def has_gk_suffix(value) -> bool:
-    return bool(GK_SUFFIX_RE.search(str(value)))
+ROUTE_HEADER_RE = re.compile(r'№\s*м-?та|маршрут', re.IGNORECASE)
+LAYOUT_HEAD_ROWS = 40
+LAYOUT_HEADER_DEPTH = 3
 
-def strip_gk_suffix(value: str) -> str:
-    return GK_SUFFIX_RE.sub('', str(value)).strip()
+_LAYOUT_CACHE = {}
 
-def read_excel_auto(file_path: Path) -> pd.DataFrame:
+def read_excel_auto(file_path: Path, **kwargs) -> pd.DataFrame:
     ext = file_path.suffix.lower()
     if ext in (".xlsx", ".xlsm"):
-        return pd.read_excel(file_path, header=None, engine="openpyxl")
+        return pd.read_excel(file_path, header=None, engine="openpyxl", **kwargs)
     elif ext == ".xls":
-        return pd.read_excel(file_path, header=None, engine="xlrd")
+        return pd.read_excel(file_path, header=None, engine="xlrd", **kwargs)
     raise RuntimeError(f"Unsupported format: {ext}")
 
 def normalize_branch(name: Optional[str]) -> str:
@@ -140,9 +160,93 @@ def extract_date_from_filename(filename: str) -> str:
                 return date_str
     return ""
 
+def _cell_text(value) -> str:
+    return str(value).strip().lower() if pd.notna(value) else ""
+
+def is_route_header_cell(value) -> bool:
+    txt = _cell_text(value)
+    return bool(ROUTE_HEADER_RE.search(txt)) and len(txt) <= 20
+
+def find_header_rows(head: pd.DataFrame) -> List[int]:
+    """Строка с '№ м-та'/'Маршрут' и следующие за ней строки шапки (до первой строки данных)."""
+    for idx in range(len(head)):
+        if any(is_route_header_cell(v) for v in head.iloc[idx].tolist()):
+            rows = [idx]
+            for nxt in range(idx + 1, min(idx + LAYOUT_HEADER_DEPTH, len(head))):
+                txt = row_text(head, nxt)
+                if any(k in txt for kws in TRANSPORT_MARKERS.values() for k in kws):
+                    break
+                if detect_branch_in_row(head.iloc[nxt]) in ALLOWED_BRANCHES:
+                    break
+                rows.append(nxt)
+            return rows
+    return []
+
+def detect_layout(head: pd.DataFrame) -> dict:
+    """
+    Находит шапку и смысловые колонки по первым строкам файла.
+    Результат кешируется по отпечатку шапки: файлы одной выгрузки разбираются один раз.
+    """
+    header_rows = find_header_rows(head)
+    if not header_rows:
+        return {"fingerprint": None, "columns": dict(DEFAULT_LAYOUT), "detected": set()}
+
+    header = head.iloc[header_rows].apply(lambda col: col.map(_cell_text))
+    fingerprint = "|".join(" ".join(row) for row in header.values.tolist())
+    if fingerprint in _LAYOUT_CACHE:
+        return _LAYOUT_CACHE[fingerprint]
+
+    raw = {c: " ".join(header[c]).strip() for c in header.columns}
+    # групповые заголовки («Выпуск», «Рейсы») объединены по горизонтали — протягиваем их вправо
+    filled = []
+    for row in header.values.tolist():
+        last, out = "", []
+        for v in row:
+            last = v or last
+            out.append(last)
+        filled.append(out)
+    labels = {c: " ".join(r[i] for r in filled).strip() for i, c in enumerate(header.columns)}
+
+    columns = {}
+    route_col = next((c for c in header.columns if header[c].map(is_route_header_cell).any()), None)
+    if route_col is not None:
+        columns["Маршрут_raw"] = route_col
+    branch_col = next((c for c, txt in raw.items() if "филиал" in txt), None)
+    if branch_col is not None and branch_col != route_col:
+        columns["Филиал_raw"] = branch_col
+    for name, keywords in METRIC_KEYWORDS.items():
+        col = next((c for c, txt in labels.items()
+                    if all(k in txt for k in keywords) and c not in columns.values()), None)
+        if col is not None:
+            columns[name] = col
+    detected = set(columns)
+    for name, col in DEFAULT_LAYOUT.items():
+        if name not in columns and col not in columns.values():
+            columns[name] = col
+
+    layout = {"fingerprint": fingerprint, "columns": columns, "detected": detected}
+    _LAYOUT_CACHE[fingerprint] = layout
+
+    drift = {n: (DEFAULT_LAYOUT[n], c) for n, c in columns.items() if c != DEFAULT_LAYOUT[n]}
+    if drift:
+        moved = ", ".join(f"{n}: {a}->{b}" for n, (a, b) in drift.items())
+        print(f"[WARNING] Раскладка выгрузки отличается от стандартной ({moved})")
+    missing = set(DEFAULT_LAYOUT) - detected
+    if missing:
+        print(f"[INFO] Колонки не найдены в шапке, беру стандартные позиции: {sorted(missing)}")
+    return layout
+
+def read_release_table(file_path: Path):
+    """
+    Читает файл один раз и определяет раскладку по его первым LAYOUT_HEAD_ROWS строкам.
+    Отдельно колонки не отбираются: openpyxl всё равно разбирает весь лист.
+    """
+    table = read_excel_auto(file_path)
+    return table, detect_layout(table.head(LAYOUT_HEAD_ROWS))
+
 def process_release_file(file_path: Path) -> pd.DataFrame:
     try:
-        table = read_excel_auto(file_path)
+        table, layout = read_release_table(file_path)
     except Exception as e:
         print(f"[WARNING] Error reading {file_path.name}: {e}")
         return pd.DataFrame()
@@ -165,15 +269,7 @@ def process_release_file(file_path: Path) -> pd.DataFrame:
             continue
 
         df_block = table.iloc[start:end + 1, :].copy()
-        df_block = df_block.rename(columns={
-            1: "Филиал_raw",
-            2: "Маршрут_raw",
-            3: "ПланВыпуск",
-            8: "ФактВыпуск",
-            13: "ПланРейсы",
-            14: "ФактРейсы",
-            15: "Потери"
-        })
+        df_block = df_block.rename(columns={col: name for name, col in layout["columns"].items()})
 
         branch_series = df_block.apply(detect_branch_in_row, axis=1)
         df_block["Филиал"] = branch_series.ffill()
@@ -182,15 +278,9 @@ def process_release_file(file_path: Path) -> pd.DataFrame:
         mask_branch = df_block["Филиал"].isin(ALLOWED_BRANCHES)
         df_block = df_block[mask_route & mask_branch].copy()
 
-        df_block["Маршрут"] = (
-            df_block["Маршрут_raw"].astype(str)
-            .str.strip()
-            .str.replace("_", "", regex=False)
-            .str.lower()
-        )
-
-        df_block["КТР"] = df_block["Маршрут"].apply(lambda s: "КТР" if has_gk_suffix(s) else "не КТР")
-        df_block["Маршрут"] = df_block["Маршрут"].apply(strip_gk_suffix).str.replace("_", "", regex=False)
+        route_raw = df_block["Маршрут_raw"].astype(str).str.replace("_", "", regex=False)
+        df_block["КТР"] = route_raw.str.contains(GK_SUFFIX_RE, regex=True).map({True: "КТР", False: "не КТР"})
+        df_block["Маршрут"] = normalize_route_series(df_block["Маршрут_raw"])
 
         for col in ["ПланРейсы", "ФактРейсы", "Потери", "ПланВыпуск", "ФактВыпуск"]:
             if col in df_block:
@@ -225,31 +315,21 @@ def process_release_file(file_path: Path) -> pd.DataFrame:
 
     return df
 
-def main():
-    if not SOURCE_FOLDER.exists():
-        print("[ERROR] No source folder:", SOURCE_FOLDER)
-        sys.exit(1)
-    OUTPUT_FOLDER.mkdir(parents=True, exist_ok=True)
-
-    release_files = sorted(SOURCE_FOLDER.glob("Выпуск*.xls*"))
-    if not release_files:
-        print("[ERROR] No 'Выпуск*.xls*' files found in folder:", SOURCE_FOLDER)
-        sys.exit(0)
-
+def build_releases(release_files: List[Path]) -> pd.DataFrame:
     frames = []
     for file in release_files:
         df_part = process_release_file(file)
         if not df_part.empty:
             frames.append(df_part)
+    return finalize_releases(frames)
 
+def finalize_releases(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    frames = [f for f in frames if not f.empty]
     if not frames:
-        print("[ERROR] No data extracted from release files")
-        sys.exit(1)
+        return pd.DataFrame()
 
     df_releases = pd.concat(frames, ignore_index=True)
 
-  
-
     df_releases = df_releases.rename(columns={"Маршрут": "№\nм-та"})
     df_releases["Ключ 2"] = df_releases["Дата"].astype(str) + " " + df_releases["№\nм-та"].astype(str)
     df_releases["Ключ 4"] = (
@@ -264,7 +344,23 @@ def main():
         "ПланВыпуск", "ФактВыпуск", "ПланРейсы", "ФактРейсы", "Потери",
         "Ключ 2", "Ключ 4"
     ]
-    df_releases = df_releases[[c for c in final_cols if c in df_releases.columns]]
+    return df_releases[[c for c in final_cols if c in df_releases.columns]]
+
+def main():
+    if not SOURCE_FOLDER.exists():
+        print("[ERROR] No source folder:", SOURCE_FOLDER)
+        sys.exit(1)
+    OUTPUT_FOLDER.mkdir(parents=True, exist_ok=True)
+
+    release_files = sorted(SOURCE_FOLDER.glob(RELEASE_GLOB))
+    if not release_files:
+        print(f"[ERROR] No '{RELEASE_GLOB}' files found in folder:", SOURCE_FOLDER)
+        sys.exit(0)
+
+    df_releases = build_releases(release_files)
+    if df_releases.empty:
+        print("[ERROR] No data extracted from release files")
+        sys.exit(1)
 
     df_releases.to_excel(OUTPUT_FILE, index=False)
     print("[OK] Result saved:", OUTPUT_FILE)
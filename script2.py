@@ -1,10 +1,12 @@
-import re
 import sys
 import pandas as pd
 import numpy as np
 from pathlib import Path
 import subprocess
 
+from routes import normalize_route_series
+import prefetch
+
 
 # НАСТРОЙКИ / ПУТИ
 # =====================
@@ -12,25 +14,10 @@ BASE_FOLDER = Path("/Users/mikhailsokolov/Desktop/МГТ/Рейсы")
 OUTPUT_FILE = BASE_FOLDER / "ЭП" / "ЭП_итог.xlsx"
 MARKS_FILE = BASE_FOLDER / "Отметки выхода июль.xlsx"
 SHEET_NAME = "Выпуск и рейсы КСУПТ"
+REQUIRED_COLS = {"Дата", "Маршрут", "ТП", "Вид ТС", "Территория", "Факт рейсов"}
 # =====================
 
 
-GK_SUFFIX_RE = re.compile(r'\s*/\s*гк(?:\s*-\s*[\w\-а-яё\d]+)?', re.IGNORECASE)
-
-def strip_gk_suffix(value: str) -> str:
-    return GK_SUFFIX_RE.sub('', str(value)).strip()
-
-def normalize_route_series(series: pd.Series) -> pd.Series:
-    return (
-        series.fillna("")
-              .astype(str)
-              .str.strip()
-              .str.replace("_", "", regex=False)
-              .str.lower()
-              .apply(strip_gk_suffix)
-              .str.replace("_", "", regex=False)
-    )
-
 def detect_vehicle_type_series(s: pd.Series) -> pd.Series:
     """
     Усиленное определение типа по тексту из 'Вид ТС'.
@@ -64,22 +51,10 @@ def detect_vehicle_type_series(s: pd.Series) -> pd.Series:
         default=None,
     )
 
-def main():
-    print("[INFO] Запуск SCRIPT2.py")
-
-    for f, name in [(OUTPUT_FILE, "ЭП_итог"), (MARKS_FILE, "Отметки")]:
-        if not f.exists():
-            print(f"[ERROR] Не найден файл {name}: {f}")
-            sys.exit(1)
-
-    print(f"[OK] Найдены файлы:\n  - {OUTPUT_FILE}\n  - {MARKS_FILE}")
-
-    df = pd.read_excel(MARKS_FILE)
-    required_cols = {"Дата", "Маршрут", "ТП", "Вид ТС", "Территория", "Факт рейсов"}
-    missing = required_cols - set(df.columns)
+def build_kcsupt_sheet(df: pd.DataFrame, releases: pd.DataFrame) -> pd.DataFrame:
+    missing = REQUIRED_COLS - set(df.columns)
     if missing:
-        print(f"[ERROR] Отсутствуют колонки: {missing}")
-        sys.exit(1)
+        raise ValueError(f"Отсутствуют колонки: {missing}")
 
     print(f"[INFO] Прочитано строк: {len(df)}")
 
@@ -98,7 +73,6 @@ def main():
     df = df[df["__type"].isin(["автобус", "электробус"])].copy()
     print(f"[INFO] После фильтрации по типу осталось {len(df)} строк")
 
-    releases = pd.read_excel(OUTPUT_FILE)  
     if not {"Ключ 2", "ТипТС"}.issubset(set(releases.columns)):
         print("[WARNING] В ЭП_итог.xlsx не найдено 'Ключ 2' и 'ТипТС'. Буду использовать только распознавание по 'Вид ТС'.")
         map_df = pd.DataFrame(columns=["Ключ 2", "ТипТС"])
@@ -164,9 +138,34 @@ def main():
 
     df = df.drop(columns=["__type", "Филиал_clean", "Территория_clean", "Маршрут_norm", "Авт/Эл_from_rel"], errors="ignore").fillna("")
 
-    with pd.ExcelWriter(OUTPUT_FILE, engine="openpyxl", mode="a", if_sheet_exists="replace") as writer:
+    return df
+
+def write_kcsupt_sheet(df: pd.DataFrame, output_file: Path):
+    with pd.ExcelWriter(output_file, engine="openpyxl", mode="a", if_sheet_exists="replace") as writer:
         df.to_excel(writer, sheet_name=SHEET_NAME, index=False)
 
+def main():
+    print("[INFO] Запуск SCRIPT2.py")
+
+    for f, name in [(OUTPUT_FILE, "ЭП_итог"), (MARKS_FILE, "Отметки")]:
+        if not f.exists():
+            print(f"[ERROR] Не найден файл {name}: {f}")
+            sys.exit(1)
+
+    print(f"[OK] Найдены файлы:\n  - {OUTPUT_FILE}\n  - {MARKS_FILE}")
+
+    # отметки и ЭП_итог.xlsx независимы — разбираются одновременно
+    with prefetch.prefetch({"marks": (pd.read_excel, MARKS_FILE), "releases": (pd.read_excel, OUTPUT_FILE)}) as inputs:
+        df = inputs["marks"].result()
+        releases = inputs["releases"].result()
+    try:
+        df = build_kcsupt_sheet(df, releases)
+    except ValueError as e:
+        print(f"[ERROR] {e}")
+        sys.exit(1)
+
+    write_kcsupt_sheet(df, OUTPUT_FILE)
+
     print(f"[OK] Лист '{SHEET_NAME}' обновлён в {OUTPUT_FILE}")
     print("[DONE] SCRIPT2.py завершил работу ✅")
 
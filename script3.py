@@ -1,20 +1,51 @@
 import sys
 import re
+import argparse
 import datetime
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+import numpy as np
 import pandas as pd
 from openpyxl import load_workbook
 
+import cube
+import diagnostics
+import export
+import query
+import routes
+import prefetch
+
 # =====================
 # НАСТРОЙКИ / ПУТИ
 # =====================
 BASE_FOLDER = Path("/Users/mikhailsokolov/Desktop/МГТ/Рейсы")
 OUTPUT_FILE = BASE_FOLDER / "ЭП" / "ЭП_итог.xlsx"
 SOURCE_FILE_JULY = BASE_FOLDER / "ЭП июль.xlsx"
+CUBE_FILE = BASE_FOLDER / "ЭП" / "ЭП_куб.parquet"
+DB_FILE = BASE_FOLDER / "ЭП" / "ЭП.sqlite"
+EXPORT_FOLDER = BASE_FOLDER / "ЭП" / "выгрузка"
+DIAG_FILE = BASE_FOLDER / "ЭП" / "ЭП_диагностика.xlsx"
+SUBSET_FILE = BASE_FOLDER / "ЭП" / "ЭП_колонки.xlsx"  # результат --columns (лист ЭкспПоказ не трогаем)
 
 SOURCE_SHEET = "Выпуск и рейсы КСУПТ"
 TARGET_SHEET = "ЭкспПоказ"
 
+REQUIRED_COLS = [
+    "Длина маршр., км", "Выпуск", "Количество рейсов произ.", "Кол-во водителей", "КТР",
+    "Выпус План ПКД", "Выпуск Факт ПКД", "Рейсы План ПКД", "Рейсы Факт ПКД",
+    "Ручной выпуск план", "Ручной выпуск факт", "Ручной рейсы план", "Ручной рейсы факт"
+]
+SORT_COLS = ["Дата", "Маршрут", "Филиал", "Авт/Эл", "Площадка"]
+SUBSET_KEY_COLS = ["Дата", "Маршрут", "Филиал", "Авт/Эл", "Площадка", "Ключ 4", "Ключ 5"]
+PARTITION_COLS = ["Дата", "Филиал"]
+# Совпадение -> (значение ПКД, Корр. колонка, сумма которой по Ключ 4 вычитается)
+MATCH_COLS = {
+    "Совпадение плана выпуска": ("Выпус План ПКД", "Корр. Выпуск План"),
+    "Совпадение факта выпуска": ("Выпуск Факт ПКД", "Корр. Выпуск Факт"),
+    "Совпадение плана рейсов": ("Рейсы План ПКД", "Корр. Рейсы План"),
+    "Совпадение факта рейсов": ("Рейсы Факт ПКД", "Корр. Рейсы Факт"),
+}
+
 COLUMNS = [
     "Дата", "Маршрут", "Территория", "Дата ввода расписания", "Длина маршр., км",
     "Выпуск", "Количество рейсов произ.", "Кол-во водителей", "Площадка", "Филиал",
@@ -28,9 +59,6 @@ COLUMNS = [
     "Ручной выпуск факт", "Ручной рейсы план", "Ручной рейсы факт"
 ]
 
-LAT_TO_CYR = {"A":"А","B":"В","C":"С","E":"Е","H":"Н","K":"К","M":"М","O":"О","P":"Р","T":"Т","X":"Х","Y":"У","Z":"З","S":"С","V":"В"}
-CYR_TO_LAT = {v: k for k, v in LAT_TO_CYR.items()}
-
 # =====================
 # ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ
 # =====================
@@ -66,40 +94,15 @@ def _extract_filial(text: str):
 
 
 def extract_route_candidates(cell_value):
-    if pd.isna(cell_value):
-        return []
-    s = str(cell_value).strip()
-    if not s:
-        return []
-    tokens = re.split(r'[^0-9A-Za-zА-Яа-яЁё\-]+', s)
-    candidates = []
-    for t in tokens:
-        t = t.strip()
-        if not t:
-            continue
-        if not re.search(r'\d', t):
-            continue
-        t_clean = re.sub(r'\-+', '-', t.upper()).strip('-')
-        candidates.append(t_clean)
-        cand_lat_to_cyr = "".join(LAT_TO_CYR.get(ch, ch) for ch in t_clean)
-        cand_cyr_to_lat = "".join(CYR_TO_LAT.get(ch, ch) for ch in t_clean)
-        if cand_lat_to_cyr != t_clean:
-            candidates.append(cand_lat_to_cyr)
-        if cand_cyr_to_lat != t_clean:
-            candidates.append(cand_cyr_to_lat)
-    seen, out = set(), []
-    for c in candidates:
-        if c not in seen and c:
-            seen.add(c)
-            out.append(c)
-    return out
-
-
-def build_key_parts_from_name_and_route(name_cell, route_cell):
+    return routes.route_candidates(cell_value)
+
+
+def build_key_parts_from_name_and_route(name_cell, route_cell, route_cands=None):
     date_str = _extract_date(name_cell) if isinstance(name_cell, str) else None
     filial = _extract_filial(name_cell) if isinstance(name_cell, str) else None
     transport = _normalize_transport(name_cell) if isinstance(name_cell, str) else None
-    route_cands = extract_route_candidates(route_cell)
+    if route_cands is None:
+        route_cands = extract_route_candidates(route_cell)
     parts = []
     if date_str:
         parts.append(date_str)
@@ -113,6 +116,11 @@ def build_key_parts_from_name_and_route(name_cell, route_cell):
     return {"date": date_str, "filial": filial, "transport": transport, "routes": route_cands, "key_norm": key_norm}
 
 
+def parse_key4(raw_key):
+    """Разбор Ключ 4 для поиска в справочнике ЭП июль (как при расчёте ЭкспПоказ)."""
+    return build_key_parts_from_name_and_route(raw_key if isinstance(raw_key, str) else None, raw_key)
+
+
 def _normalize_key4_value(v):
     if pd.isna(v):
         return "<__NA__>"
@@ -160,35 +168,13 @@ def find_best_key_column_by_matching(df_sheet: pd.DataFrame, keys_to_match: set)
     return best_col if best_count > 0 else None
 
 # =====================
-# ОСНОВНОЙ СЦЕНАРИЙ
+# СПРАВОЧНИКИ
 # =====================
 
-def main():
-    print("[INFO] Запуск SCRIPT3.py (dedup-first mode — расчёты на уникальных строках)")
-
-    if not OUTPUT_FILE.exists():
-        print(f"[ERROR] Не найден файл: {OUTPUT_FILE}")
-        sys.exit(1)
-    if not SOURCE_FILE_JULY.exists():
-        print(f"[ERROR] Не найден файл: {SOURCE_FILE_JULY}")
-        sys.exit(1)
-
-    df_src = pd.read_excel(OUTPUT_FILE, sheet_name=SOURCE_SHEET, dtype=object)
-
-   
-    required_cols = [
-        "Длина маршр., км", "Выпуск", "Количество рейсов произ.", "Кол-во водителей", "КТР",
-        "Выпус План ПКД", "Выпуск Факт ПКД", "Рейсы План ПКД", "Рейсы Факт ПКД",
-        "Ручной выпуск план", "Ручной выпуск факт", "Ручной рейсы план", "Ручной рейсы факт"
-    ]
-    for col in required_cols:
-        if col not in df_src.columns:
-            df_src[col] = None
-
-   
-    exact_map, date_route_map, route_map = {}, {}, {}
+def load_july_reference(path: Path) -> routes.RouteIndex:
+    index = routes.RouteIndex()
     try:
-        df_july_raw = pd.read_excel(SOURCE_FILE_JULY, dtype=object)
+        df_july_raw = pd.read_excel(path, dtype=object)
         def safe_col(idx, default_last=True):
             try:
                 return df_july_raw.columns[idx]
@@ -198,49 +184,48 @@ def main():
         col_F, col_G = safe_col(5), safe_col(6)
         col_R, col_W = safe_col(17), safe_col(22)
 
-        for _, row in df_july_raw.iterrows():
-            name_cell, route_cell = row.get(col_A), row.get(col_B)
-            length, vyp = row.get(col_F), row.get(col_G)
-            reisy, vod = row.get(col_R), row.get(col_W)
-
-            parsed = build_key_parts_from_name_and_route(name_cell, route_cell)
-            key_norm, routes, date = parsed["key_norm"], parsed["routes"], parsed["date"]
-
-            if key_norm and key_norm not in exact_map:
-                exact_map[key_norm] = {"len": length, "vyp": vyp, "reisy": reisy, "vod": vod}
-            for r in routes:
-                if date:
-                    kdr = (date, r)
-                    if kdr not in date_route_map:
-                        date_route_map[kdr] = {"len": length, "vyp": vyp, "reisy": reisy, "vod": vod}
-                if r not in route_map:
-                    route_map[r] = {"len": length, "vyp": vyp, "reisy": reisy, "vod": vod}
-        print(f"[INFO] Июльский справочник прочитан: строк={len(df_july_raw)}")
+        route_cands = routes.route_candidates_series(df_july_raw[col_B])
+        for name_cell, route_cell, cands, length, vyp, reisy, vod in zip(
+            df_july_raw[col_A], df_july_raw[col_B], route_cands,
+            df_july_raw[col_F], df_july_raw[col_G], df_july_raw[col_R], df_july_raw[col_W],
+        ):
+            parsed = build_key_parts_from_name_and_route(name_cell, route_cell, route_cands=cands)
+            entry = {"len": length, "vyp": vyp, "reisy": reisy, "vod": vod}
+            index.add(parsed["key_norm"], parsed["date"], parsed["routes"], entry)
+        print(f"[INFO] Июльский справочник прочитан: строк={len(df_july_raw)}, маршрутов={len(index)}")
     except Exception as e:
-        print(f"[WARN] Не удалось прочитать '{SOURCE_FILE_JULY}': {e}. Продолжаю без справочника июля.")
-
-    def find_values_for_parsed(parsed):
-        if parsed.get("key_norm") and parsed["key_norm"] in exact_map:
-            v = exact_map[parsed["key_norm"]]
-            return v["len"], v["vyp"], v["reisy"], v["vod"]
-        if parsed.get("date"):
-            for r in parsed.get("routes", []):
-                kdr = (parsed["date"], r)
-                if kdr in date_route_map:
-                    v = date_route_map[kdr]
-                    return v["len"], v["vyp"], v["reisy"], v["vod"]
-        for r in parsed.get("routes", []):
-            if r in route_map:
-                v = route_map[r]
-                return v["len"], v["vyp"], v["reisy"], v["vod"]
+        print(f"[WARN] Не удалось прочитать '{path}': {e}. Продолжаю без справочника июля.")
+    return index
+
+
+def find_values_for_parsed(parsed, july_ref: routes.RouteIndex):
+    v = july_ref.lookup(parsed.get("key_norm"), parsed.get("date"), parsed.get("routes", []))
+    if v is None:
         return None, None, None, None
+    return v["len"], v["vyp"], v["reisy"], v["vod"]
 
-    
-    ktr_map, pkd_map = {}, {}
+
+def read_source_sheet(path: Path) -> pd.DataFrame:
+    df_src = pd.read_excel(path, sheet_name=SOURCE_SHEET, dtype=object)
+    print(f"[INFO] Лист '{SOURCE_SHEET}' загружен, строк={len(df_src)}")
+    return df_src
+
+
+def read_sheet1(path: Path):
     try:
-        df_sheet1 = pd.read_excel(OUTPUT_FILE, sheet_name="Sheet1", dtype=object)
-        print(f"[INFO] Прочитан Sheet1, колонки: {list(df_sheet1.columns)}")
+        df_sheet1 = pd.read_excel(path, sheet_name="Sheet1", dtype=object)
+    except Exception as e:
+        print(f"[WARN] Не удалось прочитать Sheet1: {e}")
+        return None
+    print(f"[INFO] Прочитан Sheet1, колонки: {list(df_sheet1.columns)}")
+    return df_sheet1
 
+
+def build_sheet1_maps(df_sheet1: pd.DataFrame | None, df_src: pd.DataFrame):
+    ktr_map, pkd_map = {}, {}
+    if df_sheet1 is None:
+        return ktr_map, pkd_map
+    try:
         col_key2 = find_column_by_candidates(df_sheet1, ["Ключ 2", "Ключ2", "Ключ_2"], fallback_index=10)
         col_ktr = find_column_by_candidates(df_sheet1, ["КТР", "Ктр", "Ктр."], fallback_index=4)
         if col_key2 and col_ktr:
@@ -291,291 +276,481 @@ def main():
         else:
             print("[WARN] Недостаточно данных в Sheet1 для PKD-мэппинга.")
     except Exception as e:
-        print(f"[WARN] Не удалось прочитать Sheet1: {e}")
+        print(f"[WARN] Не удалось обработать Sheet1: {e}")
+    return ktr_map, pkd_map
 
+# =====================
+# РАСЧЁТ ЭкспПоказ
+# =====================
 
-    if "Ключ 5" in df_src.columns:
-        df_src["Ключ_5_norm"] = df_src["Ключ 5"].apply(_normalize_key4_value)
-        counts_k5 = df_src["Ключ_5_norm"].value_counts()
-        df_src["orig_dup_count"] = df_src["Ключ_5_norm"].map(counts_k5)
+def _to_float(val):
+    try:
+        return float(val)
+    except Exception:
+        return None
 
-       
-        sort_cols = [c for c in ["Дата", "Маршрут", "Филиал", "Авт/Эл", "Площадка"] if c in df_src.columns]
-        df_unique = df_src.sort_values(sort_cols).drop_duplicates(subset=["Ключ_5_norm"], keep="first").copy()
-        removed = len(df_src) - len(df_unique)
-        print(f"[INFO] Dedup-first: удалено {removed} строк по Ключ 5 (будем считать без дублей)")
-    else:
-        df_unique = df_src.copy()
-        df_unique["Ключ_5_norm"] = None
-        df_unique["orig_dup_count"] = 1
-        print("[WARN] В данных нет 'Ключ 5' — расчёты будут выполняться на всех строках (не было ключа для дедупа).")
 
-    for col in required_cols:
-        if col not in df_unique.columns:
-            df_unique[col] = None
-
-   
-    filled_len = filled_vyp = filled_rei = filled_vod = filled_ktr = 0
-    filled_plan_pkd = filled_fact_pkd = filled_plan_reis_pkd = filled_fact_reis_pkd = 0
-
-    for idx, row in df_unique.iterrows():
-        raw_key = row.get("Ключ 4")
-        parsed = build_key_parts_from_name_and_route(raw_key if isinstance(raw_key, str) else None, raw_key)
-        length, vyp, reisy, vod = find_values_for_parsed(parsed)
-
-        if length is not None and pd.isna(row.get("Длина маршр., км")):
-            df_unique.at[idx, "Длина маршр., км"] = length
-            filled_len += 1
-        if vyp is not None and pd.isna(row.get("Выпуск")):
-            df_unique.at[idx, "Выпуск"] = vyp
-            filled_vyp += 1
-        if reisy is not None and pd.isna(row.get("Количество рейсов произ.")):
-            df_unique.at[idx, "Количество рейсов произ."] = reisy
-            filled_rei += 1
-        if vod is not None and pd.isna(row.get("Кол-во водителей")):
-            df_unique.at[idx, "Кол-во водителей"] = vod
-            filled_vod += 1
-
-        key2_val = row.get("Ключ 2")
-        if pd.isna(row.get("КТР")) and pd.notna(key2_val):
+def calc_corr_vyp_plan(row):
+    manual = row.get("Ручной выпуск план")
+    if pd.notna(manual):
+        return manual
+    plan_pkd = row.get("Выпус План ПКД")
+    vypusk = _to_float(row.get("Выпуск"))
+    vypusk_sum = _to_float(row.get("Выпуск сумм."))
+    dub = row.get("Дубляж", 0)
+    try:
+        if pd.isna(plan_pkd) and plan_pkd is not None:
+            return None
+        if dub == 0:
+            return plan_pkd
+        if pd.notna(vypusk) and pd.notna(vypusk_sum) and vypusk_sum != 0:
+            return round(float(plan_pkd) * vypusk / vypusk_sum)
+    except Exception:
+        return None
+    return None
+
+
+def calc_corr_vyp_fact(row):
+    manual = row.get("Ручной выпуск факт")
+    if pd.notna(manual):
+        return manual
+    vyp_fact_pkd = row.get("Выпуск Факт ПКД")
+    vypusk = _to_float(row.get("Выпуск"))
+    vypusk_sum = _to_float(row.get("Выпуск сумм."))
+    dub = row.get("Дубляж", 0)
+    try:
+        if pd.isna(vyp_fact_pkd) and vyp_fact_pkd is not None:
+            return None
+        if dub == 0:
+            return vyp_fact_pkd
+        if pd.notna(vypusk) and pd.notna(vypusk_sum) and vypusk_sum != 0:
+            return round(float(vyp_fact_pkd) * vypusk / vypusk_sum)
+    except Exception:
+        return None
+    return None
+
+
+def calc_corr_reis_plan(row):
+    manual = row.get("Ручной рейсы план")
+    if pd.notna(manual):
+        return manual
+    plan_reis_pkd = row.get("Рейсы План ПКД")
+    reis_prod = _to_float(row.get("Количество рейсов произ."))
+    reis_sum = _to_float(row.get("Рейсы сумм"))
+    dub = row.get("Дубляж", 0)
+    try:
+        if pd.isna(plan_reis_pkd) and plan_reis_pkd is not None:
+            return None
+        if dub == 0:
+            return plan_reis_pkd
+        if pd.notna(reis_prod) and pd.notna(reis_sum) and reis_sum != 0:
+            return round(float(plan_reis_pkd) * reis_prod / reis_sum)
+    except Exception:
+        return None
+    return None
+
+
+def calc_corr_reis_fact(row):
+    manual = row.get("Ручной рейсы факт")
+    if pd.notna(manual):
+        return manual
+    reis_fact_pkd = row.get("Рейсы Факт ПКД")
+    reis_prod = _to_float(row.get("Количество рейсов произ."))
+    reis_sum = _to_float(row.get("Рейсы сумм"))
+    dub = row.get("Дубляж", 0)
+    try:
+        if pd.isna(reis_fact_pkd) and reis_fact_pkd is not None:
+            return None
+        if dub == 0:
+            return reis_fact_pkd
+        if pd.notna(reis_prod) and pd.notna(reis_sum) and reis_sum != 0:
+            return round(float(reis_fact_pkd) * reis_prod / reis_sum)
+    except Exception:
+        return None
+    return None
+
+
+class _Key4Groups:
+    """
+    Группы строк по Ключ 4: ключ факторизуется один раз, дальше любые суммы по группе
+    считаются на кодах и раскладываются обратно на строки индексированием.
+    Строки без Ключ 4 в группы не входят (сумма — NaN), как при groupby("Ключ 4").
+    """
+
+    def __init__(self, key4: pd.Series):
+        self.index = key4.index
+        codes, uniques = pd.factorize(key4)
+        self.codes = codes
+        self.has_key = codes >= 0
+        self.n = len(uniques)
+
+        # Дубляж — по нормализованному ключу: нормализуем только уникальные значения
+        raw_counts = np.bincount(codes[self.has_key], minlength=self.n)
+        norm_of_group = [_normalize_key4_value(v) for v in uniques]
+        norm_counts = {}
+        for norm, cnt in zip(norm_of_group, raw_counts):
+            norm_counts[norm] = norm_counts.get(norm, 0) + int(cnt)
+        na_count = int((~self.has_key).sum())
+        if na_count:
+            norm_counts[_normalize_key4_value(None)] = norm_counts.get(_normalize_key4_value(None), 0) + na_count
+
+        dub_of_group = np.array([0 if norm_counts[n] == 1 else 1 for n in norm_of_group] + [0 if na_count == 1 else 1])
+        self.dub = pd.Series(dub_of_group[np.where(self.has_key, codes, self.n)], index=self.index)
+
+    def sum(self, columns: dict) -> dict:
+        """{имя: Series} -> {имя: сумма по группе на каждой строке}; все колонки за одну группировку."""
+        values = pd.DataFrame(columns, index=self.index)[self.has_key]
+        # sort=True: строки итога идут в порядке кодов 0..n-1, код группы = номер строки
+        totals = values.groupby(self.codes[self.has_key], sort=True).sum()
+        row_group = np.where(self.has_key, self.codes, 0)
+        out = {}
+        for name in columns:
+            if self.n == 0:
+                out[name] = pd.Series(np.nan, index=self.index)
+                continue
+            out[name] = pd.Series(totals[name].to_numpy()[row_group], index=self.index).where(self.has_key)
+        return out
+
+
+# =====================
+# ГРАФ КОЛОНОК
+# =====================
+# Расчёт разбит на этапы; каждый этап объявляет, от каких этапов и справочников
+# он зависит и какие колонки ЭкспПоказ даёт. Вызывающий передаёт нужные колонки —
+# выполняются только этапы, от которых они зависят (остальные колонки остаются пустыми).
+
+PKD_FIELDS = {
+    "Выпус План ПКД": ("plan_vyp", "filled_plan_pkd"),
+    "Выпуск Факт ПКД": ("fact_vyp", "filled_fact_pkd"),
+    "Рейсы План ПКД": ("plan_reis", "filled_plan_reis_pkd"),
+    "Рейсы Факт ПКД": ("fact_reis", "filled_fact_reis_pkd"),
+}
+KCSUPT_TRUE = ["TRUE", "ПРАВДА", "1"]
+
+
+def _stage_july(df_unique: pd.DataFrame, ctx: dict, stats: dict):
+    if "Ключ 4" not in df_unique.columns:
+        return
+    july_ref = ctx["refs"]["july"]
+    fields = [("Длина маршр., км", "filled_len"), ("Выпуск", "filled_vyp"),
+              ("Количество рейсов произ.", "filled_rei"), ("Кол-во водителей", "filled_vod")]
+    empty = {col: df_unique[col].isna().to_numpy() for col, _ in fields}
+    key4_cands = routes.route_candidates_series(df_unique["Ключ 4"])
+
+    for pos, (idx, raw_key, cands) in enumerate(zip(df_unique.index, df_unique["Ключ 4"], key4_cands)):
+        parsed = build_key_parts_from_name_and_route(raw_key if isinstance(raw_key, str) else None, raw_key, route_cands=cands)
+        values = find_values_for_parsed(parsed, july_ref)
+        for (col, stat), value in zip(fields, values):
+            if value is not None and empty[col][pos]:
+                df_unique.at[idx, col] = value
+                stats[stat] += 1
+
+
+def _stage_ktr(df_unique: pd.DataFrame, ctx: dict, stats: dict):
+    if "Ключ 2" not in df_unique.columns:
+        return
+    ktr_map = ctx["refs"]["ktr_map"]
+    for idx, ktr_val, key2_val in zip(df_unique.index, df_unique["КТР"], df_unique["Ключ 2"]):
+        if pd.isna(ktr_val) and pd.notna(key2_val):
             k2 = str(key2_val).strip()
             if k2 in ktr_map:
                 df_unique.at[idx, "КТР"] = ktr_map[k2]
-                filled_ktr += 1
-
-        k4_norm = _normalize_key4_value(raw_key)
-        if k4_norm in pkd_map:
-            pkd_entry = pkd_map[k4_norm]
-            if (pkd_entry.get("plan_vyp") is not None) and (pd.isna(df_unique.at[idx, "Выпус План ПКД"])):
-                df_unique.at[idx, "Выпус План ПКД"] = pkd_entry.get("plan_vyp")
-                filled_plan_pkd += 1
-            if (pkd_entry.get("fact_vyp") is not None) and (pd.isna(df_unique.at[idx, "Выпуск Факт ПКД"])):
-                df_unique.at[idx, "Выпуск Факт ПКД"] = pkd_entry.get("fact_vyp")
-                filled_fact_pkd += 1
-            if (pkd_entry.get("plan_reis") is not None) and (pd.isna(df_unique.at[idx, "Рейсы План ПКД"])):
-                df_unique.at[idx, "Рейсы План ПКД"] = pkd_entry.get("plan_reis")
-                filled_plan_reis_pkd += 1
-            if (pkd_entry.get("fact_reis") is not None) and (pd.isna(df_unique.at[idx, "Рейсы Факт ПКД"])):
-                df_unique.at[idx, "Рейсы Факт ПКД"] = pkd_entry.get("fact_reis")
-                filled_fact_reis_pkd += 1
-
-  
-    if "Ключ 4" in df_unique.columns:
-        norm_k4 = df_unique["Ключ 4"].apply(_normalize_key4_value)
-        counts_k4 = norm_k4.value_counts()
-        df_unique["Дубляж"] = norm_k4.map(lambda x: 0 if counts_k4.get(x, 0) == 1 else 1)
-
-        if "Выпуск" in df_unique.columns:
-            df_unique["Выпуск сумм."] = df_unique.fillna({"Выпуск": 0}).groupby("Ключ 4")["Выпуск"].transform("sum")
-        else:
-            df_unique["Выпуск сумм."] = 0
+                stats["filled_ktr"] += 1
 
-        if "Количество рейсов произ." in df_unique.columns:
-            df_unique["Рейсы сумм"] = df_unique.fillna({"Количество рейсов произ.": 0}).groupby("Ключ 4")["Количество рейсов произ."].transform("sum")
-        else:
-            df_unique["Рейсы сумм"] = 0
+
+def _stage_pkd(df_unique: pd.DataFrame, ctx: dict, stats: dict):
+    if "Ключ 4" not in df_unique.columns:
+        return
+    pkd_map = ctx["refs"]["pkd_map"]
+    for idx, raw_key in zip(df_unique.index, df_unique["Ключ 4"]):
+        pkd_entry = pkd_map.get(_normalize_key4_value(raw_key))
+        if pkd_entry is None:
+            continue
+        for col, (field, stat) in PKD_FIELDS.items():
+            if pkd_entry.get(field) is not None and pd.isna(df_unique.at[idx, col]):
+                df_unique.at[idx, col] = pkd_entry.get(field)
+                stats[stat] += 1
+
+
+def _stage_sums(df_unique: pd.DataFrame, ctx: dict, stats: dict):
+    # Все величины уровня Ключ 4 считаются на одной группировке: ключи факторизуются
+    # один раз, суммы возвращаются на строки по кодам групп — без merge и копий всего листа.
+    groups = _Key4Groups(df_unique["Ключ 4"]) if "Ключ 4" in df_unique.columns else None
+    ctx["groups"] = groups
+
+    if groups is not None:
+        df_unique["Дубляж"] = groups.dub
+        sums = groups.sum({
+            "Выпуск сумм.": df_unique["Выпуск"].fillna(0),
+            "Рейсы сумм": df_unique["Количество рейсов произ."].fillna(0),
+        })
+        df_unique["Выпуск сумм."] = sums["Выпуск сумм."]
+        df_unique["Рейсы сумм"] = sums["Рейсы сумм"]
     else:
         df_unique["Дубляж"] = 0
         df_unique["Выпуск сумм."] = 0
         df_unique["Рейсы сумм"] = 0
 
-    filled_vyp_sum = df_unique["Выпуск сумм."].notna().sum()
-    filled_rei_sum = df_unique["Рейсы сумм"].notna().sum()
-
+    stats["filled_vyp_sum"] = int(df_unique["Выпуск сумм."].notna().sum())
+    stats["filled_rei_sum"] = int(df_unique["Рейсы сумм"].notna().sum())
 
-    if {"Выпус План ПКД", "Выпуск сумм."}.issubset(df_unique.columns):
-        df_unique["Совпадение исх плана выпуска"] = (
-            df_unique.fillna({"Выпус План ПКД": 0, "Выпуск сумм.": 0})["Выпус План ПКД"] - df_unique.fillna({"Выпуск сумм.": 0})["Выпуск сумм."]
-        )
-    else:
-        df_unique["Совпадение исх плана выпуска"] = None
 
-    if {"Рейсы План ПКД", "Рейсы сумм"}.issubset(df_unique.columns):
-        df_unique["Совпадение исх плана рейсов"] = (
-            df_unique.fillna({"Рейсы План ПКД": 0, "Рейсы сумм": 0})["Рейсы План ПКД"] - df_unique.fillna({"Рейсы сумм": 0})["Рейсы сумм"]
-        )
-    else:
-        df_unique["Совпадение исх плана рейсов"] = None
+def _stage_match_src(df_unique: pd.DataFrame, ctx: dict, stats: dict):
+    df_unique["Совпадение исх плана выпуска"] = df_unique["Выпус План ПКД"].fillna(0) - df_unique["Выпуск сумм."].fillna(0)
+    df_unique["Совпадение исх плана рейсов"] = df_unique["Рейсы План ПКД"].fillna(0) - df_unique["Рейсы сумм"].fillna(0)
 
 
-    def _to_float(val):
-        try:
-            return float(val)
-        except Exception:
-            return None
-
-    def calc_corr_vyp_plan(row):
-        manual = row.get("Ручной выпуск план")
-        if pd.notna(manual):
-            return manual
-        plan_pkd = row.get("Выпус План ПКД")
-        vypusk = _to_float(row.get("Выпуск"))
-        vypusk_sum = _to_float(row.get("Выпуск сумм."))
-        dub = row.get("Дубляж", 0)
-        try:
-            if pd.isna(plan_pkd) and plan_pkd is not None:
-                return None
-            if dub == 0:
-                return plan_pkd
-            if pd.notna(vypusk) and pd.notna(vypusk_sum) and vypusk_sum != 0:
-                return round(float(plan_pkd) * vypusk / vypusk_sum)
-        except Exception:
-            return None
-        return None
-
-    def calc_corr_vyp_fact(row):
-        manual = row.get("Ручной выпуск факт")
-        if pd.notna(manual):
-            return manual
-        vyp_fact_pkd = row.get("Выпуск Факт ПКД")
-        vypusk = _to_float(row.get("Выпуск"))
-        vypusk_sum = _to_float(row.get("Выпуск сумм."))
-        dub = row.get("Дубляж", 0)
-        try:
-            if pd.isna(vyp_fact_pkd) and vyp_fact_pkd is not None:
-                return None
-            if dub == 0:
-                return vyp_fact_pkd
-            if pd.notna(vypusk) and pd.notna(vypusk_sum) and vypusk_sum != 0:
-                return round(float(vyp_fact_pkd) * vypusk / vypusk_sum)
-        except Exception:
-            return None
-        return None
-
-    def calc_corr_reis_plan(row):
-        manual = row.get("Ручной рейсы план")
-        if pd.notna(manual):
-            return manual
-        plan_reis_pkd = row.get("Рейсы План ПКД")
-        reis_prod = _to_float(row.get("Количество рейсов произ."))
-        reis_sum = _to_float(row.get("Рейсы сумм"))
-        dub = row.get("Дубляж", 0)
-        try:
-            if pd.isna(plan_reis_pkd) and plan_reis_pkd is not None:
-                return None
-            if dub == 0:
-                return plan_reis_pkd
-            if pd.notna(reis_prod) and pd.notna(reis_sum) and reis_sum != 0:
-                return round(float(plan_reis_pkd) * reis_prod / reis_sum)
-        except Exception:
-            return None
-        return None
-
-    def calc_corr_reis_fact(row):
-        manual = row.get("Ручной рейсы факт")
-        if pd.notna(manual):
-            return manual
-        reis_fact_pkd = row.get("Рейсы Факт ПКД")
-        reis_prod = _to_float(row.get("Количество рейсов произ."))
-        reis_sum = _to_float(row.get("Рейсы сумм"))
-        dub = row.get("Дубляж", 0)
-        try:
-            if pd.isna(reis_fact_pkd) and reis_fact_pkd is not None:
-                return None
-            if dub == 0:
-                return reis_fact_pkd
-            if pd.notna(reis_prod) and pd.notna(reis_sum) and reis_sum != 0:
-                return round(float(reis_fact_pkd) * reis_prod / reis_sum)
-        except Exception:
-            return None
-        return None
-
+def _stage_corr(df_unique: pd.DataFrame, ctx: dict, stats: dict):
     df_unique["Корр. Выпуск План"] = df_unique.apply(calc_corr_vyp_plan, axis=1)
     df_unique["Корр. Выпуск Факт"] = df_unique.apply(calc_corr_vyp_fact, axis=1)
     df_unique["Корр. Рейсы План"] = df_unique.apply(calc_corr_reis_plan, axis=1)
     df_unique["Корр. Рейсы Факт"] = df_unique.apply(calc_corr_reis_fact, axis=1)
 
-   
-    if "Ключ 4" in df_unique.columns:
-        sums_corr = df_unique.groupby("Ключ 4").agg({
-            "Корр. Выпуск План": "sum",
-            "Корр. Выпуск Факт": "sum",
-            "Корр. Рейсы План": "sum",
-            "Корр. Рейсы Факт": "sum"
-        }).rename(columns={
-            "Корр. Выпуск План": "sum_corr_vyp_plan",
-            "Корр. Выпуск Факт": "sum_corr_vyp_fact",
-            "Корр. Рейсы План": "sum_corr_reis_plan",
-            "Корр. Рейсы Факт": "sum_corr_reis_fact"
-        })
-        df_unique = df_unique.merge(sums_corr, how="left", left_on="Ключ 4", right_index=True)
-
-        df_unique["Совпадение плана выпуска"] = (
-            df_unique.fillna({"Выпус План ПКД": 0, "sum_corr_vyp_plan": 0})["Выпус План ПКД"] - df_unique["sum_corr_vyp_plan"]
-        )
-        df_unique["Совпадение факта выпуска"] = (
-            df_unique.fillna({"Выпуск Факт ПКД": 0, "sum_corr_vyp_fact": 0})["Выпуск Факт ПКД"] - df_unique["sum_corr_vyp_fact"]
-        )
-        df_unique["Совпадение плана рейсов"] = (
-            df_unique.fillna({"Рейсы План ПКД": 0, "sum_corr_reis_plan": 0})["Рейсы План ПКД"] - df_unique["sum_corr_reis_plan"]
-        )
-        df_unique["Совпадение факта рейсов"] = (
-            df_unique.fillna({"Рейсы Факт ПКД": 0, "sum_corr_reis_fact": 0})["Рейсы Факт ПКД"] - df_unique["sum_corr_reis_fact"]
-        )
-    else:
-        df_unique["Совпадение плана выпуска"] = None
-        df_unique["Совпадение факта выпуска"] = None
-        df_unique["Совпадение плана рейсов"] = None
-        df_unique["Совпадение факта рейсов"] = None
 
-            
+def _stage_match(df_unique: pd.DataFrame, ctx: dict, stats: dict):
+    groups = ctx["groups"]
+    if groups is None:
+        for match_col in MATCH_COLS:
+            df_unique[match_col] = None
+        return
+    # Корр. зависят от сумм этапа sums, поэтому их суммы — второй проход по тем же кодам групп
+    sums_corr = groups.sum({corr_col: df_unique[corr_col] for _, corr_col in MATCH_COLS.values()})
+    for match_col, (pkd_col, corr_col) in MATCH_COLS.items():
+        df_unique[match_col] = df_unique[pkd_col].fillna(0) - sums_corr[corr_col]
+
+
+def _kcsupt_true_groups(df_kcsupt: pd.DataFrame, value_col):
+    """Группы листа КСУПТ по Ключ 5 со строками, где рейсы не нулевые."""
+    col_key5 = find_column_by_candidates(df_kcsupt, ["Ключ 5", "ключ5", "Key5"])
+    col_truth = find_column_by_candidates(df_kcsupt, ["AQ", "Не ноль рейсов"])
+    if not (col_key5 and col_truth and value_col):
+        return
+    for key5_val, group in df_kcsupt.groupby(col_key5):
+        mask = group[col_truth].astype(str).str.upper().isin(KCSUPT_TRUE)
+        yield _normalize_key4_value(key5_val), group[mask]
+
+
+def _stage_kcsupt_vyp(df_unique: pd.DataFrame, ctx: dict, stats: dict):
+    df_kcsupt = ctx["kcsupt"]
+    col_exit = find_column_by_candidates(df_kcsupt, ["Выход", "G"])
     try:
-        df_kcsupt = pd.read_excel(OUTPUT_FILE, sheet_name="Выпуск и рейсы КСУПТ", dtype=object)
-        print(f"[INFO] Лист 'Выпуск и рейсы КСУПТ' загружен, строк={len(df_kcsupt)}")
-
-
-        cols = [str(c).strip() for c in df_kcsupt.columns]
-        colnames = {c: c for c in cols}
-        col_key5 = find_column_by_candidates(df_kcsupt, ["Ключ 5", "ключ5", "Key5"])
-        col_truth = find_column_by_candidates(df_kcsupt, ["AQ", "Не ноль рейсов"])
-        col_exit = find_column_by_candidates(df_kcsupt, ["Выход", "G"])
-
         vypusk_fact_map = {}
-        if col_key5 and col_truth and col_exit:
-            for key5_val, group in df_kcsupt.groupby(col_key5):
-                
-                mask = group[col_truth].astype(str).str.upper().isin(["TRUE", "ПРАВДА", "1"])
-                group_true = group[mask]
-                uniq_exits = group_true[col_exit].dropna().astype(str).str.strip().unique()
-                vypusk_fact_map[_normalize_key4_value(key5_val)] = len(uniq_exits)
+        for k5_norm, group_true in _kcsupt_true_groups(df_kcsupt, col_exit):
+            uniq_exits = group_true[col_exit].dropna().astype(str).str.strip().unique()
+            vypusk_fact_map[k5_norm] = len(uniq_exits)
 
         df_unique["Выпуск факт КСУПТ"] = df_unique["Ключ_5_norm"].map(vypusk_fact_map).fillna(0)
-        print(f"[INFO] Выпуск факт КСУПТ рассчитан для {df_unique['Выпуск факт КСУПТ'].astype(bool).sum()} строк")
+        stats["kcsupt_vyp"] = int(df_unique["Выпуск факт КСУПТ"].astype(bool).sum())
     except Exception as e:
-        print(f"[WARN] Не удалось обработать лист 'Выпуск и рейсы КСУПТ': {e}")
+        print(f"[WARN] Не удалось обработать лист '{SOURCE_SHEET}': {e}")
 
-        
-    try:
-       
-        if 'df_kcsupt' not in locals():
-            df_kcsupt = pd.read_excel(OUTPUT_FILE, sheet_name="Выпуск и рейсы КСУПТ", dtype=object)
-
-        col_key5 = find_column_by_candidates(df_kcsupt, ["Ключ 5", "ключ5", "Key5"])
-        col_truth = find_column_by_candidates(df_kcsupt, ["AQ", "Не ноль рейсов"])
-        col_fact_reis = find_column_by_candidates(df_kcsupt, ["Факт рейсов", "Q"])
 
+def _stage_kcsupt_reis(df_unique: pd.DataFrame, ctx: dict, stats: dict):
+    df_kcsupt = ctx["kcsupt"]
+    col_fact_reis = find_column_by_candidates(df_kcsupt, ["Факт рейсов", "Q"])
+    try:
         reisy_fact_map = {}
-        if col_key5 and col_truth and col_fact_reis:
-            for key5_val, group in df_kcsupt.groupby(col_key5):
-                mask = group[col_truth].astype(str).str.upper().isin(["TRUE", "ПРАВДА", "1"])
-                group_true = group[mask]
-                # суммируем факт рейсов
-                total_reis = pd.to_numeric(group_true[col_fact_reis], errors="coerce").fillna(0).sum()
-                reisy_fact_map[_normalize_key4_value(key5_val)] = total_reis
+        for k5_norm, group_true in _kcsupt_true_groups(df_kcsupt, col_fact_reis):
+            # суммируем факт рейсов
+            reisy_fact_map[k5_norm] = pd.to_numeric(group_true[col_fact_reis], errors="coerce").fillna(0).sum()
 
         df_unique["Рейсы факт КСУПТ"] = df_unique["Ключ_5_norm"].map(reisy_fact_map).fillna(0)
-        print(f"[INFO] Рейсы факт КСУПТ рассчитаны для {df_unique['Рейсы факт КСУПТ'].astype(bool).sum()} строк")
+        stats["kcsupt_reis"] = int(df_unique["Рейсы факт КСУПТ"].astype(bool).sum())
     except Exception as e:
         print(f"[WARN] Не удалось обработать 'Рейсы факт КСУПТ': {e}")
 
 
+# этап -> зависимости, справочники из refs, колонки ЭкспПоказ; порядок словаря — порядок выполнения
+STAGES = {
+    "july": {"run": _stage_july, "needs": [], "refs": ["july"],
+             "columns": ["Длина маршр., км", "Выпуск", "Количество рейсов произ.", "Кол-во водителей"]},
+    "ktr": {"run": _stage_ktr, "needs": [], "refs": ["ktr_map"], "columns": ["КТР"]},
+    "pkd": {"run": _stage_pkd, "needs": [], "refs": ["pkd_map"], "columns": list(PKD_FIELDS)},
+    "sums": {"run": _stage_sums, "needs": ["july"], "refs": [],
+             "columns": ["Дубляж", "Выпуск сумм.", "Рейсы сумм"]},
+    "match_src": {"run": _stage_match_src, "needs": ["pkd", "sums"], "refs": [],
+                  "columns": ["Совпадение исх плана выпуска", "Совпадение исх плана рейсов"]},
+    "corr": {"run": _stage_corr, "needs": ["pkd", "sums"], "refs": [],
+             "columns": [corr_col for _, corr_col in MATCH_COLS.values()]},
+    "match": {"run": _stage_match, "needs": ["pkd", "corr"], "refs": [], "columns": list(MATCH_COLS)},
+    "kcsupt_vyp": {"run": _stage_kcsupt_vyp, "needs": [], "refs": [], "columns": ["Выпуск факт КСУПТ"]},
+    "kcsupt_reis": {"run": _stage_kcsupt_reis, "needs": [], "refs": [], "columns": ["Рейсы факт КСУПТ"]},
+}
+COLUMN_STAGE = {col: name for name, stage in STAGES.items() for col in stage["columns"]}
+
+
+def required_stages(columns=None) -> list:
+    """Этапы (в порядке выполнения), нужные для колонок columns; None — все колонки."""
+    if columns is None:
+        return list(STAGES)
+    unknown = [c for c in columns if c not in COLUMNS]
+    if unknown:
+        raise ValueError(f"Неизвестные колонки ЭкспПоказ: {unknown}")
+    needed, todo = set(), [COLUMN_STAGE[c] for c in columns if c in COLUMN_STAGE]
+    while todo:
+        name = todo.pop()
+        if name not in needed:
+            needed.add(name)
+            todo.extend(STAGES[name]["needs"])
+    return [name for name in STAGES if name in needed]
+
+
+def required_refs(columns=None) -> set:
+    """Какие справочники (july / ktr_map / pkd_map) нужны для колонок columns."""
+    return {ref for name in required_stages(columns) for ref in STAGES[name]["refs"]}
+
+
+def compute_exp_pokaz(df_src: pd.DataFrame, refs: dict, columns=None):
+    """
+    Дедуп по Ключ 5 и этапы STAGES, нужные для колонок columns (None — все).
+    Возвращает (df_unique, stats). Все группировки идут по Ключ 4 / Ключ 5,
+    поэтому функцию можно вызывать как на всём листе, так и на его партиции (Дата, Филиал).
+    """
+    stats = dict.fromkeys([
+        "removed", "filled_len", "filled_vyp", "filled_rei", "filled_vod", "filled_ktr",
+        "filled_plan_pkd", "filled_fact_pkd", "filled_plan_reis_pkd", "filled_fact_reis_pkd",
+        "filled_vyp_sum", "filled_rei_sum", "kcsupt_vyp", "kcsupt_reis",
+    ], 0)
+
+    # лист КСУПТ — это тот же лист, что и df_src; сам df_src не изменяется
+    ctx = {"refs": refs, "kcsupt": df_src}
+    df_src = df_src.copy()
+    for col in REQUIRED_COLS:
+        if col not in df_src.columns:
+            df_src[col] = None
+
+    if "Ключ 5" in df_src.columns:
+        df_src["Ключ_5_norm"] = df_src["Ключ 5"].apply(_normalize_key4_value)
+        counts_k5 = df_src["Ключ_5_norm"].value_counts()
+        df_src["orig_dup_count"] = df_src["Ключ_5_norm"].map(counts_k5)
+
+        sort_cols = [c for c in SORT_COLS if c in df_src.columns]
+        df_unique = df_src.sort_values(sort_cols, kind="stable").drop_duplicates(subset=["Ключ_5_norm"], keep="first").copy()
+        stats["removed"] = len(df_src) - len(df_unique)
+    else:
+        df_unique = df_src.copy()
+        df_unique["Ключ_5_norm"] = None
+        df_unique["orig_dup_count"] = 1
+
+    for name in required_stages(columns):
+        STAGES[name]["run"](df_unique, ctx, stats)
+
+    return df_unique, stats
+
+# =====================
+# ПАРТИЦИОННЫЙ РЕЖИМ
+# =====================
+
+_WORKER_REFS = None
+_WORKER_COLUMNS = None
+
+
+def _init_partition_worker(refs: dict, columns=None):
+    global _WORKER_REFS, _WORKER_COLUMNS
+    _WORKER_REFS, _WORKER_COLUMNS = refs, columns
 
 
+def _compute_partition(df_part: pd.DataFrame):
+    return compute_exp_pokaz(df_part, _WORKER_REFS, _WORKER_COLUMNS)
+
+
+def compute_exp_pokaz_partitioned(df_src: pd.DataFrame, refs: dict, workers: int | None = None, columns=None):
+    """
+    Партиции (Дата, Филиал) без общих ключей независимы: каждая считается в отдельном
+    процессе, результаты склеиваются в том же порядке, что и при расчёте на всём листе.
+    """
+    parts = split_partitions(df_src)
+    if parts is None:
+        print(f"[WARN] Нет колонок {PARTITION_COLS} для партиционирования — считаю одним блоком.")
+        return compute_exp_pokaz(df_src, refs, columns)
+    print(f"[INFO] Партиций (Дата, Филиал): {len(parts)}")
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_partition_worker, initargs=(refs, columns)) as pool:
+        results = list(pool.map(_compute_partition, parts))
+    return merge_partitions(results, df_src, refs, columns)
+
+
+def split_partitions(df_src: pd.DataFrame):
+    """
+    Партиции (Дата, Филиал), крупные — первыми; None, если колонок для разбиения нет.
+    Дедуп по Ключ 5 и Дубляж/суммы по Ключ 4 идут по всему листу, поэтому партиции
+    с общим нормализованным Ключ 4 или Ключ 5 объединяются: пустой ключ — это тоже ключ
+    '<__NA__>', такие строки оказываются в одной партиции. Строки без Дата или Филиал —
+    в одной общей партиции.
+    """
+    part_cols = [c for c in PARTITION_COLS if c in df_src.columns]
+    if len(part_cols) < len(PARTITION_COLS):
+        return None
+    key_cols = [c for c in ("Ключ 4", "Ключ 5") if c in df_src.columns]
+
+    labels = df_src.groupby(part_cols, sort=False, dropna=False).ngroup().to_numpy()
+    labels = np.where(df_src[part_cols].isna().any(axis=1).to_numpy(), -1, labels)
+
+    parent = {}
+
+    def find(x):
+        while parent.get(x, x) != x:
+            x = parent[x]
+        return x
+
+    for col in key_cols:
+        # нормализуем только уникальные значения, как в _Key4Groups
+        codes, uniques = pd.factorize(df_src[col], use_na_sentinel=False)
+        norm_codes = pd.factorize(pd.Index([_normalize_key4_value(v) for v in uniques]))[0]
+        pairs = pd.DataFrame({"key": norm_codes[codes], "label": labels}).drop_duplicates()
+        shared = pairs[pairs.duplicated("key", keep=False)]
+        for _, group_labels in shared.groupby("key")["label"]:
+            roots = {find(x) for x in group_labels}
+            first = min(roots)
+            for other in roots:
+                parent[other] = first
+
+    if parent:
+        labels = pd.Series(labels).map({x: find(x) for x in np.unique(labels)}).to_numpy()
+    parts = [g for _, g in df_src.groupby(labels, sort=False)]
+    # крупные партиции — первыми, чтобы пул не простаивал на хвосте
+    parts.sort(key=len, reverse=True)
+    return parts
+
+
+def merge_partitions(results: list, df_src: pd.DataFrame, refs: dict, columns=None):
+    """Склеивает [(df_unique, stats)] партиций в том же порядке, что и расчёт на всём листе."""
+    stats = dict.fromkeys(results[0][1], 0) if results else {}
+    for _, part_stats in results:
+        for k, v in part_stats.items():
+            stats[k] += v
+
+    frames = [df for df, _ in results if not df.empty]
+    if not frames:
+        return compute_exp_pokaz(df_src.iloc[0:0], refs, columns)
+    df_unique = pd.concat(frames).sort_index()
+    sort_cols = [c for c in SORT_COLS if c in df_unique.columns]
+    if "Ключ 5" in df_src.columns and sort_cols:
+        df_unique = df_unique.sort_values(sort_cols, kind="stable")
+    return df_unique, stats
+
+# =====================
+# ЗАПИСЬ РЕЗУЛЬТАТА
+# =====================
+
+def to_target_frame(df_unique: pd.DataFrame) -> pd.DataFrame:
     df_final = pd.DataFrame()
     for col in COLUMNS:
         df_final[col] = df_unique[col] if col in df_unique.columns else None
+    return df_final
+
+
+def to_subset_frame(df_unique: pd.DataFrame, columns: list) -> pd.DataFrame:
+    """Ключевые колонки и запрошенные — в порядке COLUMNS."""
+    wanted = set(SUBSET_KEY_COLS) | set(columns)
+    return to_target_frame(df_unique)[[c for c in COLUMNS if c in wanted]]
 
-    wb = load_workbook(OUTPUT_FILE)
+
+def write_target_sheet(df_unique: pd.DataFrame, path: Path):
+    df_final = to_target_frame(df_unique)
+
+    wb = load_workbook(path)
     if TARGET_SHEET in wb.sheetnames:
         del wb[TARGET_SHEET]
     ws = wb.create_sheet(TARGET_SHEET)
@@ -587,12 +762,141 @@ def main():
         for col_idx, col_name in enumerate(COLUMNS, start=1):
             ws.cell(row=row_idx, column=col_idx, value=row.get(col_name, None))
 
-    wb.save(OUTPUT_FILE)
+    wb.save(path)
+
+# =====================
+# ОСНОВНОЙ СЦЕНАРИЙ
+# =====================
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="SCRIPT3: построение листа ЭкспПоказ")
+    parser.add_argument("--partitioned", action="store_true",
+                        help="считать партиции (Дата, Филиал) параллельно в пуле процессов")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="число процессов для --partitioned и выгрузки (по умолчанию — число ядер)")
+    parser.add_argument("--export", nargs="+", choices=export.FORMATS, default=None,
+                        help="дополнительно выгрузить ЭкспПоказ и лист КСУПТ в указанных форматах")
+    parser.add_argument("--split", action="store_true", help="выгрузка — отдельный файл на каждый филиал")
+    parser.add_argument("--zip", action="store_true", help="выгрузка — собрать файлы в один zip")
+    parser.add_argument("--export-dir", type=Path, default=None, help=f"папка выгрузки (по умолчанию {EXPORT_FOLDER})")
+    parser.add_argument("--columns", nargs="+", default=None,
+                        help=f"посчитать только эти колонки ЭкспПоказ (и то, от чего они зависят) в {SUBSET_FILE.name}")
+    return parser.parse_args(argv)
+
+
+def build_refs(df_src: pd.DataFrame, df_sheet1: pd.DataFrame | None, july_ref) -> dict:
+    """
+    july_ref — справочник ЭП июль или функция без аргументов, которая его вернёт
+    (например, future.result): карты Sheet1 строятся, пока справочник ещё разбирается.
+    """
+    ktr_map, pkd_map = build_sheet1_maps(df_sheet1, df_src)
+    if callable(july_ref):
+        july_ref = july_ref()
+    return {"july": july_ref, "ktr_map": ktr_map, "pkd_map": pkd_map}
+
+
+def build_exp_pokaz(df_src: pd.DataFrame, refs: dict, partitioned: bool = False, workers: int | None = None,
+                    columns=None):
+    """columns — нужные колонки ЭкспПоказ (None — все); считаются только этапы, от которых они зависят."""
+    stages = required_stages(columns)
+    if columns is not None:
+        print(f"[INFO] Колонки: {columns}; этапы расчёта: {stages}")
+    if "Ключ 5" not in df_src.columns:
+        print("[WARN] В данных нет 'Ключ 5' — расчёты будут выполняться на всех строках (не было ключа для дедупа).")
+
+    if partitioned:
+        df_unique, stats = compute_exp_pokaz_partitioned(df_src, refs, workers=workers, columns=columns)
+    else:
+        df_unique, stats = compute_exp_pokaz(df_src, refs, columns)
+
+    if "Ключ 5" in df_src.columns:
+        print(f"[INFO] Dedup-first: удалено {stats['removed']} строк по Ключ 5 (будем считать без дублей)")
+    if "kcsupt_vyp" in stages:
+        print(f"[INFO] Выпуск факт КСУПТ рассчитан для {stats['kcsupt_vyp']} строк")
+    if "kcsupt_reis" in stages:
+        print(f"[INFO] Рейсы факт КСУПТ рассчитаны для {stats['kcsupt_reis']} строк")
+    return df_unique, stats
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    print("[INFO] Запуск SCRIPT3.py (dedup-first mode — расчёты на уникальных строках)")
+
+    try:
+        need = required_refs(args.columns)
+    except ValueError as e:
+        print(f"[ERROR] {e}")
+        sys.exit(1)
+
+    if not OUTPUT_FILE.exists():
+        print(f"[ERROR] Не найден файл: {OUTPUT_FILE}")
+        sys.exit(1)
+    if "july" in need and not SOURCE_FILE_JULY.exists():
+        print(f"[ERROR] Не найден файл: {SOURCE_FILE_JULY}")
+        sys.exit(1)
+
+    # справочники читаются, только если их использует хотя бы один нужный этап;
+    # все чтения независимы и запускаются сразу, каждый шаг ждёт только свой вход
+    reads = {"src": (read_source_sheet, OUTPUT_FILE)}
+    if need & {"ktr_map", "pkd_map"}:
+        reads["sheet1"] = (read_sheet1, OUTPUT_FILE)
+    if "july" in need:
+        reads["july"] = (load_july_reference, SOURCE_FILE_JULY)
+    with prefetch.prefetch(reads) as inputs:
+        df_src = inputs["src"].result()
+        df_sheet1 = inputs["sheet1"].result() if "sheet1" in inputs else None
+        # карты Sheet1 строятся, пока справочник ЭП июль ещё разбирается в другом процессе
+        refs = build_refs(df_src, df_sheet1, inputs["july"].result if "july" in inputs else routes.RouteIndex)
+    df_unique, stats = build_exp_pokaz(df_src, refs, partitioned=args.partitioned, workers=args.workers,
+                                       columns=args.columns)
+
+    if args.columns is not None:
+        df_subset = to_subset_frame(df_unique, args.columns)
+        SUBSET_FILE.parent.mkdir(parents=True, exist_ok=True)
+        df_subset.to_excel(SUBSET_FILE, sheet_name=TARGET_SHEET, index=False)
+        print(f"[OK] Колонки {args.columns} сохранены: {SUBSET_FILE} (строк={len(df_subset)})")
+        if args.export:
+            export_dir = args.export_dir or EXPORT_FOLDER
+            zip_path = export_dir / f"{SUBSET_FILE.stem}.zip" if args.zip else None
+            written = export.export_tables({TARGET_SHEET: df_subset}, export_dir, args.export,
+                                           split=args.split, workers=args.workers, zip_path=zip_path)
+            print(f"[OK] Выгрузка: файлов={len(written)}, папка {export_dir}")
+        return
+
+    write_target_sheet(df_unique, OUTPUT_FILE)
 
     print(f"[OK] Лист '{TARGET_SHEET}' создан/обновлён ✅")
-    print(f"[STATS] Заполнено: Длина маршрута={filled_len}, Выпуск={filled_vyp}, Рейсы произ.={filled_rei}, Водители={filled_vod}, КТР={filled_ktr}")
-    print(f"[STATS] Выпуск сумм. строк={filled_vyp_sum}, Рейсы сумм строк={filled_rei_sum}")
-    print(f"[STATS PKD] Выпус План ПКД={filled_plan_pkd}, Выпуск Факт ПКД={filled_fact_pkd}, Рейсы План ПКД={filled_plan_reis_pkd}, Рейсы Факт ПКД={filled_fact_reis_pkd}")
+
+    df_target = to_target_frame(df_unique)
+    try:
+        cube.write_cube(cube.build_cube(df_target), CUBE_FILE)
+        print(f"[OK] Куб план/факт сохранён: {CUBE_FILE}")
+    except Exception as e:
+        print(f"[WARN] Не удалось сохранить куб '{CUBE_FILE}': {e}")
+    try:
+        query.register_tables(DB_FILE, {"releases": df_sheet1, "kcsupt": df_src, "exp_pokaz": df_target})
+        print(f"[OK] Результаты загружены в базу запросов: {DB_FILE}")
+    except Exception as e:
+        print(f"[WARN] Не удалось обновить базу '{DB_FILE}': {e}")
+
+    try:
+        report = diagnostics.build_report(df_src, df_sheet1, refs, parse_key4)
+        diagnostics.print_report(report)
+        diagnostics.write_report(report, DIAG_FILE)
+        print(f"[OK] Диагностика ключей сохранена: {DIAG_FILE}")
+    except Exception as e:
+        print(f"[WARN] Не удалось построить диагностику ключей: {e}")
+
+    if args.export:
+        export_dir = args.export_dir or EXPORT_FOLDER
+        zip_path = export_dir / f"{OUTPUT_FILE.stem}.zip" if args.zip else None
+        written = export.export_tables({TARGET_SHEET: df_target, SOURCE_SHEET: df_src}, export_dir, args.export,
+                                       split=args.split, workers=args.workers, zip_path=zip_path)
+        print(f"[OK] Выгрузка: файлов={len(written)}, папка {export_dir}")
+
+    print(f"[STATS] Заполнено: Длина маршрута={stats['filled_len']}, Выпуск={stats['filled_vyp']}, Рейсы произ.={stats['filled_rei']}, Водители={stats['filled_vod']}, КТР={stats['filled_ktr']}")
+    print(f"[STATS] Выпуск сумм. строк={stats['filled_vyp_sum']}, Рейсы сумм строк={stats['filled_rei_sum']}")
+    print(f"[STATS PKD] Выпус План ПКД={stats['filled_plan_pkd']}, Выпуск Факт ПКД={stats['filled_fact_pkd']}, Рейсы План ПКД={stats['filled_plan_reis_pkd']}, Рейсы Факт ПКД={stats['filled_fact_reis_pkd']}")
 
 
 if __name__ == "__main__":
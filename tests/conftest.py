@@ -0,0 +1,90 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import routes  # noqa: E402
+import script3  # noqa: E402
+
+DATES = ["01.07.2025", "02.07.2025", "03.07.2025"]
+FILIALS = ["ФСЗ", "ФЮ", "ФЮЗ"]
+# латиница и кириллица вперемешку, пробелы и NBSP вокруг — всё это один маршрут после нормализации
+ROUTES = ["12", " 12 ", "С3", "C3", "т25", "T25", "700/гк", "м1\xa0"]
+SITES = ["Пл1", "Пл2"]
+
+
+def synthetic_kcsupt(rows: int = 600, seed: int = 0) -> pd.DataFrame:
+    """
+    Лист КСУПТ с неудобными ключами: пустые Дата / Филиал / Ключ 4 / Ключ 5,
+    лишние пробелы и NBSP, латиница вместо кириллицы, Ключ 5 без даты (общий для двух дат).
+    """
+    rng = np.random.default_rng(seed)
+    data = []
+    for _ in range(rows):
+        date, filial = rng.choice(DATES), rng.choice(FILIALS)
+        route, site = rng.choice(ROUTES), rng.choice(SITES)
+        kind = rng.choice(["Авт", "Эл"])
+        key4 = f"{date} {route} {filial} {kind}"
+        data.append({
+            "Дата": date,
+            "Маршрут": route,
+            "Филиал": filial,
+            "Авт/Эл": kind,
+            "Площадка": site,
+            "Ключ 2": f"{date} {route}",
+            "Ключ 4": key4,
+            "Ключ 5": f"{key4} {site}",
+            "Не ноль рейсов": rng.choice(["ПРАВДА", "ЛОЖЬ", "TRUE"]),
+            "Выход": int(rng.integers(1, 6)),
+            "Факт рейсов": int(rng.integers(0, 12)),
+        })
+    df = pd.DataFrame(data, dtype=object)
+
+    first_day = df.index[df["Дата"] == DATES[0]]
+    df.loc[first_day[:4], "Ключ 5"] = None
+    df.loc[first_day[4:7], "Ключ 4"] = None
+    df.loc[first_day[7:9], ["Ключ 4", "Ключ 5"]] = None
+    spaced = df.index[::11]
+    df.loc[spaced, "Ключ 4"] = " " + df.loc[spaced, "Ключ 4"].astype(str) + "\xa0"
+    df.loc[spaced, "Ключ 5"] = df.loc[spaced, "Ключ 5"].astype(str) + "  "
+    # один и тот же Ключ 5 без даты на второй и третий день одного филиала
+    undated = df.index[(df["Дата"] != DATES[0]) & (df["Филиал"] == FILIALS[1])][:4]
+    df.loc[undated, "Ключ 5"] = "12 ФЮ Авт Пл1"
+    df.loc[df.index[df["Дата"] == DATES[2]][:2], "Филиал"] = None
+    df.loc[df.index[df["Дата"] == DATES[1]][-2:], "Дата"] = None
+    return df
+
+
+def synthetic_refs(df_src: pd.DataFrame) -> dict:
+    """Справочники для расчёта: Sheet1 (КТР, ПКД) и ЭП июль по части ключей листа."""
+    keys4 = df_src["Ключ 4"].dropna().drop_duplicates().iloc[::2]
+    df_sheet1 = pd.DataFrame({
+        "Ключ 2": [" ".join(str(k).split()[:2]) for k in keys4],
+        "КТР": ["КТР" if i % 3 else "не КТР" for i in range(len(keys4))],
+        "ПланВыпуск": range(len(keys4)),
+        "ФактВыпуск": range(1, len(keys4) + 1),
+        "ПланРейсы": range(10, len(keys4) + 10),
+        "ФактРейсы": range(20, len(keys4) + 20),
+        "Ключ 4": keys4.to_numpy(),
+    }, dtype=object)
+
+    july = routes.RouteIndex()
+    for i, raw_key in enumerate(df_src["Ключ 4"].dropna().drop_duplicates().iloc[1::3]):
+        parsed = script3.parse_key4(raw_key)
+        july.add(parsed["key_norm"], parsed["date"], parsed["routes"],
+                 {"len": 10 + i, "vyp": 1 + i % 4, "reisy": 5 + i % 7, "vod": 2 + i % 3})
+    return script3.build_refs(df_src, df_sheet1, july)
+
+
+@pytest.fixture(scope="session")
+def kcsupt():
+    return synthetic_kcsupt()
+
+
+@pytest.fixture(scope="session")
+def refs(kcsupt):
+    return synthetic_refs(kcsupt)
@@ -0,0 +1,23 @@
+import numpy as np
+import pandas as pd
+
+import batch
+
+
+def test_sheet_frame_matches_excel_round_trip(tmp_path):
+    df = pd.DataFrame({
+        "Ключ 2": ["01.07.2025 12", "", None, "02.07.2025 С3"],
+        "ТипТС": ["Автобус", "", "Электробус", None],
+        "ПланВыпуск": [3.0, np.nan, 2.5, 10.0],
+        "Выход": [1, 2, 3, 4],
+        "Смешанная": ["7", 4.0, " a ", np.nan],
+    }, index=[5, 2, 9, 0])
+    path = tmp_path / "ЭП_итог.xlsx"
+    df.to_excel(path, index=False)
+
+    expected = pd.read_excel(path, dtype=object)
+    result = batch.sheet_frame(df)
+
+    pd.testing.assert_frame_equal(result, expected)
+    for col in df.columns:
+        assert [type(v) for v in result[col]] == [type(v) for v in expected[col]], col
@@ -0,0 +1,114 @@
+import json
+
+import pandas as pd
+import pytest
+
+import batch
+import checkpoint
+
+
+class Counter:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, stage, value):
+        def compute():
+            self.calls.append(stage)
+            return value
+        return compute
+
+
+def test_stage_is_skipped_on_second_run(tmp_path):
+    count = Counter()
+    df = pd.DataFrame({"a": [1, None, "x"]})
+
+    checkpoint.Checkpoints(tmp_path).run("stage", "fp1", count("stage", df))
+    result = checkpoint.Checkpoints(tmp_path, resume=True).run("stage", "fp1", count("stage", None))
+
+    assert count.calls == ["stage"]
+    pd.testing.assert_frame_equal(result, df)
+
+
+def test_changed_fingerprint_or_no_resume_recomputes(tmp_path):
+    count = Counter()
+    checkpoint.Checkpoints(tmp_path).run("stage", "fp1", count("stage", 1))
+
+    assert checkpoint.Checkpoints(tmp_path, resume=True).run("stage", "fp2", count("stage", 2)) == 2
+    assert checkpoint.Checkpoints(tmp_path, resume=False).run("stage", "fp2", count("stage", 3)) == 3
+    assert count.calls == ["stage"] * 3
+
+    manifest = json.loads((tmp_path / checkpoint.MANIFEST_NAME).read_text(encoding="utf-8"))
+    assert manifest["stage"]["fingerprint"] == "fp2"
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_corrupted_checkpoint_is_recomputed(tmp_path):
+    checkpoint.Checkpoints(tmp_path).run("stage", "fp1", lambda: 1)
+    (tmp_path / "stage.pkl").write_bytes(b"not a pickle")
+    assert checkpoint.Checkpoints(tmp_path, resume=True).run("stage", "fp1", lambda: 2) == 2
+
+
+def test_unreadable_manifest_starts_over(tmp_path):
+    checkpoint.Checkpoints(tmp_path).run("stage", "fp1", lambda: 1)
+    (tmp_path / checkpoint.MANIFEST_NAME).write_text("{", encoding="utf-8")
+    assert checkpoint.Checkpoints(tmp_path, resume=True).run("stage", "fp1", lambda: 2) == 2
+
+
+def test_fingerprint_follows_file_content(tmp_path):
+    path = tmp_path / "Выпуск 01.07.2025.xlsx"
+    path.write_bytes(b"one")
+    first = checkpoint.fingerprint("code", path)
+    assert checkpoint.fingerprint("code", path) == first
+
+    path.write_bytes(b"two")
+    assert checkpoint.fingerprint("code", path) != first
+    assert checkpoint.fingerprint("other code", path) != checkpoint.fingerprint("code", path)
+
+
+@pytest.fixture
+def parsed(monkeypatch):
+    calls = []
+
+    def process_release_file(path):
+        calls.append(path.name)
+        return pd.DataFrame({"Файл": [path.name], "Содержимое": [path.read_text(encoding="utf-8")]})
+
+    monkeypatch.setattr(batch.script1, "process_release_file", process_release_file)
+    return calls
+
+
+def _releases(folder, names):
+    for name in names:
+        (folder / name).write_text(name, encoding="utf-8")
+    return sorted(folder.glob("Выпуск *.xlsx"))
+
+
+def test_edited_release_is_the_only_one_reparsed(tmp_path, parsed):
+    points_dir = tmp_path / checkpoint.CHECKPOINT_SUBFOLDER
+    paths = _releases(tmp_path, ["Выпуск 01.07.2025.xlsx", "Выпуск 02.07.2025.xlsx", "Выпуск 03.07.2025.xlsx"])
+    batch.parse_releases(checkpoint.Checkpoints(points_dir), paths)
+    parsed.clear()
+
+    paths[1].write_text("исправлен", encoding="utf-8")
+    frames, _ = batch.parse_releases(checkpoint.Checkpoints(points_dir, resume=True), paths)
+
+    assert parsed == ["Выпуск 02.07.2025.xlsx"]
+    assert [f["Содержимое"].iloc[0] for f in frames] == ["Выпуск 01.07.2025.xlsx", "исправлен", "Выпуск 03.07.2025.xlsx"]
+
+
+def test_inserted_or_removed_release_does_not_shift_checkpoints(tmp_path, parsed):
+    points_dir = tmp_path / checkpoint.CHECKPOINT_SUBFOLDER
+    paths = _releases(tmp_path, ["Выпуск 02.07.2025.xlsx", "Выпуск 03.07.2025.xlsx"])
+    batch.parse_releases(checkpoint.Checkpoints(points_dir), paths)
+    parsed.clear()
+
+    # файл, который сортируется раньше остальных, не должен заставлять разбирать их заново
+    paths = _releases(tmp_path, ["Выпуск 01.07.2025.xlsx"])
+    batch.parse_releases(checkpoint.Checkpoints(points_dir, resume=True), paths)
+    assert parsed == ["Выпуск 01.07.2025.xlsx"]
+
+    parsed.clear()
+    paths[0].unlink()
+    frames, _ = batch.parse_releases(checkpoint.Checkpoints(points_dir, resume=True), paths[1:])
+    assert parsed == []
+    assert [f["Файл"].iloc[0] for f in frames] == ["Выпуск 02.07.2025.xlsx", "Выпуск 03.07.2025.xlsx"]
@@ -0,0 +1,66 @@
+import pandas as pd
+
+import diff
+
+
+def _frame(rows):
+    return pd.DataFrame(rows, columns=["Ключ 4", "Филиал", "Рейсы план", "Рейсы факт"])
+
+
+OLD = _frame([
+    ["01.07.2025 1 Ф Авт", "Ф1", 10, 9],
+    ["01.07.2025 2 Ф Авт", "Ф1", 20, 20],
+    ["01.07.2025 2 Ф Авт", "Ф1", 5, 5],
+    ["01.07.2025 3 Ф Эл", "Ф2", 7, 7],
+])
+
+
+def test_identical_frames_are_equal():
+    result = diff.diff_frames(OLD, OLD.copy())
+    assert result["key"] == "Ключ 4"
+    assert result["matched"] == len(OLD)
+    assert diff.is_equal(result)
+
+
+def test_added_removed_and_changed_rows():
+    new = _frame([
+        ["01.07.2025 1 Ф Авт", "Ф1", 10, 8],     # факт изменился
+        ["01.07.2025 2 Ф Авт", "Ф1", 20, 20],
+        ["01.07.2025 2 Ф Авт", "Ф3", 5, 5],      # второй дубль ключа: сменился филиал
+        ["01.07.2025 4 Ф Эл", "Ф2", 3, 3],       # новая строка; маршрут 3 удалён
+    ])
+    result = diff.diff_frames(OLD, new)
+
+    assert not diff.is_equal(result)
+    assert result["matched"] == 3
+    assert result["added"]["Ключ 4"].tolist() == ["01.07.2025 4 Ф Эл"]
+    assert result["removed"]["Ключ 4"].tolist() == ["01.07.2025 3 Ф Эл"]
+
+    summary = result["summary"].set_index("Колонка")
+    assert summary.loc["Рейсы факт", "Отличий"] == 1
+    assert summary.loc["Рейсы факт", "Сумма Δ"] == -1
+    assert summary.loc["Рейсы план", "Отличий"] == 0
+    assert summary.loc["Филиал", "Тип"] == "текст"
+
+    changes = result["changes"].set_index("Колонка")
+    assert changes.loc["Рейсы факт", ["Было", "Стало"]].tolist() == [9, 8]
+    assert changes.loc["Филиал", ["Ключ 4", "Было", "Стало"]].tolist() == ["01.07.2025 2 Ф Авт", "Ф1", "Ф3"]
+
+
+def test_numbers_within_tolerance_and_missing_values():
+    new = OLD.astype({"Рейсы факт": float}).copy()
+    new.loc[0, "Рейсы факт"] += 1e-12
+    new.loc[3, "Рейсы факт"] = None
+    result = diff.diff_frames(OLD, new)
+
+    changes = result["changes"]
+    assert len(changes) == 1
+    assert changes.iloc[0]["Ключ 4"] == "01.07.2025 3 Ф Эл"
+    assert pd.isna(changes.iloc[0]["Стало"])
+
+
+def test_only_columns_are_reported():
+    result = diff.diff_frames(OLD, OLD.drop(columns="Рейсы план").assign(Примечание=""))
+    assert result["only_old_cols"] == ["Рейсы план"]
+    assert result["only_new_cols"] == ["Примечание"]
+    assert not diff.is_equal(result)
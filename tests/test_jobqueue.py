@@ -0,0 +1,107 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import distributed
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Управляемое время очереди: аренда истекает, когда тест сдвигает часы."""
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(distributed, "time", SimpleNamespace(time=lambda: now.value, sleep=lambda s: None))
+    return now
+
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    q = distributed.JobQueue(tmp_path)
+    yield q
+    q.close()
+
+
+def _state(q, job_id):
+    return q.status().set_index("id").loc[job_id]
+
+
+def test_each_job_is_claimed_once(tmp_path, queue):
+    queue.put("a", "month", {"folder": "m07"})
+    queue.put("b", "month", {"folder": "m08"})
+
+    other = distributed.JobQueue(tmp_path)
+    try:
+        first, second = queue.claim("w1"), other.claim("w2")
+        assert [first["id"], second["id"]] == ["a", "b"]
+        assert first["payload"] == {"folder": "m07"} and first["attempt"] == 1
+        assert queue.claim("w3") is None
+    finally:
+        other.close()
+    assert queue.counts() == {distributed.RUNNING: 2}
+
+
+def test_expired_lease_is_reclaimed(queue, clock):
+    queue.put("a", "month", {})
+    queue.claim("w1")
+
+    clock.value += distributed.LEASE_SECONDS - 1
+    assert queue.claim("w2") is None
+
+    clock.value += 2
+    job = queue.claim("w2")
+    assert job["id"] == "a" and job["attempt"] == 2
+    # старый владелец аренду потерял и результат записать не может
+    assert not queue.heartbeat("a", "w1")
+    assert not queue.complete("a", "w1", {"rows": 1})
+    assert _state(queue, "a")["owner"] == "w2"
+
+
+def test_heartbeat_extends_lease(queue, clock):
+    queue.put("a", "month", {})
+    queue.claim("w1")
+
+    for _ in range(3):
+        clock.value += distributed.LEASE_SECONDS - 1
+        assert queue.heartbeat("a", "w1")
+        assert queue.claim("w2") is None
+
+    assert queue.complete("a", "w1", {"months": ["2025-07"]})
+    row = _state(queue, "a")
+    assert row["state"] == distributed.DONE
+    assert json.loads(row["result"]) == {"months": ["2025-07"]}
+    assert not queue.heartbeat("a", "w1")
+
+
+def test_other_worker_cannot_update_job(queue):
+    queue.put("a", "month", {})
+    queue.claim("w1")
+
+    assert not queue.heartbeat("a", "w2")
+    assert not queue.complete("a", "w2", {})
+    assert not queue.fail("a", "w2", "ошибка")
+    assert _state(queue, "a")["state"] == distributed.RUNNING
+
+
+def test_failed_job_is_retried_until_max_attempts(queue):
+    queue.put("a", "month", {})
+
+    for attempt in range(1, distributed.MAX_ATTEMPTS + 1):
+        job = queue.claim(f"w{attempt}")
+        assert job["attempt"] == attempt
+        assert queue.fail("a", f"w{attempt}", f"ошибка {attempt}")
+
+    row = _state(queue, "a")
+    assert row["state"] == distributed.FAILED
+    assert row["error"] == f"ошибка {distributed.MAX_ATTEMPTS}"
+    assert queue.claim("w0") is None
+
+
+def test_lost_lease_counts_as_attempt(queue, clock):
+    queue.put("a", "month", {})
+    for _ in range(distributed.MAX_ATTEMPTS):
+        assert queue.claim("w") is not None
+        clock.value += distributed.LEASE_SECONDS + 1
+
+    assert queue.claim("w") is None
+    row = _state(queue, "a")
+    assert row["state"] == distributed.FAILED and row["error"] == "аренда истекла"
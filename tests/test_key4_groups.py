@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+
+import script3
+
+# ---- Дубляж и суммы по Ключ 4 до _Key4Groups: value_counts, transform и merge ----
+
+
+def old_dub(df):
+    norm_k4 = df["Ключ 4"].apply(script3._normalize_key4_value)
+    counts_k4 = norm_k4.value_counts()
+    return norm_k4.map(lambda x: 0 if counts_k4.get(x, 0) == 1 else 1)
+
+
+def old_sum(df, col):
+    return df.fillna({col: 0}).groupby("Ключ 4")[col].transform("sum")
+
+
+def old_match(df):
+    corr_cols = [corr_col for _, corr_col in script3.MATCH_COLS.values()]
+    sums_corr = df.groupby("Ключ 4").agg({c: "sum" for c in corr_cols}).rename(columns=lambda c: f"sum {c}")
+    merged = df.merge(sums_corr, how="left", left_on="Ключ 4", right_index=True)
+    return {match_col: merged.fillna({pkd_col: 0, f"sum {corr_col}": 0})[pkd_col] - merged[f"sum {corr_col}"]
+            for match_col, (pkd_col, corr_col) in script3.MATCH_COLS.items()}
+
+
+# ---------------------------------------------------------------------------------
+
+
+def _frame(kcsupt, refs):
+    df_unique, _ = script3.compute_exp_pokaz(kcsupt, refs)
+    # часть строк без Выпуск — суммы должны считать их нулями
+    df_unique.loc[df_unique.index[::5], "Выпуск"] = np.nan
+    return df_unique
+
+
+def test_dub_matches_old(kcsupt, refs):
+    df = _frame(kcsupt, refs)
+    assert df["Ключ 4"].isna().any()
+    groups = script3._Key4Groups(df["Ключ 4"])
+    pd.testing.assert_series_equal(groups.dub, old_dub(df), check_dtype=False, check_names=False)
+
+
+def test_sums_match_old(kcsupt, refs):
+    df = _frame(kcsupt, refs)
+    groups = script3._Key4Groups(df["Ключ 4"])
+    sums = groups.sum({
+        "Выпуск": df["Выпуск"].fillna(0),
+        "Количество рейсов произ.": df["Количество рейсов произ."].fillna(0),
+    })
+    for col, values in sums.items():
+        expected = old_sum(df, col).reindex(df.index)
+        pd.testing.assert_series_equal(values, expected, check_dtype=False, check_names=False)
+
+
+def test_match_columns_match_old(kcsupt, refs):
+    df, _ = script3.compute_exp_pokaz(kcsupt, refs)
+    for match_col, expected in old_match(df).items():
+        pd.testing.assert_series_equal(df[match_col], expected.reindex(df.index), check_dtype=False, check_names=False)
+
+
+def test_without_keys():
+    groups = script3._Key4Groups(pd.Series([None, np.nan], dtype=object))
+    assert groups.dub.tolist() == [1, 1]
+    assert groups.sum({"x": pd.Series([1.0, 2.0])})["x"].isna().all()
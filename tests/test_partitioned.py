@@ -0,0 +1,34 @@
+import pandas as pd
+
+import script3
+
+
+def test_partitioned_matches_sequential_with_nan_keys(kcsupt, refs):
+    expected, expected_stats = script3.compute_exp_pokaz(kcsupt, refs)
+    result, stats = script3.compute_exp_pokaz_partitioned(kcsupt, refs, workers=2)
+
+    pd.testing.assert_frame_equal(result, expected)
+    assert stats == expected_stats
+
+
+def test_split_partitions_keeps_shared_keys_together(kcsupt):
+    parts = script3.split_partitions(kcsupt)
+
+    assert len(parts) > 1
+    assert sum(len(p) for p in parts) == len(kcsupt)
+    for col in ["Ключ 4", "Ключ 5"]:
+        owner = {}
+        for i, part in enumerate(parts):
+            for key in part[col].map(script3._normalize_key4_value).unique():
+                assert owner.setdefault(key, i) == i, f"{col} '{key}' в разных партициях"
+
+
+def test_split_partitions_puts_empty_keys_in_one_partition(kcsupt):
+    parts = script3.split_partitions(kcsupt)
+    for cols in [script3.PARTITION_COLS, ["Ключ 4"], ["Ключ 5"]]:
+        with_empty = [p for p in parts if p[cols].isna().any(axis=None)]
+        assert len(with_empty) == 1, cols
+
+
+def test_split_partitions_without_partition_columns():
+    assert script3.split_partitions(pd.DataFrame({"Ключ 5": ["a"]})) is None
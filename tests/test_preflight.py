@@ -0,0 +1,45 @@
+import pandas as pd
+
+import preflight
+import script3
+
+
+def _write_result(path, kcsupt_columns):
+    with pd.ExcelWriter(path) as writer:
+        pd.DataFrame(columns=preflight.RESULT_SHEETS["Sheet1"]).to_excel(writer, sheet_name="Sheet1", index=False)
+        pd.DataFrame(columns=kcsupt_columns).to_excel(writer, sheet_name=script3.SOURCE_SHEET, index=False)
+
+
+def _levels(problems):
+    return [p["Уровень"] for p in problems]
+
+
+def test_result_without_exit_column_is_a_warning(tmp_path):
+    path = tmp_path / "ЭП_итог.xlsx"
+    _write_result(path, preflight.RESULT_SHEETS[script3.SOURCE_SHEET])
+
+    problems = preflight.check_result(path)
+    assert _levels(problems) == [preflight.WARN]
+    assert "Выход" in problems[0]["Проверка"]
+
+
+def test_result_missing_required_column_is_an_error(tmp_path):
+    path = tmp_path / "ЭП_итог.xlsx"
+    _write_result(path, ["Ключ 4", "Ключ 5", "Выход"])
+
+    assert _levels(preflight.check_result(path)) == [preflight.ERROR]
+
+
+def test_open_workbook_is_detected_by_lock_file(tmp_path):
+    path = tmp_path / "ЭП_итог.xlsx"
+    _write_result(path, preflight.RESULT_SHEETS[script3.SOURCE_SHEET] + ["Выход"])
+    assert preflight.check_result(path, sheets=False) == []
+
+    (tmp_path / "~$ЭП_итог.xlsx").write_bytes(b"")
+    problems = preflight.check_result(path, sheets=False)
+    assert _levels(problems) == [preflight.ERROR]
+    assert "~$ЭП_итог.xlsx" in problems[0]["Проверка"]
+
+
+def test_missing_result_is_fine_before_the_first_run(tmp_path):
+    assert preflight._probe(("result", tmp_path / "ЭП_итог.xlsx")) == []
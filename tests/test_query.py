@@ -0,0 +1,56 @@
+import pandas as pd
+
+import query
+
+
+def _exp_pokaz(dates, routes=("Е10", "15к")):
+    rows = [{"Дата": d, "Маршрут": r, "Филиал": "Ф1", "Корр. Рейсы Факт": i}
+            for i, d in enumerate(dates) for r in routes]
+    return pd.DataFrame(rows)
+
+
+JULY = ["01.07.2025", "02.07.2025", "03.07.2025"]
+AUGUST = ["01.08.2025", "02.08.2025"]
+
+
+def _dates(df):
+    return df["Дата"].tolist()
+
+
+def test_route_history_over_two_months(tmp_path):
+    db = tmp_path / "ЭП.sqlite"
+    query.register_tables(db, {"exp_pokaz": _exp_pokaz(JULY)})
+    query.register_tables(db, {"exp_pokaz": _exp_pokaz(AUGUST)})
+
+    assert _dates(query.route_history("e10", db_file=db)) == JULY + AUGUST
+    assert _dates(query.route_history("Е10", "02.07.2025", "01.08.2025", db_file=db)) == JULY[1:] + AUGUST[:1]
+    assert _dates(query.route_history("15К", date_from="2025-08-02", db_file=db)) == AUGUST[1:]
+    assert query.route_history("999", db_file=db).empty
+
+    tables = query.list_tables(db).set_index("Таблица")
+    assert tables.loc["exp_pokaz", "Строк"] == 2 * (len(JULY) + len(AUGUST))
+    assert tables.loc["exp_pokaz", "Месяцы"] == "2025-07, 2025-08"
+
+
+def test_partial_reregister_replaces_only_its_dates(tmp_path):
+    db = tmp_path / "ЭП.sqlite"
+    query.register_tables(db, {"exp_pokaz": _exp_pokaz(JULY)})
+    query.register_tables(db, {"exp_pokaz": _exp_pokaz(AUGUST)})
+
+    update = _exp_pokaz(JULY[:1]).assign(**{"Корр. Рейсы Факт": 100})
+    query.register_tables(db, {"exp_pokaz": update})
+
+    history = query.route_history("Е10", db_file=db)
+    assert _dates(history) == JULY + AUGUST
+    assert history["Корр. Рейсы Факт"].tolist() == [100, 1, 2, 0, 1]
+    count = query.run_query("SELECT COUNT(*) AS n FROM exp_pokaz", db_file=db)["n"].iloc[0]
+    assert count == 2 * (len(JULY) + len(AUGUST))
+
+
+def test_whole_month_reregister_drops_missing_days(tmp_path):
+    db = tmp_path / "ЭП.sqlite"
+    query.register_tables(db, {"exp_pokaz": _exp_pokaz(JULY)})
+    query.register_tables(db, {"exp_pokaz": _exp_pokaz(AUGUST)})
+
+    query.register_tables(db, {"exp_pokaz": _exp_pokaz(JULY[:2])}, whole_months=True)
+    assert _dates(query.route_history("Е10", db_file=db)) == JULY[:2] + AUGUST
@@ -0,0 +1,129 @@
+import re
+
+import pandas as pd
+import pytest
+
+import routes
+import script3
+from conftest import DATES, FILIALS, ROUTES
+
+# ---- поиск по справочнику ЭП июль до routes.py: три словаря и варианты написания ----
+LAT_TO_CYR = routes.LAT_TO_CYR
+CYR_TO_LAT = {v: k for k, v in LAT_TO_CYR.items()}
+
+
+def old_route_candidates(cell_value):
+    if pd.isna(cell_value):
+        return []
+    s = str(cell_value).strip()
+    if not s:
+        return []
+    candidates = []
+    for t in re.split(r'[^0-9A-Za-zА-Яа-яЁё\-]+', s):
+        t = t.strip()
+        if not t or not re.search(r'\d', t):
+            continue
+        t_clean = re.sub(r'\-+', '-', t.upper()).strip('-')
+        candidates.append(t_clean)
+        cand_lat_to_cyr = "".join(LAT_TO_CYR.get(ch, ch) for ch in t_clean)
+        cand_cyr_to_lat = "".join(CYR_TO_LAT.get(ch, ch) for ch in t_clean)
+        if cand_lat_to_cyr != t_clean:
+            candidates.append(cand_lat_to_cyr)
+        if cand_cyr_to_lat != t_clean:
+            candidates.append(cand_cyr_to_lat)
+    seen, out = set(), []
+    for c in candidates:
+        if c not in seen and c:
+            seen.add(c)
+            out.append(c)
+    return out
+
+
+def old_parse(name_cell, route_cell):
+    return script3.build_key_parts_from_name_and_route(name_cell, route_cell, route_cands=old_route_candidates(route_cell))
+
+
+def old_reference(rows):
+    exact_map, date_route_map, route_map = {}, {}, {}
+    for name_cell, route_cell, entry in rows:
+        parsed = old_parse(name_cell, route_cell)
+        if parsed["key_norm"] and parsed["key_norm"] not in exact_map:
+            exact_map[parsed["key_norm"]] = entry
+        for r in parsed["routes"]:
+            if parsed["date"]:
+                date_route_map.setdefault((parsed["date"], r), entry)
+            route_map.setdefault(r, entry)
+    return exact_map, date_route_map, route_map
+
+
+def old_lookup(parsed, ref):
+    exact_map, date_route_map, route_map = ref
+    if parsed.get("key_norm") and parsed["key_norm"] in exact_map:
+        return exact_map[parsed["key_norm"]]
+    if parsed.get("date"):
+        for r in parsed.get("routes", []):
+            if (parsed["date"], r) in date_route_map:
+                return date_route_map[(parsed["date"], r)]
+    for r in parsed.get("routes", []):
+        if r in route_map:
+            return route_map[r]
+    return None
+
+
+def canonical_key(raw_key):
+    """Ключ, в котором маршруты уже записаны канонически (кириллицей)."""
+    if not isinstance(raw_key, str):
+        return raw_key
+    return routes.ROUTE_TOKEN_RE.sub(lambda m: routes.canonical_token(m.group(0)), raw_key)
+
+
+# ---------------------------------------------------------------------------------
+
+CELLS = ["С3", "C3", " c-3 ", "т25", "T25", "700/гк", "м1\xa0", "12, 12А", "№ 5--К", "", None, float("nan"), 42]
+
+
+def _dedup(values):
+    out = []
+    for v in values:
+        if v not in out:
+            out.append(v)
+    return out
+
+
+@pytest.mark.parametrize("cell", CELLS)
+def test_route_candidates_are_canonical_old_candidates(cell):
+    assert routes.route_candidates(cell) == _dedup(routes.canonical_token(c) for c in old_route_candidates(cell))
+
+
+def test_route_candidates_series_matches_scalar(kcsupt):
+    series = pd.concat([kcsupt["Ключ 4"], kcsupt["Маршрут"], pd.Series(CELLS, dtype=object)], ignore_index=True)
+    assert routes.route_candidates_series(series).tolist() == [routes.route_candidates(v) for v in series]
+
+
+def test_normalize_route_series_matches_scalar(kcsupt):
+    series = pd.concat([kcsupt["Маршрут"], pd.Series(["Т25_", "A1/ГК-2", " С3 "])], ignore_index=True)
+    assert routes.normalize_route_series(series).tolist() == [routes.normalize_route(v) for v in series]
+    assert routes.normalize_route("C3") == routes.normalize_route("с3")
+
+
+def test_route_index_matches_old_lookup(kcsupt):
+    # справочник записан кириллицей, как ЭП июль; в ключах листа — латиница, пробелы, NBSP и пустые значения
+    rows = []
+    for i, (date, filial, route) in enumerate((d, f, r) for d in DATES for f in FILIALS for r in ROUTES[::2]):
+        entry = {"len": i, "vyp": i + 1, "reisy": i + 2, "vod": i + 3}
+        rows.append((f"{date} {filial} (авт)", route, entry))
+    rows.append(("без даты", "99", {"len": -1, "vyp": -1, "reisy": -1, "vod": -1}))
+
+    index = routes.RouteIndex()
+    for name_cell, route_cell, entry in rows:
+        parsed = script3.build_key_parts_from_name_and_route(name_cell, route_cell)
+        index.add(parsed["key_norm"], parsed["date"], parsed["routes"], entry)
+    old_ref = old_reference(rows)
+
+    keys = kcsupt["Ключ 4"].tolist() + [f"{DATES[0]} 99 ФЮ Авт", "C3", None]
+    for raw_key in keys:
+        new = script3.find_values_for_parsed(script3.parse_key4(raw_key), index)
+        canonical = canonical_key(raw_key)
+        old = old_lookup(old_parse(canonical if isinstance(canonical, str) else None, canonical), old_ref)
+        expected = (None,) * 4 if old is None else (old["len"], old["vyp"], old["reisy"], old["vod"])
+        assert new == expected, raw_key
@@ -0,0 +1,37 @@
+import pandas as pd
+import pytest
+
+import script3
+
+SUBSETS = [[col] for stage in script3.STAGES.values() for col in stage["columns"]] + [
+    ["Дубляж", "КТР"],
+    ["Совпадение факта рейсов", "Рейсы факт КСУПТ"],
+    ["Дата", "Маршрут", "Ключ 5"],
+]
+
+
+@pytest.fixture(scope="module")
+def full(kcsupt, refs):
+    return script3.compute_exp_pokaz(kcsupt, refs)
+
+
+@pytest.mark.parametrize("columns", SUBSETS, ids=lambda cols: "+".join(cols))
+def test_subset_matches_full_compute(kcsupt, refs, full, columns):
+    expected, expected_stats = full
+    result, stats = script3.compute_exp_pokaz(kcsupt, refs, columns)
+
+    cols = script3.SUBSET_KEY_COLS + [c for c in columns if c not in script3.SUBSET_KEY_COLS]
+    pd.testing.assert_frame_equal(result[cols], expected[cols])
+    assert stats["removed"] == expected_stats["removed"]
+
+
+def test_subset_skips_unrelated_stages():
+    assert script3.required_stages(["КТР"]) == ["ktr"]
+    assert script3.required_stages(["Совпадение плана выпуска"]) == ["july", "pkd", "sums", "corr", "match"]
+    assert script3.required_refs(["Рейсы факт КСУПТ"]) == set()
+    assert script3.required_stages(None) == list(script3.STAGES)
+
+
+def test_unknown_column():
+    with pytest.raises(ValueError):
+        script3.required_stages(["Нет такой колонки"])
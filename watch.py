@@ -0,0 +1,258 @@
+import sys
+import json
+import time
+import zipfile
+import argparse
+from pathlib import Path
+import pandas as pd
+
+import script1
+
+# =====================
+# НАСТРОЙКИ / ПУТИ
+# =====================
+SOURCE_FOLDER = script1.SOURCE_FOLDER
+OUTPUT_FILE = script1.OUTPUT_FILE
+CACHE_FOLDER = script1.OUTPUT_FOLDER / "watch_cache"
+STATE_FILE = CACHE_FOLDER / "state.json"
+RELEASES_SHEET = "Sheet1"
+
+POLL_INTERVAL = 5.0     # сек между сканированиями папки
+SETTLE_SECONDS = 10.0   # файл считается дописанным, если размер и mtime не менялись столько секунд
+# после обновления выпусков пересчитать КСУПТ, ЭкспПоказ и куб (batch.process_month с контрольными точками);
+# False — обновляется только лист выпусков, остальное остаётся устаревшим до запуска batch.py
+CHAIN = True
+# =====================
+
+
+def is_file_complete(path: Path) -> bool:
+    """xlsx — это zip: пока файл дописывается, центрального каталога в конце ещё нет."""
+    try:
+        if path.suffix.lower() in (".xlsx", ".xlsm"):
+            return zipfile.is_zipfile(path)
+        with open(path, "rb"):
+            return True
+    except OSError:
+        return False
+
+
+def file_signature(path: Path):
+    st = path.stat()
+    return [st.st_size, st.st_mtime_ns]
+
+
+def load_state(state_file: Path) -> dict:
+    if state_file.exists():
+        try:
+            return json.loads(state_file.read_text(encoding="utf-8"))
+        except Exception as e:
+            print(f"[WARN] Не удалось прочитать состояние {state_file}: {e}. Начинаю заново.")
+    return {}
+
+
+def save_state(state_file: Path, state: dict):
+    state_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp = state_file.with_suffix(".tmp")
+    tmp.write_text(json.dumps(state, ensure_ascii=False, indent=1), encoding="utf-8")
+    tmp.replace(state_file)
+
+
+def cache_path(cache_folder: Path, file_name: str) -> Path:
+    return cache_folder / f"{Path(file_name).stem}.parquet"
+
+
+def write_releases_sheet(df: pd.DataFrame, output_file: Path):
+    """Обновляет только лист выпусков, остальные листы ЭП_итог.xlsx остаются на месте."""
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    if output_file.exists():
+        with pd.ExcelWriter(output_file, engine="openpyxl", mode="a", if_sheet_exists="replace") as writer:
+            df.to_excel(writer, sheet_name=RELEASES_SHEET, index=False)
+    else:
+        df.to_excel(output_file, sheet_name=RELEASES_SHEET, index=False)
+
+
+def rebuild_result(cache_folder: Path, state: dict, output_file: Path) -> int:
+    frames = []
+    for name in sorted(state):
+        path = cache_path(cache_folder, name)
+        if path.exists():
+            frames.append(pd.read_parquet(path))
+    df_releases = script1.finalize_releases(frames)
+    if df_releases.empty:
+        print("[WARN] Нет данных для записи — результат не обновлён")
+        return 0
+    write_releases_sheet(df_releases, output_file)
+    return len(df_releases)
+
+
+class ReleaseWatcher:
+    """
+    Опрашивает папку выпусков и обрабатывает каждый новый или изменённый файл,
+    как только он дописан. Если в папке есть всё для цепочки batch.py, пересчёт
+    идёт ею (контрольные точки по файлам); иначе разобранные файлы кешируются
+    по одному и лист выпусков — это склейка кеша, а не повторный разбор всех файлов.
+    """
+
+    def __init__(self, source_folder: Path, output_file: Path, cache_folder: Path,
+                 settle_seconds: float = SETTLE_SECONDS, chain: bool = CHAIN):
+        self.source_folder = source_folder
+        self.output_file = output_file
+        self.cache_folder = cache_folder
+        self.state_file = cache_folder / STATE_FILE.name
+        self.settle_seconds = settle_seconds
+        self.chain = chain
+        self.state = load_state(self.state_file)
+        self.pending = {}  # имя -> (подпись, момент, с которого подпись не меняется)
+        self.removed = False  # удаление файла ещё не отражено в результате
+
+    def scan(self) -> tuple:
+        now = time.monotonic()
+        seen, ready = set(), []
+        for path in sorted(self.source_folder.glob(script1.RELEASE_GLOB)):
+            if path.name.startswith("~$"):
+                continue
+            seen.add(path.name)
+            try:
+                sig = file_signature(path)
+            except OSError:
+                continue
+            if self.state.get(path.name) == sig:
+                self.pending.pop(path.name, None)
+                continue
+            prev = self.pending.get(path.name)
+            if prev is None or prev[0] != sig:
+                self.pending[path.name] = (sig, now)
+                continue
+            if now - prev[1] >= self.settle_seconds and is_file_complete(path):
+                ready.append(path)
+
+        removed = [name for name in self.state if name not in seen]
+        for name in removed:
+            del self.state[name]
+            cache_path(self.cache_folder, name).unlink(missing_ok=True)
+            print(f"[INFO] Файл удалён из папки: {name}")
+        for name in [n for n in self.pending if n not in seen]:
+            del self.pending[name]
+        return ready, bool(removed)
+
+    def process(self, files: list):
+        self.cache_folder.mkdir(parents=True, exist_ok=True)
+        for path in files:
+            sig = self.pending.pop(path.name)[0] if path.name in self.pending else file_signature(path)
+            df_part = script1.process_release_file(path)
+            if df_part.empty:
+                print(f"[WARN] {path.name}: данных не найдено")
+                cache_path(self.cache_folder, path.name).unlink(missing_ok=True)
+            else:
+                df_part.to_parquet(cache_path(self.cache_folder, path.name), index=False)
+                print(f"[OK] {path.name}: строк={len(df_part)}")
+            self.state[path.name] = sig
+
+    def uncached(self) -> list:
+        """Учтённые файлы без кеша наблюдателя (их разбирала цепочка) — для склейки их нужно разобрать."""
+        paths = [self.source_folder / name for name in sorted(self.state)
+                 if not cache_path(self.cache_folder, name).exists()]
+        return [p for p in paths if p.exists()]
+
+    def step(self) -> bool:
+        ready, removed = self.scan()
+        self.removed = self.removed or removed
+        if not ready and not self.removed:
+            return False
+        if self.chain_ready():
+            if any(name not in {p.name for p in ready} for name in self.pending):
+                # цепочка читает все файлы папки — ждём, пока допишутся остальные
+                return False
+            if self.run_chain(ready):
+                self.removed = False
+                return True
+        self.process(ready + [p for p in self.uncached() if p not in ready])
+        rows = rebuild_result(self.cache_folder, self.state, self.output_file)
+        save_state(self.state_file, self.state)
+        self.removed = False
+        print(f"[OK] Результат обновлён: {self.output_file} (строк={rows}, файлов={len(self.state)})")
+        if rows and not self.chain:
+            print(f"[WARN] Обновлён только лист '{RELEASES_SHEET}': {self.stale()} — "
+                  f"запустите batch.py --resume {self.source_folder}")
+        return True
+
+    def stale(self) -> str:
+        import batch
+        return (f"листы '{batch.script2.SHEET_NAME}', '{batch.script3.TARGET_SHEET}' и куб "
+                f"в {self.output_file.name} устарели")
+
+    def chain_ready(self) -> bool:
+        """Можно ли обновить всё цепочкой batch.py; если нет — почему (производные листы устареют)."""
+        import batch
+
+        if not self.chain:
+            return False
+        try:
+            inputs = batch.resolve_month_inputs(self.source_folder)
+        except FileNotFoundError as e:
+            print(f"[WARN] {e}: {self.stale()}")
+            return False
+        if inputs["output"].resolve() != self.output_file.resolve():
+            print(f"[WARN] Цепочка пишет в {inputs['output']}, а не в {self.output_file}: {self.stale()}")
+            return False
+        return True
+
+    def run_chain(self, ready: list) -> bool:
+        """
+        Выпуски, КСУПТ, ЭкспПоказ и куб пересчитываются одной цепочкой batch.py
+        (resume: заново разбираются только изменённые файлы, остальное берётся из контрольных точек).
+        Собственный разбор наблюдателя не нужен; при ошибке состояние не меняется.
+        """
+        import batch
+
+        try:
+            res = batch.process_month(self.source_folder, None, resume=True)
+        except Exception as e:
+            print(f"[ERROR] Не удалось пересчитать цепочку: {e}. Обновляю только лист '{RELEASES_SHEET}', {self.stale()}")
+            return False
+        for path in ready:
+            self.state[path.name] = self.pending.pop(path.name)[0]
+            # кеш наблюдателя для этого файла устарел — разбор лежит в контрольных точках цепочки
+            cache_path(self.cache_folder, path.name).unlink(missing_ok=True)
+        save_state(self.state_file, self.state)
+        rows = ", ".join(f"{t}={n}" for t, n in res["rows"].items())
+        print(f"[OK] Цепочка пересчитана: {self.output_file} ({rows}, файлов={len(self.state)})")
+        return True
+
+    def run(self, interval: float = POLL_INTERVAL, once: bool = False):
+        print(f"[INFO] Слежу за {self.source_folder} (опрос каждые {interval} с, ожидание дозаписи {self.settle_seconds} с)")
+        try:
+            while True:
+                self.step()
+                if once and not self.pending:
+                    break
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            print("[INFO] Остановлено пользователем")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Слежение за папкой выпусков и инкрементальное обновление ЭП_итог.xlsx")
+    parser.add_argument("--folder", type=Path, default=SOURCE_FOLDER, help="папка с файлами 'Выпуск DD.MM.YYYY.xlsx'")
+    parser.add_argument("--output", type=Path, default=OUTPUT_FILE, help="итоговый файл ЭП_итог.xlsx")
+    parser.add_argument("--cache", type=Path, default=CACHE_FOLDER, help="папка кеша разобранных файлов")
+    parser.add_argument("--interval", type=float, default=POLL_INTERVAL, help="период опроса, сек")
+    parser.add_argument("--settle", type=float, default=SETTLE_SECONDS, help="сколько секунд файл не должен меняться")
+    parser.add_argument("--once", action="store_true", help="обработать то, что уже лежит в папке, и выйти")
+    parser.add_argument("--no-chain", action="store_true",
+                        help="обновлять только лист выпусков, без пересчёта КСУПТ, ЭкспПоказ и куба")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.folder.exists():
+        print("[ERROR] No source folder:", args.folder)
+        sys.exit(1)
+    watcher = ReleaseWatcher(args.folder, args.output, args.cache, settle_seconds=args.settle,
+                             chain=CHAIN and not args.no_chain)
+    watcher.run(interval=args.interval, once=args.once)
+
+
+if __name__ == "__main__":
+    main()